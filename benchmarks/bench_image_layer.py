@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of easydms.
+# Copyright (c) 2016 Peter Kessen
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject
+# to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+# OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4
+
+"""Measure peak memory of building the image layer of one page
+
+A page image of the given size is written as PNG, then turned into a one
+page PDF by easydms.imagepdf and, if installed, by img2pdf, each in a
+fresh python process. For reference, 'read' only reads the image file
+into memory. The peak resident set size of that process above
+its size after the imports is reported along with the time taken.
+
+Usage: python benchmarks/bench_image_layer.py [--dpi DPI] [--gray]
+                                              [--limit MB]
+"""
+
+import argparse
+import os
+import struct
+import subprocess
+import sys
+import tempfile
+import zlib
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# A4 in inches
+PAGE_SIZE = (8.27, 11.69)
+
+# 'read' only does what select_image_layer did before calling img2pdf
+CONVERTERS = {
+    'read': (
+        '',
+        'rawdata = open(image, "rb").read()'),
+    'imagepdf': (
+        'import easydms.imagepdf',
+        'easydms.imagepdf.convert(image, output, (dpi, dpi))'),
+    'img2pdf': (
+        'import img2pdf',
+        'rawdata = open(image, "rb").read()\n'
+        'img2pdf.convert(rawdata, with_pdfrw=False, outputstream='
+        'open(output, "wb"),\n'
+        '    layout_fun=img2pdf.get_fixed_dpi_layout_fun((dpi, dpi)))'),
+}
+
+MEASURE = '''
+import resource, sys, time
+{import_statement}
+image, output, dpi = sys.argv[1], sys.argv[2], float(sys.argv[3])
+before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+start = time.perf_counter()
+{statement}
+elapsed = time.perf_counter() - start
+after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+print(after - before, elapsed)
+'''
+
+
+def png_chunk(kind, data):
+    return struct.pack('>I4s', len(data), kind) + data + \
+        struct.pack('>I', zlib.crc32(kind + data) & 0xffffffff)
+
+
+def write_page_png(path, width, height, colors):
+    """Write a noisy page image row by row, so it hardly compresses"""
+    compressor = zlib.compressobj(1)
+    color_type = 2 if colors == 3 else 0
+    with open(path, 'wb') as f:
+        f.write(b'\x89PNG\r\n\x1a\n')
+        f.write(png_chunk(b'IHDR', struct.pack(
+            '>IIBBBBB', width, height, 8, color_type, 0, 0, 0)))
+        for _ in range(height):
+            row = b'\0' + os.urandom(width * colors)
+            data = compressor.compress(row)
+            if data:
+                f.write(png_chunk(b'IDAT', data))
+        f.write(png_chunk(b'IDAT', compressor.flush()))
+        f.write(png_chunk(b'IEND', b''))
+
+
+def measure(name, image, output, dpi):
+    import_statement, statement = CONVERTERS[name]
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(
+        [ROOT] + ([env['PYTHONPATH']] if env.get('PYTHONPATH') else []))
+    code = MEASURE.format(
+        import_statement=import_statement, statement=statement)
+    result = subprocess.run(
+        [sys.executable, '-c', code, image, output, str(dpi)],
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=env,
+        universal_newlines=True)
+    if result.returncode != 0:
+        return None
+    rss, elapsed = result.stdout.split()
+    # ru_maxrss is in kilobytes on Linux
+    return int(rss) / 1024, float(elapsed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--dpi', type=int, default=600)
+    parser.add_argument('--gray', action='store_true',
+                        help="measure a grayscale instead of a color page")
+    parser.add_argument('--limit', type=float, default=None,
+                        help="exit non-zero if imagepdf needs more than this "
+                             "many MB")
+    args = parser.parse_args()
+
+    width = int(PAGE_SIZE[0] * args.dpi)
+    height = int(PAGE_SIZE[1] * args.dpi)
+    colors = 1 if args.gray else 3
+    with tempfile.TemporaryDirectory() as tmpdir:
+        image = os.path.join(tmpdir, 'page.png')
+        write_page_png(image, width, height, colors)
+        print("Page image: {0}x{1} px, {2:.1f} MB".format(
+            width, height, os.path.getsize(image) / 1000000))
+        print("{0:<12} {1:>12} {2:>10}".format('converter', 'peak RSS',
+                                               'time'))
+        results = {}
+        for name in sorted(CONVERTERS):
+            output = os.path.join(tmpdir, name + '.pdf')
+            results[name] = measure(name, image, output, args.dpi)
+            if results[name] is None:
+                print("{0:<12} {1:>12}".format(name, 'unavailable'))
+                continue
+            print("{0:<12} {1:>9.1f} MB {2:>9.2f}s".format(
+                name, *results[name]))
+
+    if args.limit is not None and results['imagepdf'] is not None and \
+            results['imagepdf'][0] > args.limit:
+        sys.exit("imagepdf peak memory exceeds limit of {0} MB".format(
+            args.limit))
+
+
+if __name__ == '__main__':
+    main()
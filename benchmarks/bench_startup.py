@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of easydms.
+# Copyright (c) 2016 Peter Kessen
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject
+# to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+# OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4
+
+"""Measure the cost of importing easydms modules in a fresh interpreter
+
+Every sample starts a new python process, so the numbers include
+everything a cold start of easydms-gui or a headless tool pays before it
+does any work. The time of a bare interpreter start is subtracted.
+
+Usage: python benchmarks/bench_startup.py [-n RUNS] [--limit SECONDS]
+                                          [module ...]
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+DEFAULT_MODULES = ['easydms.config', 'easydms.ocrmypdfwrapper']
+
+
+def time_import(statement, runs):
+    env = dict(os.environ)
+    paths = [os.path.dirname(os.path.dirname(os.path.abspath(__file__)))]
+    if env.get('PYTHONPATH'):
+        paths.append(env['PYTHONPATH'])
+    env['PYTHONPATH'] = os.pathsep.join(paths)
+    samples = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.check_call([sys.executable, '-c', statement], env=env)
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('modules', nargs='*', default=DEFAULT_MODULES)
+    parser.add_argument('-n', '--runs', type=int, default=10)
+    parser.add_argument('--limit', type=float, default=None,
+                        help="exit non-zero if a median import takes longer "
+                             "than this many seconds")
+    args = parser.parse_args()
+
+    baseline = statistics.median(time_import('pass', args.runs))
+    print("{0:<32} {1:>10} {2:>10}".format('module', 'median', 'min'))
+    print("{0:<32} {1:>9.1f}ms {2:>9}".format(
+        '(interpreter)', baseline * 1000, ''))
+
+    slow = False
+    for module in args.modules:
+        samples = time_import('import ' + module, args.runs)
+        median = statistics.median(samples) - baseline
+        best = min(samples) - baseline
+        print("{0:<32} {1:>9.1f}ms {2:>8.1f}ms".format(
+            module, median * 1000, best * 1000))
+        if args.limit is not None and median > args.limit:
+            slow = True
+
+    if slow:
+        sys.exit("Import cost exceeds limit of {0:.3f}s".format(args.limit))
+
+
+if __name__ == '__main__':
+    main()
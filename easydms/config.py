@@ -42,6 +42,16 @@ MAC_DIR                = '~/Library/Application Support'
 
 CONFIG_FILENAME        = 'easydms.yaml'
 
+CACHE_UNIX_DIR_VAR     = 'XDG_CACHE_HOME'
+CACHE_UNIX_DIR_FALLBACK = '~/.cache'
+
+CACHE_WINDOWS_DIR_VAR  = 'LOCALAPPDATA'
+CACHE_WINDOWS_DIR_FALLBACK = '~\\AppData\\Local'
+
+CACHE_MAC_DIR          = '~/Library/Caches'
+
+CACHE_DIRNAME          = 'easydms'
+
 
 class ErrorNoConfiguration(Exception):
     """No Configuration could be loaded
@@ -157,3 +167,24 @@ def config_location():
             pass
 
     raise ErrorNoConfiguration(paths)
+
+
+def cache_location():
+    """Return the platform-specific directory for cached data of easydms
+
+    Unlike the configuration, everything below this directory may be
+    deleted at any time. The directory is not created here.
+    """
+    if platform.system() == 'Darwin':
+        path = CACHE_MAC_DIR
+
+    elif platform.system() == 'Windows':
+        path = os.environ.get(CACHE_WINDOWS_DIR_VAR,
+                              CACHE_WINDOWS_DIR_FALLBACK)
+
+    else:
+        # Assume Unix.
+        path = os.environ.get(CACHE_UNIX_DIR_VAR, CACHE_UNIX_DIR_FALLBACK)
+
+    path = os.path.join(path, CACHE_DIRNAME)
+    return os.path.abspath(os.path.expanduser(path))
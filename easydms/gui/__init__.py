@@ -27,6 +27,7 @@
 import os
 import shutil
 import sys
+import threading
 import easydms.config
 from PyQt5.QtCore import (
     Qt,
@@ -40,16 +41,20 @@ from PyQt5.QtWidgets import (
     QApplication, QWidget, QMessageBox,
     QFormLayout, QHBoxLayout, QPushButton,
     QLineEdit, QDateEdit, QFileDialog,
-    QLabel,
+    QLabel, QProgressBar,
     QCompleter,
 )
 from .pdfViewerWidget import pdfViewerWidget
 from .. import ocrmypdfwrapper
+from ..ocrcache import FileCache
+from ..suggest import suggest
 
 
 class mainWidget(QWidget):
     procOcr = None
+    procQuickOcr = None
     fileToOcr = pyqtSignal(str)
+    fileToQuickOcr = pyqtSignal(str, list)
     styleLblOCRrunning = "background: yellow"
     styleLblOCRfinished = "background: green"
 
@@ -64,9 +69,23 @@ class mainWidget(QWidget):
         self.ocrW = ocrWorker()
         self.fileToOcr.connect(self.ocrW.do, Qt.QueuedConnection)
         self.ocrW.finished.connect(self.ocrFinished)
+        self.ocrW.progress.connect(self.ocrProgress)
         self.ocrW.moveToThread(self.procOcr)
 
+        # Suggestions from the letterhead must not wait for the full OCR
+        if not mainWidget.procQuickOcr:
+            mainWidget.procQuickOcr = QThread(self)
+            mainWidget.procQuickOcr.start()
+        self.quickOcrW = quickOcrWorker()
+        self.fileToQuickOcr.connect(self.quickOcrW.do, Qt.QueuedConnection)
+        self.quickOcrW.finished.connect(self.quickOcrFinished)
+        self.quickOcrW.moveToThread(self.procQuickOcr)
+        self.quickOcrFile = None
+        self.dateAtLoad = None
+
         self.config = config
+        self.setupOcrCache()
+        self.setupPdfa()
         layout = QHBoxLayout(self)
         self.setLayout(layout)
         self.layLeftPane = QFormLayout()
@@ -90,13 +109,21 @@ class mainWidget(QWidget):
         self.btnStoreDoc = QPushButton(self.tr("Store document"))
         self.btnStoreDoc.clicked.connect(self.storeDoc)
         self.btnStoreDoc.setEnabled(False)
+        self.btnCancelOcr = QPushButton(self.tr("Cancel OCR"))
+        self.btnCancelOcr.clicked.connect(self.cancelOcr)
+        self.btnCancelOcr.setEnabled(False)
         self.lblOcrProgress = QLabel(self.tr("OCR not started"))
         self.lblOcrProgress.setAlignment(Qt.AlignCenter)
+        self.barOcrProgress = QProgressBar()
+        self.barOcrProgress.setRange(0, 0)
+        self.barOcrProgress.setVisible(False)
         self.layLeftPane.addRow(self.btnLoadDoc)
         self.layLeftPane.addRow(self.tr("Company Name"), self.inpCompanyName)
         self.layLeftPane.addRow(self.tr("Date"), self.inpDate)
         self.layLeftPane.addRow(self.btnStoreDoc)
         self.layLeftPane.addRow(self.lblOcrProgress)
+        self.layLeftPane.addRow(self.barOcrProgress)
+        self.layLeftPane.addRow(self.btnCancelOcr)
 
     def loadDoc(self):
         defaultDir = self.config.getKey('default_import_dir', None)
@@ -118,10 +145,22 @@ class mainWidget(QWidget):
         try:
             self.btnLoadDoc.setEnabled(False)
             self.btnStoreDoc.setEnabled(False)
+            self.btnCancelOcr.setEnabled(True)
+            self.ocrW.clearCancel()
+            previous = getattr(self, 'ocrFileName', None)
+            if previous and os.path.exists(previous):
+                # The result of the previous document was not stored
+                os.remove(previous)
             self.fileToOcr.emit(filepath)
+            self.quickOcrFile = filepath
+            self.inpCompanyName.setModified(False)
+            self.dateAtLoad = self.inpDate.date()
+            self.fileToQuickOcr.emit(filepath, self.compNames.stringList())
             self.wdgViewer.setFile(filepath)
             self.lblOcrProgress.setStyleSheet(self.styleLblOCRrunning)
             self.lblOcrProgress.setText(self.tr("OCR running"))
+            self.barOcrProgress.setRange(0, 0)
+            self.barOcrProgress.setVisible(True)
             self.ocrFileName = None
         except:
             print("Error during ocr")
@@ -129,12 +168,44 @@ class mainWidget(QWidget):
 
     def ocrFinished(self, newFilename):
         self.btnLoadDoc.setEnabled(True)
+        self.btnCancelOcr.setEnabled(False)
+        self.barOcrProgress.setVisible(False)
+        if not newFilename:
+            self.lblOcrProgress.setStyleSheet("")
+            self.lblOcrProgress.setText(self.tr("OCR cancelled"))
+            return
         self.btnStoreDoc.setEnabled(True)
         self.lblOcrProgress.setStyleSheet(self.styleLblOCRfinished)
         self.lblOcrProgress.setText(self.tr("OCR finished"))
         self.ocrFileName = newFilename
         self.wdgViewer.setFile(self.ocrFileName)
 
+    def quickOcrFinished(self, filepath, suggestions):
+        """Fill in the company and date found in the letterhead unless the
+        user has entered them already"""
+        if filepath != self.quickOcrFile:
+            return  # another document was loaded meanwhile
+        if suggestions.companies and not self.inpCompanyName.isModified():
+            self.inpCompanyName.setText(suggestions.companies[0])
+        if suggestions.dates and self.inpDate.date() == self.dateAtLoad:
+            date = suggestions.dates[0]
+            self.inpDate.setDate(QDate(date.year, date.month, date.day))
+
+    def cancelOcr(self):
+        self.btnCancelOcr.setEnabled(False)
+        self.lblOcrProgress.setText(self.tr("Cancelling OCR"))
+        # The worker thread is busy with the job, so call it directly
+        self.ocrW.cancel()
+
+    def ocrProgress(self, done, total, eta):
+        if total <= 0:
+            return
+        self.barOcrProgress.setRange(0, total)
+        self.barOcrProgress.setValue(done)
+        if eta >= 0:
+            self.lblOcrProgress.setText(
+                self.tr("OCR running, {0} s left").format(int(round(eta))))
+
     def storeDoc(self):
         if not self.ocrFileName:
             QMessageBox.warning(
@@ -177,6 +248,8 @@ class mainWidget(QWidget):
             break
         os.makedirs(path, exist_ok=True)
         shutil.copyfile(self.ocrFileName, newFileName)
+        if self.pdfaDeferred:
+            ocrmypdfwrapper.get_engine().defer_pdfa(newFileName)
         os.remove(self.ocrFileName)
         os.remove(self.origFilePath)
         self.wdgViewer.setFile("")
@@ -184,6 +257,34 @@ class mainWidget(QWidget):
         self.origFilePath = ""
         self.determineCompanyAutoCompletion()
 
+    def setupPdfa(self):
+        """Store plain PDFs at once and convert them to PDF/A in the
+        background if configured"""
+        self.pdfaDeferred = bool(self.config.getKey('pdfa_deferred', False))
+        if self.pdfaDeferred:
+            ocrmypdfwrapper.get_engine().options.pdfa_deferred = True
+
+    def setupOcrCache(self):
+        """Reuse OCR results of re-imported documents and pages if
+        configured"""
+        engine = ocrmypdfwrapper.get_engine()
+        size = self.config.getKey('ocr_cache_size', None)
+        if size:
+            directory = self.config.getKey(
+                'ocr_cache_directory',
+                os.path.join(easydms.config.cache_location(), 'ocr'))
+            engine.cache = FileCache(
+                os.path.expanduser(directory), int(size) * 1024 * 1024,
+                suffix='.pdf')
+        size = self.config.getKey('ocr_page_cache_size', None)
+        if size:
+            directory = self.config.getKey(
+                'ocr_page_cache_directory',
+                os.path.join(easydms.config.cache_location(), 'hocr'))
+            engine.hocr_cache = FileCache(
+                os.path.expanduser(directory), int(size) * 1024 * 1024,
+                suffix='.hocr')
+
     def setDmsDirectory(self, path):
         self.dmsDirectory = path
         self.determineCompanyAutoCompletion()
@@ -202,14 +303,70 @@ class mainWidget(QWidget):
 
 class ocrWorker(QObject):
     finished = pyqtSignal(str)
+    progress = pyqtSignal(int, int, float)
 
     def __init__(self):
         super(ocrWorker, self).__init__()
+        self.job = None
+        self.cancelPending = False
+        self.lock = threading.Lock()
 
     @pyqtSlot(str)
     def do(self, filepath):
-        newName = ocrmypdfwrapper.ocr(filepath)
-        self.finished.emit(newName)
+        job = ocrmypdfwrapper.get_engine().job(
+            filepath, ocrmypdfwrapper.temporary_output(),
+            progress=self.onProgress)
+        with self.lock:
+            self.job = job
+            if self.cancelPending:
+                # Cancel was clicked before the job existed
+                self.cancelPending = False
+                job.cancel()
+        try:
+            exitcode = job.run()
+        finally:
+            with self.lock:
+                self.job = None
+        if exitcode != ocrmypdfwrapper.ExitCode.ok and \
+                os.path.exists(job.output_file):
+            os.remove(job.output_file)
+        self.finished.emit("" if job.cancelled else job.output_file)
+
+    def cancel(self):
+        """Cancel the OCR job, may be called from any thread
+
+        If the job has not been created yet, it is cancelled as soon as
+        it is.
+        """
+        with self.lock:
+            if self.job is None:
+                self.cancelPending = True
+            else:
+                self.job.cancel()
+
+    def clearCancel(self):
+        """Forget a cancel that came after the previous job had ended"""
+        with self.lock:
+            self.cancelPending = False
+
+    def onProgress(self, event):
+        """Forward page progress of the OCR job to the GUI thread"""
+        if event.kind not in ('page_done', 'job_done'):
+            return
+        eta = -1.0 if event.eta is None else event.eta
+        self.progress.emit(event.pages_done, event.pages_total or 0, eta)
+
+
+class quickOcrWorker(QObject):
+    finished = pyqtSignal(str, object)
+
+    def __init__(self):
+        super(quickOcrWorker, self).__init__()
+
+    @pyqtSlot(str, list)
+    def do(self, filepath, companyNames):
+        text = ocrmypdfwrapper.quick_ocr(filepath)
+        self.finished.emit(filepath, suggest(text, companyNames))
 
 
 def main():
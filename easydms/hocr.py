@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of easydms.
+# Copyright (c) 2016 Peter Kessen
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject
+# to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+# OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4
+
+"""Reading tesseract's hOCR output"""
+
+import re
+import xml.etree.ElementTree as ET
+
+_re_wconf = re.compile(r'x_wconf\s+(\d+)')
+
+
+def words(path):
+    """Return (text, confidence) of every word in the hOCR file path
+
+    confidence is tesseract's x_wconf or None if it is missing. A file that
+    is not well-formed hOCR has no words.
+    """
+    try:
+        tree = ET.parse(path)
+    except ET.ParseError:
+        return []
+
+    result = []
+    for elem in tree.iter():
+        if 'ocrx_word' not in elem.get('class', '').split():
+            continue
+        text = ''.join(elem.itertext()).strip()
+        if not text:
+            continue
+        match = _re_wconf.search(elem.get('title', ''))
+        result.append((text, int(match.group(1)) if match else None))
+    return result
+
+
+def has_words(path):
+    """Return True if tesseract recognized any text at all"""
+    return bool(words(path))
+
+
+def mean_confidence(path):
+    """Return the mean confidence of the words in path and their number
+
+    Words without a confidence are not counted; if there are none, the
+    mean is None.
+    """
+    confidences = [conf for _, conf in words(path) if conf is not None]
+    if not confidences:
+        return None, 0
+    return sum(confidences) / len(confidences), len(confidences)
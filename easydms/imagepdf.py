@@ -0,0 +1,251 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of easydms.
+# Copyright (c) 2016 Peter Kessen
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject
+# to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+# OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4
+
+"""Single page PDFs from page images without loading them into memory
+
+PDF can hold JPEG data as it is and the compressed data of a PNG with its
+row filters, so the image layer of a page needs no decoding of the image.
+Only the headers are parsed; the image data is copied from the image
+file to the PDF in small chunks. Memory use therefore does not depend on
+the size of the page, unlike img2pdf, which reads the whole file.
+
+Images that PDF cannot take as they are, such as interlaced PNGs or PNGs
+with transparency, raise UnsupportedImageError.
+"""
+
+import binascii
+import struct
+
+# Size of the chunks in which image data is copied
+CHUNK_SIZE = 1 << 20
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+
+# Start of frame markers of JPEG, which hold the image size
+JPEG_SOF_MARKERS = frozenset(range(0xc0, 0xd0)) - {0xc4, 0xc8, 0xcc}
+JPEG_STANDALONE_MARKERS = frozenset(range(0xd0, 0xd8)) | {0x01}
+
+COLORSPACES = {1: '/DeviceGray', 3: '/DeviceRGB'}
+
+
+class UnsupportedImageError(Exception):
+    pass
+
+
+class ImageData(object):
+    """Size, color space, filter and location of the data of an image
+
+    chunks is a list of (offset, length) of the pieces of the image file
+    that make up the image data of the PDF.
+    """
+    def __init__(self, width, height, colorspace, bpc, filter_name,
+                 chunks, decode_parms=None):
+        self.width = width
+        self.height = height
+        self.colorspace = colorspace
+        self.bpc = bpc
+        self.filter_name = filter_name
+        self.chunks = chunks
+        self.decode_parms = decode_parms
+
+    @property
+    def length(self):
+        return sum(length for _, length in self.chunks)
+
+
+def _read_exactly(f, size):
+    data = f.read(size)
+    if len(data) != size:
+        raise UnsupportedImageError("Image file is truncated")
+    return data
+
+
+def read_jpeg(f):
+    """Return the ImageData of the JPEG file object f"""
+    f.seek(0, 2)
+    file_size = f.tell()
+    f.seek(2)
+    while True:
+        byte = _read_exactly(f, 1)
+        if byte != b'\xff':
+            raise UnsupportedImageError("Invalid JPEG marker")
+        marker = _read_exactly(f, 1)[0]
+        while marker == 0xff:
+            marker = _read_exactly(f, 1)[0]
+        if marker in JPEG_STANDALONE_MARKERS:
+            continue
+        if marker in (0xd9, 0xda):
+            raise UnsupportedImageError("JPEG has no frame header")
+        length, = struct.unpack('>H', _read_exactly(f, 2))
+        segment = _read_exactly(f, length - 2)
+        if marker in JPEG_SOF_MARKERS:
+            bpc, height, width, components = struct.unpack(
+                '>BHHB', segment[:6])
+            break
+    if height == 0 or components not in COLORSPACES or bpc != 8:
+        raise UnsupportedImageError(
+            "JPEG with {0} components of {1} bits is not supported".format(
+                components, bpc))
+    return ImageData(width, height, COLORSPACES[components], bpc,
+                     '/DCTDecode', [(0, file_size)])
+
+
+def read_png(f):
+    """Return the ImageData of the PNG file object f"""
+    f.seek(len(PNG_SIGNATURE))
+    header = None
+    palette = None
+    chunks = []
+    while True:
+        length, kind = struct.unpack('>I4s', _read_exactly(f, 8))
+        if kind == b'IHDR':
+            header = struct.unpack('>IIBBBBB', _read_exactly(f, length))
+        elif kind == b'PLTE':
+            palette = _read_exactly(f, length)
+        elif kind == b'IDAT':
+            chunks.append((f.tell(), length))
+            f.seek(length, 1)
+        elif kind == b'tRNS':
+            raise UnsupportedImageError("PNG with transparency")
+        elif kind == b'IEND':
+            break
+        else:
+            f.seek(length, 1)
+        f.seek(4, 1)  # CRC
+    if header is None or not chunks:
+        raise UnsupportedImageError("PNG has no image data")
+    width, height, bpc, color_type, _, _, interlace = header
+    if interlace:
+        raise UnsupportedImageError("Interlaced PNG")
+    if color_type == 0:
+        colors, colorspace = 1, '/DeviceGray'
+    elif color_type == 2:
+        colors, colorspace = 3, '/DeviceRGB'
+    elif color_type == 3 and palette:
+        colors = 1
+        colorspace = '[/Indexed /DeviceRGB {0} <{1}>]'.format(
+            len(palette) // 3 - 1,
+            binascii.hexlify(palette).decode('ascii'))
+    else:
+        raise UnsupportedImageError(
+            "PNG color type {0} is not supported".format(color_type))
+    decode_parms = '<< /Predictor 15 /Colors {0} /BitsPerComponent {1} ' \
+        '/Columns {2} >>'.format(colors, bpc, width)
+    return ImageData(width, height, colorspace, bpc, '/FlateDecode', chunks,
+                     decode_parms)
+
+
+def read_image(f):
+    """Return the ImageData of the JPEG or PNG file object f"""
+    signature = f.read(len(PNG_SIGNATURE))
+    if signature.startswith(b'\xff\xd8'):
+        return read_jpeg(f)
+    if signature == PNG_SIGNATURE:
+        return read_png(f)
+    raise UnsupportedImageError("Not a JPEG or PNG image")
+
+
+def _number(value):
+    return '{0:.4f}'.format(value).rstrip('0').rstrip('.')
+
+
+class _Writer(object):
+    "Write to a file object and keep track of the offsets of PDF objects"
+    def __init__(self, f):
+        self.f = f
+        self.position = 0
+        self.offsets = []
+
+    def write(self, data):
+        if isinstance(data, str):
+            data = data.encode('latin-1')
+        self.f.write(data)
+        self.position += len(data)
+
+    def begin_object(self):
+        self.offsets.append(self.position)
+        self.write('{0} 0 obj\n'.format(len(self.offsets)))
+
+
+def convert(image_file, output_file, dpi):
+    """Write a one page PDF that shows image_file at dpi (x, y)
+
+    The page has exactly the size of the image. The PDF is version 1.4,
+    or 1.5 for images with 16 bits per component, which need it.
+    """
+    with open(image_file, 'rb') as image:
+        data = read_image(image)
+        width = data.width * 72.0 / dpi[0]
+        height = data.height * 72.0 / dpi[1]
+        content = 'q {0} 0 0 {1} 0 0 cm /Im0 Do Q'.format(
+            _number(width), _number(height))
+
+        with open(output_file, 'wb') as f:
+            out = _Writer(f)
+            version = '1.5' if data.bpc == 16 else '1.4'
+            out.write('%PDF-{0}\n'.format(version))
+            out.write(b'%\xe2\xe3\xcf\xd3\n')
+            out.begin_object()
+            out.write('<< /Type /Catalog /Pages 2 0 R >>\nendobj\n')
+            out.begin_object()
+            out.write('<< /Type /Pages /Kids [3 0 R] /Count 1 >>\nendobj\n')
+            out.begin_object()
+            out.write(
+                '<< /Type /Page /Parent 2 0 R /MediaBox [0 0 {0} {1}] '
+                '/Resources << /XObject << /Im0 5 0 R >> >> '
+                '/Contents 4 0 R >>\nendobj\n'.format(
+                    _number(width), _number(height)))
+            out.begin_object()
+            out.write('<< /Length {0} >>\nstream\n{1}\nendstream\n'
+                      'endobj\n'.format(len(content), content))
+            out.begin_object()
+            out.write(
+                '<< /Type /XObject /Subtype /Image /Width {0} /Height {1} '
+                '/ColorSpace {2} /BitsPerComponent {3} /Filter {4} '.format(
+                    data.width, data.height, data.colorspace, data.bpc,
+                    data.filter_name))
+            if data.decode_parms:
+                out.write('/DecodeParms {0} '.format(data.decode_parms))
+            out.write('/Length {0} >>\nstream\n'.format(data.length))
+            for offset, length in data.chunks:
+                image.seek(offset)
+                while length > 0:
+                    block = image.read(min(length, CHUNK_SIZE))
+                    if not block:
+                        raise UnsupportedImageError(
+                            "Image file is truncated")
+                    out.write(block)
+                    length -= len(block)
+            out.write('\nendstream\nendobj\n')
+
+            xref = out.position
+            out.write('xref\n0 {0}\n0000000000 65535 f \n'.format(
+                len(out.offsets) + 1))
+            for offset in out.offsets:
+                out.write('{0:010d} 00000 n \n'.format(offset))
+            out.write('trailer\n<< /Size {0} /Root 1 0 R >>\n'
+                      'startxref\n{1}\n%%EOF\n'.format(
+                          len(out.offsets) + 1, xref))
@@ -0,0 +1,190 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of easydms.
+# Copyright (c) 2016 Peter Kessen
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject
+# to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+# OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4
+
+"""Content-addressed on-disk cache for OCR results
+
+Entries are files named by a hash of their input, so identical input
+finds its result again no matter where it comes from. The modification
+time of an entry records its last use; when the cache grows beyond its
+size limit the least recently used entries are evicted.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+from contextlib import suppress
+
+# Bump whenever the layout or meaning of cached results changes
+CACHE_VERSION = 1
+
+DEFAULT_MAX_SIZE = 1024 * 1024 * 1024
+# Other processes add entries too, so the size of the cache is counted
+# anew whenever this fraction of max_size was added since the last count
+RECOUNT_FRACTION = 0.1
+
+
+def content_key(path, params):
+    """Return the hex digest of the contents of path and the dict params
+
+    params must be serializable as JSON; values that are not (e.g. sets)
+    are hashed by their string representation.
+    """
+    h = hashlib.sha256()
+    h.update('easydms-cache-{0}\n'.format(CACHE_VERSION).encode('utf-8'))
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            h.update(chunk)
+    h.update(json.dumps(params, sort_keys=True, default=str).encode('utf-8'))
+    return h.hexdigest()
+
+
+class FileCache(object):
+    """Size-bounded store of files addressed by content keys
+
+    Instances can be pickled into worker processes; hit and miss counters
+    are kept per process. put() keeps a running total of the size of the
+    cache, so the entries are only listed when it passes max_size or was
+    last counted a while ago.
+    """
+    def __init__(self, directory, max_size=DEFAULT_MAX_SIZE, suffix=''):
+        self.directory = directory
+        self.max_size = max_size
+        self.suffix = suffix
+        self.hits = 0
+        self.misses = 0
+        # Size at the last count plus the entries put since, and the
+        # bytes put since
+        self.total = None
+        self.added = 0
+        self.lock = threading.Lock()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.lock = threading.Lock()
+
+    def __repr__(self):
+        return '{0}({1!r}, max_size={2!r})'.format(
+            self.__class__.__name__, self.directory, self.max_size)
+
+    def path(self, key):
+        return os.path.join(self.directory, key[:2], key + self.suffix)
+
+    def get(self, key, destination):
+        """Copy the entry for key to destination, return True on a hit"""
+        entry = self.path(key)
+        try:
+            shutil.copyfile(entry, destination)
+        except FileNotFoundError:
+            with self.lock:
+                self.misses += 1
+            return False
+
+        # Mark as recently used
+        with suppress(OSError):
+            os.utime(entry)
+        with self.lock:
+            self.hits += 1
+        return True
+
+    def put(self, key, source):
+        """Store a copy of the file source as entry for key"""
+        entry = self.path(key)
+        os.makedirs(os.path.dirname(entry), exist_ok=True)
+        fd, tmpname = tempfile.mkstemp(
+            dir=os.path.dirname(entry), suffix='.tmp')
+        os.close(fd)
+        try:
+            shutil.copyfile(source, tmpname)
+            size = os.path.getsize(tmpname)
+            try:
+                size -= os.path.getsize(entry)
+            except FileNotFoundError:
+                pass
+            os.replace(tmpname, entry)
+        except BaseException:
+            with suppress(OSError):
+                os.unlink(tmpname)
+            raise
+
+        with self.lock:
+            if self.total is not None:
+                self.total += size
+                self.added += max(size, 0)
+            recount = self.total is None or \
+                self.added > self.max_size * RECOUNT_FRACTION
+            full = recount or self.total > self.max_size
+        if full:
+            self.evict()
+
+    def entries(self):
+        """Return (mtime, size, path) of all entries"""
+        result = []
+        with suppress(FileNotFoundError):
+            for subdir in os.scandir(self.directory):
+                if not subdir.is_dir():
+                    continue
+                for entry in os.scandir(subdir.path):
+                    if entry.name.endswith('.tmp'):
+                        continue
+                    with suppress(FileNotFoundError):
+                        st = entry.stat()
+                        result.append((st.st_mtime, st.st_size, entry.path))
+        return result
+
+    def size(self):
+        return sum(size for _, size, _ in self.entries())
+
+    def evict(self):
+        """Remove least recently used entries until the limit is kept"""
+        entries = sorted(self.entries())
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if total <= self.max_size:
+                break
+            with suppress(FileNotFoundError):
+                os.unlink(path)
+            total -= size
+        with self.lock:
+            self.total = total
+            self.added = 0
+
+    def stats(self):
+        entries = self.entries()
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'entries': len(entries),
+            'size': sum(size for _, size, _ in entries),
+            'max_size': self.max_size,
+        }
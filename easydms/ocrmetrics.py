@@ -0,0 +1,335 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of easydms.
+# Copyright (c) 2016 Peter Kessen
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject
+# to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+# OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4
+
+"""Timing and throughput of the stages of OCR jobs
+
+While a job runs, every stage invocation appends one JSON record to the
+metrics file of the job, from whichever worker process it runs in. When
+the job has finished, the records are summed up per stage in a JobMetrics
+object, which can be written as a JSON report or as a textfile for the
+Prometheus node exporter.
+"""
+
+import hashlib
+import json
+import os
+import tempfile
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+METRICS_FORMATS = ('json', 'prometheus')
+
+
+def cpu_time():
+    """CPU seconds used by this process and its finished subprocesses"""
+    if resource is None:
+        return time.process_time()
+    self = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return sum((self.ru_utime, self.ru_stime,
+                children.ru_utime, children.ru_stime))
+
+
+def job_file(path, name):
+    """Return the metrics file of the job name for the report path
+
+    The base name of name and a digest of all of it are put before the
+    extension of path, so every job has a file of its own, even if jobs
+    run at the same time or input files of the same name are processed.
+    """
+    root, ext = os.path.splitext(path)
+    stem = os.path.splitext(os.path.basename(name))[0]
+    digest = hashlib.sha1(os.path.abspath(name).encode('utf-8')).hexdigest()
+    return '{0}.{1}-{2}{3}'.format(root, stem, digest[:8], ext)
+
+
+def append_record(path, record):
+    """Append record as one line to the metrics file path
+
+    Lines are written with a single write to a file opened for appending,
+    so concurrent writers do not interleave.
+    """
+    line = (json.dumps(record, sort_keys=True) + '\n').encode('utf-8')
+    fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    try:
+        os.write(fd, line)
+    finally:
+        os.close(fd)
+
+
+@contextmanager
+def measure(path, stage, pages, page=None):
+    """Record wall and CPU time of the enclosed block as stage
+
+    page is the page number if the block works on a single page. The start
+    of the block is recorded too, so progress can be followed while the
+    job runs.
+    """
+    start = time.time()
+    append_record(path, {'stage': stage, 'begin': start, 'page': page})
+    wall = time.perf_counter()
+    cpu = cpu_time()
+    try:
+        yield
+    finally:
+        append_record(path, {
+            'stage': stage,
+            'start': start,
+            'wall': time.perf_counter() - wall,
+            'cpu': cpu_time() - cpu,
+            'pages': pages,
+            'page': page,
+            'pid': os.getpid(),
+        })
+
+
+def record_time(record):
+    """Time of the event a record describes"""
+    for key in ('start', 'begin', 'done'):
+        if key in record:
+            return record[key]
+    return 0.0
+
+
+def _escape(value):
+    """Escape a Prometheus label value"""
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace(
+        '\n', '\\n')
+
+
+def start_run(path):
+    """Record that a run of the job starts
+
+    A job that resumes in the work folder of an earlier run appends to the
+    same file; JobMetrics.load() only sums up the records of the last run.
+    """
+    append_record(path, {'run': time.time()})
+
+
+def stage_done(path, stage):
+    """Record that all invocations of stage have finished"""
+    append_record(path, {'stage': stage, 'done': time.time()})
+
+
+class StageMetrics(object):
+    """Sums of all invocations of one stage
+
+    wall and cpu add up the time of all invocations; span is the time from
+    the start of the first to the end of the last one, which is less than
+    wall if invocations ran in parallel.
+    """
+    def __init__(self, name):
+        self.name = name
+        self.calls = 0
+        self.pages = 0
+        self.wall = 0.0
+        self.cpu = 0.0
+        self.first_start = None
+        self.last_end = None
+
+    def add(self, record):
+        self.calls += 1
+        self.pages += record.get('pages', 0)
+        self.wall += record['wall']
+        self.cpu += record['cpu']
+        end = record['start'] + record['wall']
+        if self.first_start is None or record['start'] < self.first_start:
+            self.first_start = record['start']
+        if self.last_end is None or end > self.last_end:
+            self.last_end = end
+
+    @property
+    def span(self):
+        if self.first_start is None:
+            return 0.0
+        return self.last_end - self.first_start
+
+    @property
+    def pages_per_second(self):
+        return self.pages / self.span if self.span > 0 else None
+
+    def to_dict(self):
+        return OrderedDict((
+            ('calls', self.calls),
+            ('pages', self.pages),
+            ('wall', self.wall),
+            ('cpu', self.cpu),
+            ('span', self.span),
+            ('pages_per_second', self.pages_per_second),
+        ))
+
+
+class JobMetrics(object):
+    """Stage metrics of one OCR job, in order of first appearance
+
+    work_folder_peak is the most space in bytes the job's intermediate
+    files took at any time, if known. With two pass OCR, ocr_tiers lists
+    for every OCRed page a dict with its 'page' number, the 'tier' that
+    made its text ('fast' or 'full') and the mean word 'confidence' of the
+    fast pass.
+    """
+    def __init__(self, name=None, records=()):
+        self.name = name
+        self.stages = OrderedDict()
+        self.work_folder_peak = None
+        self.ocr_tiers = None
+        for record in records:
+            self.add(record)
+
+    @classmethod
+    def load(cls, path, name=None):
+        """Sum up the records of the last run in the metrics file path"""
+        records = []
+        try:
+            with open(path, encoding='utf-8') as f:
+                for line in f:
+                    if line.strip():
+                        record = json.loads(line)
+                        if 'run' in record:
+                            records = []
+                        else:
+                            records.append(record)
+        except FileNotFoundError:
+            pass
+        records.sort(key=record_time)
+        return cls(name, records)
+
+    def add(self, record):
+        if 'wall' not in record:
+            return  # stage start or completion
+        stage = self.stages.get(record['stage'])
+        if stage is None:
+            stage = self.stages[record['stage']] = StageMetrics(
+                record['stage'])
+        stage.add(record)
+
+    @property
+    def wall(self):
+        starts = [s.first_start for s in self.stages.values()]
+        ends = [s.last_end for s in self.stages.values()]
+        if not starts:
+            return 0.0
+        return max(ends) - min(starts)
+
+    @property
+    def cpu(self):
+        return sum(s.cpu for s in self.stages.values())
+
+    @property
+    def pages(self):
+        return max((s.pages for s in self.stages.values()), default=0)
+
+    def bottleneck(self):
+        """Return the stage that took the most wall time, or None"""
+        if not self.stages:
+            return None
+        return max(self.stages.values(), key=lambda s: s.wall)
+
+    def to_dict(self):
+        result = OrderedDict((
+            ('job', self.name),
+            ('wall', self.wall),
+            ('cpu', self.cpu),
+            ('pages', self.pages),
+            ('work_folder_peak', self.work_folder_peak),
+            ('stages', OrderedDict(
+                (name, stage.to_dict())
+                for name, stage in self.stages.items())),
+        ))
+        if self.ocr_tiers is not None:
+            result['ocr_tiers'] = self.ocr_tiers
+        return result
+
+    def prometheus(self):
+        """Return the metrics in the Prometheus text exposition format"""
+        lines = []
+
+        def metric(name, help, values):
+            lines.append('# HELP easydms_ocr_{0} {1}'.format(name, help))
+            lines.append('# TYPE easydms_ocr_{0} gauge'.format(name))
+            for labels, value in values:
+                labels = ','.join('{0}="{1}"'.format(k, _escape(v))
+                                  for k, v in labels)
+                lines.append('easydms_ocr_{0}{{{1}}} {2!r}'.format(
+                    name, labels, float(value)))
+
+        job = (('job', self.name or ''),)
+        metric('job_wall_seconds', 'Wall time of the whole job',
+               [(job, self.wall)])
+        metric('job_pages', 'Pages processed by the job',
+               [(job, self.pages)])
+        if self.work_folder_peak is not None:
+            metric('job_work_folder_peak_bytes',
+                   'Most space used by intermediate files of the job',
+                   [(job, self.work_folder_peak)])
+        for name, attr, help in (
+                ('stage_wall_seconds', 'wall',
+                 'Wall time summed over all invocations of a stage'),
+                ('stage_cpu_seconds', 'cpu',
+                 'CPU time of a stage including its subprocesses'),
+                ('stage_span_seconds', 'span',
+                 'Time from the start to the end of a stage'),
+                ('stage_pages', 'pages', 'Pages processed by a stage'),
+                ('stage_calls', 'calls', 'Invocations of a stage')):
+            metric(name, help, [
+                (job + (('stage', stage.name),), getattr(stage, attr))
+                for stage in self.stages.values()])
+        if self.ocr_tiers is not None:
+            metric('job_pages_by_ocr_tier',
+                   'Pages whose text was made by a pass of two pass OCR',
+                   [(job + (('tier', tier),),
+                     sum(1 for page in self.ocr_tiers
+                         if page['tier'] == tier))
+                    for tier in ('fast', 'full')])
+        return '\n'.join(lines) + '\n'
+
+    def write(self, path, format='json'):
+        """Write the metrics report to path atomically"""
+        if format == 'prometheus':
+            content = self.prometheus()
+        elif format == 'json':
+            content = json.dumps(self.to_dict(), indent=2) + '\n'
+        else:
+            raise ValueError("Unknown metrics format {0}".format(format))
+        fd, tmpname = tempfile.mkstemp(
+            prefix=os.path.basename(path) + '.', suffix='.tmp',
+            dir=os.path.dirname(path) or '.')
+        try:
+            with open(fd, 'w', encoding='utf-8') as f:
+                f.write(content)
+            # mkstemp creates files only the owner can read, but collectors
+            # often run as another user
+            os.chmod(tmpname, 0o644)
+            os.replace(tmpname, path)
+        except BaseException:
+            os.unlink(tmpname)
+            raise
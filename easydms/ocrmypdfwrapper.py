@@ -27,17 +27,22 @@
 # original code from ocrmypdf/__main__.py
 # changed content to use as python module
 
+import copy
+import itertools
+import math
+import signal
 import tempfile
+import threading
 
 # original imports
-from contextlib import suppress
+from contextlib import contextmanager, suppress
 from tempfile import mkdtemp
 import sys
 import os
 import re
 import shutil
+import subprocess
 import multiprocessing
-import atexit
 import textwrap
 import img2pdf
 import logging
@@ -45,12 +50,17 @@ import logging
 import PyPDF2 as pypdf
 from PIL import Image
 
-from functools import partial
+try:
+    import pikepdf
+except ImportError:
+    pikepdf = None
+
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from collections import namedtuple
+from functools import partial, wraps
 
-from ruffus import transform, suffix, merge, active_if, regex, \
-    formatter, split, collate, graphviz, posttask
+from ruffus import Pipeline, suffix, regex, formatter
 import ruffus.ruffus_exceptions as ruffus_exceptions
-import ruffus.cmdline as cmdline
 import ruffus.proxy_logger as proxy_logger
 
 from ocrmypdf.hocrtransform import HocrTransform
@@ -60,10 +70,27 @@ from ocrmypdf import ghostscript
 from ocrmypdf import tesseract
 from ocrmypdf import qpdf
 from ocrmypdf import leptonica
+from ocrmypdf import unpaper
 from ocrmypdf import ExitCode, page_number, is_iterable_notstr, VERSION
+from ocrmypdf import get_program
 from collections.abc import Sequence
 # end original imports
 
+from . import hocr
+from . import imagepdf
+from . import pdfmerge
+from . import proctree
+from . import sysresources
+from . import tessworker
+from .ocrmetrics import (JobMetrics, METRICS_FORMATS, job_file, measure,
+                         stage_done, start_run)
+from .ocrcache import content_key
+from .ocrprogress import ProgressEvent, ProgressMonitor
+from .pageinfostore import PageInfoStore
+from .workerslots import WorkerSlots
+from .workfolder import WorkFolder, lock_folder, remove_stale
+from .probecache import ProbeCache
+
 VECTOR_PAGE_DPI = 400
 
 
@@ -72,17 +99,65 @@ VECTOR_PAGE_DPI = 400
 
 MINIMUM_TESS_VERSION = '3.02.02'
 
+# Seconds an external program may take to answer a probe
+PROBE_TIMEOUT = 10
+
 
 def complain(message):
     print(*textwrap.wrap(message), file=sys.stderr)
 
 
-if tesseract.version() < MINIMUM_TESS_VERSION:
-    complain(
-        "Please install tesseract {0} or newer "
-        "(currently installed version is {1})".format(
-            MINIMUM_TESS_VERSION, tesseract.version()))
-    sys.exit(ExitCode.missing_dependency)
+_probes = ProbeCache()
+
+
+def tesseract_version():
+    return _probes.get(get_program('tesseract'), 'version', tesseract.version)
+
+
+def tesseract_default_tessdata():
+    """Directory of the traineddata files tesseract uses without
+    TESSDATA_PREFIX, or None if it does not tell"""
+    env = dict(os.environ)
+    env.pop('TESSDATA_PREFIX', None)
+    try:
+        output = subprocess.run(
+            [get_program('tesseract'), '--list-langs'], env=env,
+            stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+            universal_newlines=True, timeout=PROBE_TIMEOUT).stdout
+    except (OSError, subprocess.TimeoutExpired):
+        return None
+    match = re.search(r'languages in "(.+?)"', output)
+    return match.group(1) if match else None
+
+
+def tesseract_tessdata():
+    """Directories whose traineddata files make the tesseract languages
+
+    Depending on its version, tesseract looks for them in TESSDATA_PREFIX
+    itself or in its tessdata subdirectory, so both are listed.
+    """
+    prefix = os.environ.get('TESSDATA_PREFIX')
+    if prefix:
+        return [prefix, os.path.join(prefix, 'tessdata')]
+    default = _probes.get(
+        get_program('tesseract'), 'tessdata', tesseract_default_tessdata)
+    return [default] if default else []
+
+
+def tesseract_languages():
+    return set(_probes.get(
+        get_program('tesseract'), 'languages',
+        lambda: sorted(tesseract.languages()),
+        depends=tesseract_tessdata()))
+
+
+def unpaper_version():
+    return _probes.get(get_program('unpaper'), 'version', unpaper.version)
+
+
+def qpdf_version():
+    return _probes.get(get_program('qpdf'), 'version', qpdf.version)
+
 
 try:
     import PIL.features
@@ -115,8 +190,25 @@ def check_pil_encoder(codec_name, friendly_name):
     sys.exit(ExitCode.missing_dependency)
 
 
-check_pil_encoder('jpg', 'JPEG')
-check_pil_encoder('zlib', 'PNG')
+_dependencies_checked = False
+
+
+def check_dependencies():
+    """Verify the external programs and libraries, once per process"""
+    global _dependencies_checked
+    if _dependencies_checked:
+        return
+
+    if tesseract_version() < MINIMUM_TESS_VERSION:
+        complain(
+            "Please install tesseract {0} or newer "
+            "(currently installed version is {1})".format(
+                MINIMUM_TESS_VERSION, tesseract_version()))
+        sys.exit(ExitCode.missing_dependency)
+
+    check_pil_encoder('jpg', 'JPEG')
+    check_pil_encoder('zlib', 'PNG')
+    _dependencies_checked = True
 
 
 # -------------
@@ -138,16 +230,13 @@ Online documentation is located at:
 
 class ocrOptions:
     def __init__(self):
-        # wrapper variables
-        self.tmp_dir = tempfile.TemporaryDirectory()
-
         # ocrmypdf variables
-        self.input_file = os.path.join(self.tmp_dir.name, 'input_file.pdf')
+        self.input_file = None
         """
     help="PDF file containing the images to be OCRed (or '-' to read from "
          "standard input)")
         """
-        self.output_file = os.path.join(self.tmp_dir.name, 'output_file.pdf')
+        self.output_file = None
         """
     help="output searchable PDF file (or '-' to write to standard output)")
         """
@@ -218,6 +307,36 @@ class ocrOptions:
     help="oversample images to at least the specified DPI, to improve OCR "
          "results slightly")
         """
+        self.ocr_dpi_max = None
+        """
+    help="give tesseract page images of at most this DPI, downsampling "
+         "finer ones; the image layer keeps the full resolution")
+        """
+        self.ocr_dpi_min = None
+        """
+    help="give tesseract page images of at least this DPI, upsampling "
+         "coarser ones; the image layer keeps the original resolution")
+        """
+        self.two_pass_ocr = False
+        """
+    help="OCR every page with cheap settings first and only OCR pages "
+         "again with the full settings if the mean word confidence of the "
+         "first pass is below fast_pass_confidence")
+        """
+        self.fast_pass_dpi = 150
+        """
+    help="DPI of the page images of the first pass of two_pass_ocr")
+        """
+        self.fast_pass_config = []
+        """
+    help="additional Tesseract configuration files for the first pass of "
+         "two_pass_ocr, e.g. to select faster models")
+        """
+        self.fast_pass_confidence = 80
+        """
+    help="mean word confidence (0-100) from which the first pass of "
+         "two_pass_ocr is good enough")
+        """
         self.force_ocr = False
         """
     help="rasterize any fonts or vector objects on each page, apply OCR, and "
@@ -257,6 +376,12 @@ class ocrOptions:
     help='give up on OCR after the timeout, but copy the preprocessed page '
          'into the final output')
         """
+        self.tesseract_threads = None
+        """
+    help="OpenMP threads of each tesseract; by default the CPUs that are "
+         "left over by the pages processed in parallel, unless "
+         "OMP_THREAD_LIMIT is set")
+        """
         self.rotate_pages_threshold = 14.0
         """
     help="only rotate pages when confidence is above this value (arbitrary "
@@ -272,98 +397,220 @@ class ocrOptions:
         """
         self.verbose = False
 
+        # easydms variables
+        self.tesseract_api = True
+        """
+    help="if tesserocr is installed, run tesseract inside the worker "
+         "processes, which load the language models only once, instead of "
+         "starting the tesseract program for every page")
+        """
+        self.work_dir = None
+        """
+    help="create the work folders of jobs in this directory, e.g. a tmpfs "
+         "like /dev/shm, instead of the default temporary directory")
+        """
+        self.work_quota = None
+        """
+    help="bytes of intermediate files a job may keep in its work folder; "
+         "beyond that, large files are moved to spill_dir")
+        """
+        self.spill_dir = None
+        """
+    help="directory on disk for intermediate files that exceed work_quota "
+         "(default: the default temporary directory)")
+        """
+        self.resume_dir = None
+        """
+    help="keep the work folder of each job in this directory, named after "
+         "its input and options, until the job completes; running the same "
+         "job again after a crash only redoes unfinished stages")
+        """
+        self.metrics_file = None
+        """
+    help="write wall time, CPU time and pages processed of every pipeline "
+         "stage to a file of each job when it has finished; its name is this "
+         "one with the name of the input file and a digest of its path "
+         "put before the extension")
+        """
+        self.metrics_format = 'json'
+        """
+    help="format of the metrics file: 'json' for a report, 'prometheus' "
+         "for the textfile collector of the Prometheus node exporter")
+        """
+        self.blank_pages = None
+        """
+    help="detect blank pages, e.g. the empty back sides of duplex scans, and "
+         "'skip' OCR on them or 'drop' them from the output")
+        """
+        self.blank_threshold = 0.002
+        """
+    help="a page is blank if less than this fraction of it, margins not "
+         "counted, is covered with ink")
+        """
+        self.text_overlay = 'page'
+        """
+    help="how the hOCR text layers are put on the image layers: 'page' "
+         "merges every page on its own with PyPDF2, 'document' overlays all "
+         "pages and assembles the document in one pass with pikepdf")
+        """
+        self.rasterize_batch = False
+        """
+    help="rasterize all pages that need the same Ghostscript device and "
+         "resolution in a few Ghostscript processes instead of one per page; "
+         "saves the Ghostscript startup time on long documents")
+        """
+        self.rotate_from_raster = False
+        """
+    help="with rotate_pages, rasterize every page once at OCR resolution "
+         "and derive the orientation preview from that image; pages are "
+         "then turned upright by rotating the image instead of rendering "
+         "the rotated page again")
+        """
+        self.pdfa_deferred = False
+        """
+    help="with output_type 'pdfa', jobs produce a plain PDF right away; "
+         "OcrEngine.defer_pdfa() converts it to PDF/A later in a low "
+         "priority background process and replaces it when done")
+        """
 
-options = ocrOptions()
-
-
-def ocr(input_file):
-    options.input_file = input_file
-    run_pipeline()
-    if os.path.exists(options.output_file):
-        print("done")
-    else:
-        print("error")
 
-    return options.output_file
+# Options that influence the output file; a cached result is only reused
+# when all of them match
+CACHE_KEY_OPTIONS = (
+    'language', 'image_dpi', 'output_type', 'title', 'author', 'subject',
+    'keywords', 'rotate_pages', 'remove_background', 'deskew', 'clean',
+    'clean_final', 'oversample', 'force_ocr', 'skip_text', 'skip_big',
+    'tesseract_config', 'tesseract_pagesegmode', 'pdf_renderer',
+    'rotate_pages_threshold', 'debug_rendering', 'blank_pages',
+    'blank_threshold', 'ocr_dpi_max', 'ocr_dpi_min', 'two_pass_ocr',
+    'fast_pass_dpi', 'fast_pass_config', 'fast_pass_confidence',
+)
+
+
+def cache_key(options):
+    """Content key of options.input_file processed with options"""
+    params = {name: getattr(options, name) for name in CACHE_KEY_OPTIONS}
+    params['tesseract'] = tesseract_version()
+    return content_key(options.input_file, params)
+
+
+def hocr_cache_params(options):
+    """Settings besides the page image that tesseract's hOCR depends on"""
+    return {
+        'language': options.language,
+        'tesseract_config': options.tesseract_config,
+        'tesseract_pagesegmode': options.tesseract_pagesegmode,
+        'tesseract': tesseract_version(),
+    }
 
 
-# ----------
-# Languages
+def check_options(options):
+    """Validate and complete options before they are handed to any OcrJob
 
-if not options.language:
-    options.language = ['eng']  # Enforce English hegemony
+    Mirrors the argument checks ocrmypdf performs on its command line.
+    """
+    # ----------
+    # Languages
 
-# Support v2.x "eng+deu" language syntax
-if '+' in options.language[0]:
-    options.language = options.language[0].split('+')
+    if not options.language:
+        options.language = ['eng']  # Enforce English hegemony
 
-if not set(options.language).issubset(tesseract.languages()):
-    complain(
-        "The installed version of tesseract does not have language "
-        "data for the following requested languages: ")
-    for lang in (set(options.language) - tesseract.languages()):
-        complain(lang)
-    sys.exit(ExitCode.bad_args)
+    # Support v2.x "eng+deu" language syntax
+    if '+' in options.language[0]:
+        options.language = options.language[0].split('+')
 
+    if not set(options.language).issubset(tesseract_languages()):
+        complain(
+            "The installed version of tesseract does not have language "
+            "data for the following requested languages: ")
+        for lang in (set(options.language) - tesseract_languages()):
+            complain(lang)
+        sys.exit(ExitCode.bad_args)
 
-# ----------
-# Arguments
+    # ----------
+    # Arguments
 
-options.verbose_abbreviated_path = 1
+    options.verbose_abbreviated_path = 1
 
-if options.pdf_renderer == 'auto':
-    options.pdf_renderer = 'hocr'
+    if options.pdf_renderer == 'auto':
+        options.pdf_renderer = 'hocr'
 
-if options.pdf_renderer == 'tesseract' and tesseract.version() < '3.04.01' \
-        and os.environ.get('OCRMYPDF_SHARP_TTF', '') != '1':
-    complain(
-        "WARNING: Your version of tesseract has problems with PDF output. "
-        "Some PDF viewers will fail to find searchable text.\n"
-        "--pdf-renderer=tesseract is not recommended.")
+    if options.pdf_renderer == 'tesseract' and \
+            tesseract_version() < '3.04.01' and \
+            os.environ.get('OCRMYPDF_SHARP_TTF', '') != '1':
+        complain(
+            "WARNING: Your version of tesseract has problems with PDF output. "
+            "Some PDF viewers will fail to find searchable text.\n"
+            "--pdf-renderer=tesseract is not recommended.")
 
-if any((options.clean, options.clean_final)):
-    try:
-        from . import unpaper
-        if unpaper.version() < '6.1':
+    if any((options.clean, options.clean_final)):
+        try:
+            if unpaper_version() < '6.1':
+                complain(
+                    "The installed 'unpaper' is not supported. "
+                    "Install version 6.1 or newer.")
+                sys.exit(ExitCode.missing_dependency)
+        except FileNotFoundError:
             complain(
-                "The installed 'unpaper' is not supported. "
-                "Install version 6.1 or newer.")
+                "Install the 'unpaper' program to use --deskew or --clean.")
             sys.exit(ExitCode.missing_dependency)
-    except FileNotFoundError:
+
+    if options.debug_rendering and options.pdf_renderer == 'tesseract':
         complain(
-            "Install the 'unpaper' program to use --deskew or --clean.")
-        sys.exit(ExitCode.missing_dependency)
-else:
-    unpaper = None
+            "Ignoring --debug-rendering because it is not supported with"
+            "--pdf-renderer=tesseract.")
 
-if options.debug_rendering and options.pdf_renderer == 'tesseract':
-    complain(
-        "Ignoring --debug-rendering because it is not supported with"
-        "--pdf-renderer=tesseract.")
+    if options.force_ocr and options.skip_text:
+        complain(
+            "Error: --force-ocr and --skip-text are mutually incompatible.")
+        sys.exit(ExitCode.bad_args)
 
-if options.force_ocr and options.skip_text:
-    complain(
-        "Error: --force-ocr and --skip-text are mutually incompatible.")
-    sys.exit(ExitCode.bad_args)
+    if options.clean and not options.clean_final \
+            and options.pdf_renderer == 'tesseract':
+        complain(
+            "Tesseract PDF renderer cannot render --clean pages without "
+            "also performing --clean-final, so --clean-final is assumed.")
 
-if options.clean and not options.clean_final \
-        and options.pdf_renderer == 'tesseract':
-    complain(
-        "Tesseract PDF renderer cannot render --clean pages without "
-        "also performing --clean-final, so --clean-final is assumed.")
+    if set(options.language) & {'chi_sim', 'chi_tra'} and any((
+            options.pdf_renderer == 'hocr', options.output_type == 'pdfa')):
+        complain(
+            "Your settings are known to cause problems with OCR of Chinese "
+            "text. Try adding these arguments: "
+            "    ocrmypdf --pdf-renderer tesseract --output-type pdf")
+
+    if options.blank_pages not in (None, 'skip', 'drop'):
+        complain("Error: blank_pages must be 'skip' or 'drop'.")
+        sys.exit(ExitCode.bad_args)
+
+    if options.work_dir and not os.path.isdir(options.work_dir):
+        complain("Error: work directory {0} does not exist.".format(
+            options.work_dir))
+        sys.exit(ExitCode.bad_args)
+
+    if options.text_overlay not in ('page', 'document'):
+        complain("Error: text_overlay must be 'page' or 'document'.")
+        sys.exit(ExitCode.bad_args)
+    if options.text_overlay == 'document' and pikepdf is None:
+        complain(
+            "Install pikepdf to use text_overlay 'document'; overlaying "
+            "page by page instead.")
+        options.text_overlay = 'page'
 
-if set(options.language) & {'chi_sim', 'chi_tra'} \
-        and (options.pdf_renderer == 'hocr' or options.output_type == 'pdfa'):
-    complain(
-        "Your settings are known to cause problems with OCR of Chinese text. "
-        "Try adding these arguments: "
-        "    ocrmypdf --pdf-renderer tesseract --output-type pdf")
+    if options.ocr_dpi_max and options.ocr_dpi_min and \
+            options.ocr_dpi_min > options.ocr_dpi_max:
+        complain("Error: ocr_dpi_min must not exceed ocr_dpi_max.")
+        sys.exit(ExitCode.bad_args)
+
+    if options.metrics_format not in METRICS_FORMATS:
+        complain("Error: metrics format must be one of: {0}".format(
+            ', '.join(METRICS_FORMATS)))
+        sys.exit(ExitCode.bad_args)
 
-lossless_reconstruction = False
-if options.pdf_renderer == 'hocr':
-    if not options.deskew and not options.clean_final and \
-            not options.force_ocr and not options.remove_background:
-        lossless_reconstruction = True
+    options.lossless_reconstruction = False
+    if options.pdf_renderer == 'hocr':
+        if not options.deskew and not options.clean_final and \
+                not options.force_ocr and not options.remove_background:
+            options.lossless_reconstruction = True
 
 
 # ----------
@@ -387,10 +634,6 @@ def logging_factory(logger_name, listargs):
     return root_logger
 
 
-_logger, _logger_mutex = proxy_logger.make_shared_logger_and_proxy(
-    logging_factory, __name__, [None, options.verbose])
-
-
 class WrappedLogger:
 
     def __init__(self, my_logger, my_mutex):
@@ -422,14 +665,29 @@ class WrappedLogger:
             self.logger.critical(*args, **kwargs)
 
 
-_log = WrappedLogger(_logger, _logger_mutex)
-_log.debug('ocrmypdf ' + VERSION)
+_log = None
+_log_lock = threading.Lock()
+
+
+def get_logger():
+    """Return the logger shared by all jobs, starting it on first use"""
+    global _log
+    with _log_lock:
+        if _log is None:
+            logger, mutex = proxy_logger.make_shared_logger_and_proxy(
+                logging_factory, __name__, [None, False])
+            _log = WrappedLogger(logger, mutex)
+            _log.debug('ocrmypdf ' + VERSION)
+    return _log
 
 
-def re_symlink(input_file, soft_link_name, log=_log):
+def re_symlink(input_file, soft_link_name, log=None):
     """
     Helper function: relinks soft symbolic link if necessary
     """
+    if log is None:
+        log = get_logger()
+
     # Guard against soft linking to oneself
     if input_file == soft_link_name:
         log.debug("Warning: No symbolic link made. You are using " +
@@ -463,20 +721,134 @@ def re_symlink(input_file, soft_link_name, log=_log):
 # -------------
 # The Pipeline
 
-manager = multiprocessing.Manager()
-_pdfinfo = manager.list()
-_pdfinfo_lock = manager.Lock()
+class JobContext:
+    """Everything the pipeline stages of one OcrJob need to know
+
+    Instances are handed to every stage as a ruffus extra and are pickled
+    into the worker processes, so only picklable state belongs here.
+    """
+
+    def __init__(self, options, work_folder, slots=None, hocr_cache=None):
+        self.options = options
+        self.work_folder = work_folder
+        self.pages = PageInfoStore(os.path.join(work_folder, 'pageinfo'))
+        self.metrics_file = os.path.join(work_folder, 'metrics.jsonl')
+        self.metrics = None
+        self.cancel_file = os.path.join(work_folder, 'cancelled')
+        self.worker_folder = os.path.join(work_folder, 'workers')
+        spill_dir = None
+        if options.work_quota is not None:
+            spill_dir = options.spill_dir or tempfile.gettempdir()
+        self.work = WorkFolder(work_folder, options.work_quota, spill_dir)
+        self.slots = slots
+        self.hocr_cache = hocr_cache
+        # The process that runs the job, as opposed to its worker processes
+        self.pid = os.getpid()
+
+    def clear_run_state(self):
+        """Forget the cancellation and workers of an earlier run of the job
+
+        Its metrics stay in the file for progress reporting, but no longer
+        count for the metrics of the job.
+        """
+        with suppress(FileNotFoundError):
+            os.remove(self.cancel_file)
+        shutil.rmtree(self.worker_folder, ignore_errors=True)
+        start_run(self.metrics_file)
+
+
+def page_numbers(files):
+    """Set of the page numbers of the per page files of a stage"""
+    if isinstance(files, str):
+        prefix = os.path.basename(files)[0:6]
+        return {int(prefix)} if prefix.isdigit() else set()
+    pages = set()
+    for f in files:
+        pages |= page_numbers(f)
+    return pages
+
+
+@contextmanager
+def stage_running(context):
+    "Note the process running a stage of the job, so it can be interrupted"
+    os.makedirs(context.worker_folder, exist_ok=True)
+    marker = os.path.join(context.worker_folder, str(os.getpid()))
+    open(marker, 'w').close()
+    try:
+        yield
+    finally:
+        with suppress(FileNotFoundError):
+            os.remove(marker)
 
-work_folder = mkdtemp(prefix="com.github.ocrmypdf.")
 
+def check_cancelled(context):
+    if os.path.exists(context.cancel_file):
+        sys.exit(ExitCode.ctrl_c)
 
-def done_task(caller):
-    "Useful as debug hook"
-    pass
+
+def interrupt_workers(context, log):
+    """Stop the programs and workers running stages of a cancelled job
+
+    External programs started by the workers are terminated; a worker
+    process gets SIGINT so ruffus reports its stage as interrupted. When
+    stages run in this very process, only the programs working on files of
+    this job are terminated, since other jobs may run in the same process.
+    """
+    try:
+        workers = [int(pid) for pid in os.listdir(context.worker_folder)]
+    except (OSError, ValueError):
+        return
+    for pid in workers:
+        children = proctree.descendants(pid)
+        if pid == os.getpid():
+            children = [
+                child for child in children
+                if any(context.work_folder in arg
+                       for arg in proctree.command_line(child))]
+        proctree.send_signal(children, signal.SIGTERM)
+        if pid != os.getpid():
+            proctree.send_signal([pid], signal.SIGINT)
+        log.debug("Interrupted worker {0} and {1} programs".format(
+            pid, len(children)))
+
+
+def pipeline_stage(func):
+    """Decorate the task function of a pipeline stage
+
+    When the job belongs to a batch, the stage only runs while it holds one
+    of the worker slots shared by all documents of that batch. A stage of a
+    cancelled job exits right away. Wall time, CPU time and pages of every
+    invocation go to the metrics of the job, the size of its output files to
+    the usage of the work folder. In worker processes, tesseract is limited
+    to the threads of the job before the stage runs.
+    """
+    @wraps(func)
+    def run_stage(input_files, output_files, log, context):
+        pages = page_numbers(input_files)
+        page = next(iter(pages)) if len(pages) == 1 else None
+        timed = partial(
+            measure, context.metrics_file, func.__name__, len(pages), page)
+        limit_tesseract_threads(context)
+        if context.slots is None:
+            check_cancelled(context)
+            with stage_running(context), timed():
+                result = func(input_files, output_files, log, context)
+        else:
+            with context.slots.hold():
+                check_cancelled(context)
+                with stage_running(context), timed():
+                    result = func(input_files, output_files, log, context)
+        context.work.account(output_files, log)
+        return result
+    return run_stage
 
 
-@atexit.register
-def cleanup_working_files(*args):
+def done_task(caller, context):
+    "Record that all invocations of the stage caller have finished"
+    stage_done(context.metrics_file, caller)
+
+
+def cleanup_working_files(work_folder, options):
     if options.keep_temporary_files:
         print("Temporary working files saved at:\n{0}".format(work_folder),
               file=sys.stderr)
@@ -485,7 +857,7 @@ def cleanup_working_files(*args):
             shutil.rmtree(work_folder)
 
 
-def triage_image_file(input_file, output_file, log):
+def triage_image_file(input_file, output_file, log, options):
     try:
         log.info("Input file is not a PDF, checking if it is an image...")
         im = Image.open(input_file)
@@ -548,16 +920,12 @@ def triage_image_file(input_file, output_file, log):
         sys.exit(ExitCode.input_file)
 
 
-@posttask(partial(done_task, 'triage'))
-@transform(
-    input=os.path.join(work_folder, 'origin'),
-    filter=formatter('(?i)'),
-    output=os.path.join(work_folder, 'origin.pdf'),
-    extras=[_log])
+@pipeline_stage
 def triage(
         input_file,
         output_file,
-        log):
+        log,
+        context):
     try:
         with open(input_file, 'rb') as f:
             signature = f.read(4)
@@ -568,44 +936,73 @@ def triage(
         log.error(e)
         sys.exit(ExitCode.input_file)
 
-    triage_image_file(input_file, output_file, log)
+    triage_image_file(input_file, output_file, log, context.options)
 
 
-@posttask(partial(done_task, 'repair_pdf'))
-@transform(
-    input=triage,
-    filter=suffix('.pdf'),
-    output='.repaired.pdf',
-    output_dir=work_folder,
-    extras=[_log, _pdfinfo, _pdfinfo_lock])
+@pipeline_stage
 def repair_pdf(
         input_file,
         output_file,
         log,
-        pdfinfo,
-        pdfinfo_lock):
+        context):
 
     qpdf.repair(input_file, output_file, log)
-    with pdfinfo_lock:
-        pdfinfo.extend(pdf_get_all_pageinfo(output_file))
-        log.debug(pdfinfo)
+    if context.pages.exists():
+        return  # read from the input file before the pipeline started
+    pdfinfo = pdf_get_all_pageinfo(output_file)
+    log.debug(pdfinfo)
+    context.pages.write(pdfinfo)
+
+
+def read_input_pageinfo(input_file, context, log):
+    """Get the page info of an input PDF before the pipeline runs
+
+    Returns an empty list if the input is not a PDF or cannot be read
+    as it is; repair_pdf tries again after repairing it then.
+    """
+    if context.pages.exists():
+        # A resumed job keeps what its stages found out about the pages
+        return context.pages.all()
+    try:
+        with open(input_file, 'rb') as f:
+            if f.read(4) != b'%PDF':
+                return []
+        pdfinfo = pdf_get_all_pageinfo(input_file)
+    except Exception as e:
+        log.debug("Could not read page info before repair: {0}".format(e))
+        return []
+    log.debug(pdfinfo)
+    context.pages.write(pdfinfo)
+    return pdfinfo
+
+
+def call_tesseract_api(func, options, log, **kwargs):
+    """Call func of easydms.tessworker if the tesseract API is enabled
+
+    Returns None if the tesseract program has to be run instead.
+    """
+    if not (options.tesseract_api and tessworker.available()):
+        return None
+    try:
+        return func(**kwargs)
+    except tessworker.TesseractApiError as e:
+        log.debug("Tesseract API failed, running tesseract: {0}".format(e))
+        return None
 
 
-def get_pageinfo(input_file, pdfinfo, pdfinfo_lock):
+def get_pageinfo(input_file, context):
     pageno = int(os.path.basename(input_file)[0:6]) - 1
-    with pdfinfo_lock:
-        pageinfo = pdfinfo[pageno].copy()
-    return pageinfo
+    return context.pages.get(pageno)
 
 
-def get_page_dpi(pageinfo):
+def get_page_dpi(pageinfo, options):
     "Get the DPI when nonsquare DPI is tolerable"
     xres = max(pageinfo.get('xres', VECTOR_PAGE_DPI), options.oversample or 0)
     yres = max(pageinfo.get('yres', VECTOR_PAGE_DPI), options.oversample or 0)
     return (float(xres), float(yres))
 
 
-def get_page_square_dpi(pageinfo):
+def get_page_square_dpi(pageinfo, options):
     "Get the DPI when we require xres == yres"
     return float(max(
         pageinfo.get('xres', VECTOR_PAGE_DPI),
@@ -613,10 +1010,33 @@ def get_page_square_dpi(pageinfo):
         options.oversample or 0))
 
 
-def is_ocr_required(pageinfo, log):
+def get_full_ocr_dpi(pageinfo, options):
+    "Get the DPI of the image tesseract sees, within the OCR DPI limits"
+    dpi = get_page_square_dpi(pageinfo, options)
+    if options.ocr_dpi_max:
+        dpi = min(dpi, float(options.ocr_dpi_max))
+    if options.ocr_dpi_min:
+        dpi = max(dpi, float(options.ocr_dpi_min))
+    return dpi
+
+
+def get_ocr_dpi(pageinfo, options):
+    "Get the DPI of the image the hOCR of the page was made from"
+    if 'ocr_dpi' in pageinfo:
+        return pageinfo['ocr_dpi']
+    return get_full_ocr_dpi(pageinfo, options)
+
+
+def is_ocr_required(pageinfo, log, options):
     page = pageinfo['pageno'] + 1
     ocr_required = True
-    if not pageinfo['images']:
+    if pageinfo.get('blank'):
+        log.info(
+            "{0:4d}: page is blank - skipping all processing on this "
+            "page".format(page))
+        ocr_required = False
+
+    elif not pageinfo['images']:
         if options.force_ocr and options.oversample:
             # The user really wants to reprocess this file
             log.info(
@@ -665,17 +1085,14 @@ def is_ocr_required(pageinfo, log):
     return ocr_required
 
 
-@posttask(partial(done_task, 'split_pages'))
-@split(
-    repair_pdf,
-    os.path.join(work_folder, '*.page.pdf'),
-    extras=[_log, _pdfinfo, _pdfinfo_lock])
+@pipeline_stage
 def split_pages(
         input_files,
         output_files,
         log,
-        pdfinfo,
-        pdfinfo_lock):
+        context):
+    options = context.options
+    work_folder = context.work_folder
 
     if is_iterable_notstr(input_files):
         input_file = input_files[0]
@@ -683,8 +1100,7 @@ def split_pages(
         input_file = input_files
 
     for oo in output_files:
-        with suppress(FileNotFoundError):
-            os.unlink(oo)
+        context.work.remove(oo)
 
     # If no files were repaired the input will be empty
     if not input_file:
@@ -695,12 +1111,21 @@ def split_pages(
     npages = qpdf.get_npages(input_file, log)
     qpdf.split_pages(input_file, work_folder, npages)
 
+    # Dropping all pages would leave nothing to write
+    drop_blank = options.blank_pages == 'drop' and not all(
+        pageinfo.get('blank') for pageinfo in context.pages.all())
+
     from glob import glob
     for filename in glob(os.path.join(work_folder, '*.page.pdf')):
-        pageinfo = get_pageinfo(filename, pdfinfo, pdfinfo_lock)
+        pageinfo = get_pageinfo(filename, context)
 
-        alt_suffix = '.ocr.page.pdf' if is_ocr_required(pageinfo, log) \
-                     else '.skip.page.pdf'
+        if drop_blank and pageinfo.get('blank'):
+            # No later stage picks up these pages
+            alt_suffix = '.drop.page.pdf'
+        elif is_ocr_required(pageinfo, log, options):
+            alt_suffix = '.ocr.page.pdf'
+        else:
+            alt_suffix = '.skip.page.pdf'
         re_symlink(
             filename,
             os.path.join(
@@ -708,41 +1133,286 @@ def split_pages(
                 os.path.basename(filename)[0:6] + alt_suffix))
 
 
-@posttask(partial(done_task, 'rasterize_preview'))
-@active_if(options.rotate_pages)
-@transform(
-    input=split_pages,
-    filter=suffix('.page.pdf'),
-    output='.preview.jpg',
-    output_dir=work_folder,
-    extras=[_log, _pdfinfo, _pdfinfo_lock])
+PREVIEW_DPI = 200
+PREVIEW_DEVICE = 'jpeggray'
+
+
+def batch_raster_name(input_file, extension):
+    """Name of the raster of a page that was rendered by a batch stage"""
+    return os.path.join(
+        os.path.dirname(input_file),
+        os.path.basename(input_file)[0:6] + '.batch' + extension)
+
+
+def use_batch_raster(input_file, output_file, extension, work):
+    """Move a raster prepared by a batch stage into place if there is one
+
+    The raster is counted as output of the calling stage from now on, so
+    the work folder work stops counting it as batch raster.
+    """
+    batch_raster = batch_raster_name(input_file, extension)
+    if not os.path.exists(batch_raster):
+        return False
+    work.release(batch_raster)
+    os.replace(batch_raster, output_file)
+    return True
+
+
+# Upper bound of the bytes per pixel of the rasters of Ghostscript devices
+RASTER_BYTES_PER_PIXEL = {
+    'pngmono': 1 / 8,
+    'pnggray': 1,
+    'png256': 1,
+    'jpeggray': 1,
+}
+
+
+def raster_size(input_file, xres, yres, device, context):
+    "Estimate the size in bytes of the raster of the page PDF input_file"
+    pageinfo = get_pageinfo(input_file, context)
+    pixels = pageinfo.get('width_inches', 8.5) * xres * \
+        pageinfo.get('height_inches', 11) * yres
+    return int(pixels * RASTER_BYTES_PER_PIXEL.get(device, 3))
+
+
+def rasterize_pdfs(input_files, output_files, xres, yres, raster_device, log):
+    """Render all pages of the input files in one Ghostscript process
+
+    Ghostscript numbers its output pages across all input files, so
+    output_files names the pages of all input files in order.
+    """
+    with tempfile.TemporaryDirectory(
+            dir=os.path.dirname(output_files[0])) as tmpdir:
+        args_gs = [
+            get_program('gs'),
+            '-dQUIET',
+            '-dSAFER',
+            '-dBATCH',
+            '-dNOPAUSE',
+            '-sDEVICE=' + raster_device,
+            '-r{0}x{1}'.format(str(xres), str(yres)),
+            '-o', os.path.join(tmpdir, '%06d'),
+            '-dAutoRotatePages=/None',
+            '-f'] + list(input_files)
+        p = subprocess.run(
+            args_gs, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+            universal_newlines=True)
+        if p.stdout:
+            log.debug(p.stdout)
+        if p.returncode != 0:
+            raise subprocess.CalledProcessError(
+                p.returncode, args_gs, output=p.stdout)
+        for n, output_file in enumerate(output_files, start=1):
+            os.replace(os.path.join(tmpdir, '{0:06d}'.format(n)), output_file)
+
+
+def render_batches(groups, extension, log, processes, context):
+    """Render groups of pages with at most processes Ghostscripts at once
+
+    groups maps (device, xres, yres) to the page PDFs rendered with these
+    settings. Every group is split into at most processes chunks. Pages of
+    a failed chunk, or of a chunk whose rasters do not fit into the work
+    folder quota, are left to the per page stages.
+    """
+    work = []
+    for (device, xres, yres), input_files in sorted(groups.items()):
+        chunks = min(processes, len(input_files))
+        size = -(-len(input_files) // chunks)
+        for start in range(0, len(input_files), size):
+            chunk = input_files[start:start + size]
+            outputs = [batch_raster_name(f, extension) for f in chunk]
+            work.append((chunk, outputs, xres, yres, device))
+
+    def render(args):
+        chunk, outputs, xres, yres, device = args
+        size = sum(raster_size(f, xres, yres, device, context) for f in chunk)
+        if not context.work.reserve(size, log):
+            log.debug("No room for {0} batch rasters, rasterizing them "
+                      "one by one".format(len(chunk)))
+            return
+        log.debug("Rasterize {0} pages with {1} at {2}x{3} dpi".format(
+            len(chunk), device, xres, yres))
+        try:
+            rasterize_pdfs(chunk, outputs, xres, yres, device, log)
+        except (subprocess.CalledProcessError, OSError) as e:
+            log.warning(
+                "Batch rasterizing failed, falling back to single pages: "
+                "{0}".format(e))
+            for output in outputs:
+                with suppress(FileNotFoundError):
+                    os.unlink(output)
+        finally:
+            context.work.account(outputs, log, reserved=size)
+
+    with ThreadPoolExecutor(max(1, min(len(work), processes))) as ex:
+        list(ex.map(render, work))
+
+
+def rasterize_in_batches(groups, extension, log, context):
+    """Render groups of pages with few Ghostscript processes
+
+    Up to options.jobs processes run at once. If the job shares worker
+    slots with other jobs, the stage calling this holds one slot and each
+    further process needs a free slot of its own.
+    """
+    jobs = context.options.jobs or 1
+    if context.slots is None or jobs == 1:
+        render_batches(groups, extension, log, jobs, context)
+        return
+    with context.slots.hold(jobs - 1, least=0) as extra:
+        render_batches(groups, extension, log, 1 + extra, context)
+
+
+BLANK_DPI = 40
+BLANK_DEVICE = 'pnggray'
+BLANK_MARGIN = 0.05
+BLANK_INK_LEVEL = 160
+
+
+def ink_coverage(image_file):
+    """Fraction of the page without its margins that is covered with ink
+
+    Dark pixels are counted from the histogram, so this does not iterate
+    over the pixels in Python.
+    """
+    with Image.open(image_file) as im:
+        im = im.convert('L')
+        width, height = im.size
+        dx, dy = int(width * BLANK_MARGIN), int(height * BLANK_MARGIN)
+        histogram = im.crop((dx, dy, width - dx, height - dy)).histogram()
+    total = sum(histogram)
+    if not total:
+        return 0.0
+    return sum(histogram[:BLANK_INK_LEVEL]) / total
+
+
+@pipeline_stage
+def detect_blank_pages(
+        input_file,
+        output_file,
+        log,
+        context):
+    options = context.options
+    npages = len(context.pages)
+    with tempfile.TemporaryDirectory(dir=context.work_folder) as tmpdir:
+        images = [os.path.join(tmpdir, '{0:06d}.png'.format(n + 1))
+                  for n in range(npages)]
+        rasterize_pdfs([input_file], images, BLANK_DPI, BLANK_DPI,
+                       BLANK_DEVICE, log)
+        for pageno, image in enumerate(images):
+            coverage = ink_coverage(image)
+            blank = coverage < options.blank_threshold
+            log.debug("{0:4d}: ink coverage {1:.4f}{2}".format(
+                pageno + 1, coverage, ' - blank' if blank else ''))
+            if blank:
+                context.pages.update(pageno, 'blank', True)
+    open(output_file, 'w').close()
+
+
+def preview_from_raster(raster, preview, dpi):
+    """Downscale a page raster of dpi to the orientation preview"""
+    preview_dpi = min(dpi, PREVIEW_DPI)
+    with Image.open(raster) as im:
+        im = im.convert('L')
+        if dpi > preview_dpi:
+            im = im.resize(
+                (max(1, round(im.width * preview_dpi / dpi)),
+                 max(1, round(im.height * preview_dpi / dpi))),
+                Image.BILINEAR)
+        im.save(preview, 'JPEG', dpi=(preview_dpi, preview_dpi))
+
+
+# Transpositions that turn an image counterclockwise by the given angle
+ROTATE_CCW = {
+    90: Image.ROTATE_90,
+    180: Image.ROTATE_180,
+    270: Image.ROTATE_270,
+}
+
+
+def rotate_raster(raster, angle):
+    """Turn a page raster counterclockwise by angle, in place"""
+    with Image.open(raster) as im:
+        dpi = im.info.get('dpi')
+        rotated = im.transpose(ROTATE_CCW[angle])
+    if dpi:
+        if angle != 180:
+            dpi = dpi[::-1]
+        rotated.save(raster, 'PNG', dpi=dpi)
+    else:
+        rotated.save(raster, 'PNG')
+
+
+def uses_full_raster(input_file, options):
+    "True if the preview of a page is derived from its OCR raster"
+    return options.rotate_from_raster and \
+        os.path.basename(input_file).endswith('.ocr.page.pdf')
+
+
+def needs_preview(page_pdf):
+    """Whether orient_page looks at the preview of the page PDF page_pdf
+
+    Pages dropped as blank are not, nor the pages split_pages made, which
+    are linked to under their .ocr or .skip name.
+    """
+    return page_pdf.endswith(('.ocr.page.pdf', '.skip.page.pdf'))
+
+
+@pipeline_stage
+def rasterize_preview_batch(
+        infiles,
+        output_file,
+        log,
+        context):
+    options = context.options
+    page_pdfs = sorted(f for f in infiles if needs_preview(f))
+    full = [f for f in page_pdfs if uses_full_raster(f, options)]
+    previews = [f for f in page_pdfs if f not in full]
+    if full:
+        rasterize_in_batches(
+            raster_groups(full, context), '.png', log, context)
+    if previews:
+        rasterize_in_batches(
+            {(PREVIEW_DEVICE, PREVIEW_DPI, PREVIEW_DPI): previews},
+            '.jpg', log, context)
+    open(output_file, 'w').close()
+
+
+@pipeline_stage
 def rasterize_preview(
         input_file,
         output_file,
         log,
-        pdfinfo,
-        pdfinfo_lock):
+        context):
+    if use_batch_raster(input_file, output_file, '.jpg', context.work):
+        return
+    if uses_full_raster(input_file, context.options):
+        # Render the page for OCR now and keep it for
+        # rasterize_with_ghostscript, which then has nothing left to do
+        raster = batch_raster_name(input_file, '.png')
+        device, dpi = get_raster_settings(input_file, context)
+        if not os.path.exists(raster):
+            ghostscript.rasterize_pdf(
+                input_file, raster, xres=dpi, yres=dpi,
+                raster_device=device, log=log)
+        preview_from_raster(raster, output_file, dpi)
+        return
     ghostscript.rasterize_pdf(
         input_file=input_file,
         output_file=output_file,
-        xres=200,
-        yres=200,
-        raster_device='jpeggray',
+        xres=PREVIEW_DPI,
+        yres=PREVIEW_DPI,
+        raster_device=PREVIEW_DEVICE,
         log=log)
 
 
-@posttask(partial(done_task, 'orient_page'))
-@collate(
-    input=[split_pages, rasterize_preview],
-    filter=regex(r".*/(\d{6})(\.ocr|\.skip)(?:\.page\.pdf|\.preview\.jpg)"),
-    output=os.path.join(work_folder, r'\1\2.oriented.pdf'),
-    extras=[_log, _pdfinfo, _pdfinfo_lock])
+@pipeline_stage
 def orient_page(
         infiles,
         output_file,
         log,
-        pdfinfo,
-        pdfinfo_lock):
+        context):
+    options = context.options
 
     page_pdf = next(ii for ii in infiles if ii.endswith('.page.pdf'))
 
@@ -751,11 +1421,14 @@ def orient_page(
         return
     preview = next(ii for ii in infiles if ii.endswith('.preview.jpg'))
 
-    orient_conf = tesseract.get_orientation(
-        preview,
-        language=options.language,
-        timeout=options.tesseract_timeout,
-        log=log)
+    orient_conf = call_tesseract_api(
+        tessworker.get_orientation, options, log, input_file=preview)
+    if orient_conf is None:
+        orient_conf = tesseract.get_orientation(
+            preview,
+            language=options.language,
+            timeout=options.tesseract_timeout,
+            log=log)
 
     direction = {
         0: '⇧',
@@ -789,6 +1462,9 @@ def orient_page(
     if not apply_correction:
         re_symlink(page_pdf, output_file)
     else:
+        raster = batch_raster_name(page_pdf, '.png')
+        if uses_full_raster(page_pdf, options) and os.path.exists(raster):
+            rotate_raster(raster, orient_conf.angle)
         writer = pypdf.PdfFileWriter()
         reader = pypdf.PdfFileReader(page_pdf)
         page = reader.pages[0]
@@ -799,28 +1475,12 @@ def orient_page(
         with open(output_file, 'wb') as out:
             writer.write(out)
 
-        with pdfinfo_lock:
-            pageno = int(os.path.basename(page_pdf)[0:6]) - 1
-            pageinfo = pdfinfo[pageno].copy()
-            pageinfo['rotated'] = orient_conf.angle
-            pdfinfo[pageno] = pageinfo
-
+        pageno = int(os.path.basename(page_pdf)[0:6]) - 1
+        context.pages.update(pageno, 'rotated', orient_conf.angle)
 
-@posttask(partial(done_task, 'rasterize_with_ghostscript'))
-@transform(
-    input=orient_page,
-    filter=suffix('.ocr.oriented.pdf'),
-    output='.page.png',
-    output_dir=work_folder,
-    extras=[_log, _pdfinfo, _pdfinfo_lock])
-def rasterize_with_ghostscript(
-        input_file,
-        output_file,
-        log,
-        pdfinfo,
-        pdfinfo_lock):
-    pageinfo = get_pageinfo(input_file, pdfinfo, pdfinfo_lock)
 
+def get_raster_device(pageinfo):
+    "Get the Ghostscript device that preserves the colors of the page"
     device = 'png16m'  # 24-bit
     if all(image['comp'] == 1 for image in pageinfo['images']):
         if all(image['bpc'] == 1 for image in pageinfo['images']):
@@ -831,36 +1491,76 @@ def rasterize_with_ghostscript(
         elif all(image['bpc'] > 1 and image['color'] == 'gray'
                  for image in pageinfo['images']):
             device = 'pnggray'
+    return device
+
+
+def get_raster_settings(input_file, context):
+    """Ghostscript device and resolution for the OCR raster of a page
+
+    The resolution is square or else deskew and OCR will not work properly.
+    """
+    pageinfo = get_pageinfo(input_file, context)
+    return (get_raster_device(pageinfo),
+            get_page_square_dpi(pageinfo, context.options))
+
+
+def raster_groups(page_pdfs, context):
+    "Group page PDFs by the device and resolution of their OCR raster"
+    groups = {}
+    for page_pdf in page_pdfs:
+        device, dpi = get_raster_settings(page_pdf, context)
+        groups.setdefault((device, dpi, dpi), []).append(page_pdf)
+    return groups
+
+
+@pipeline_stage
+def rasterize_batch(
+        infiles,
+        output_file,
+        log,
+        context):
+    # Pages whose raster was made for orientation detection are done
+    oriented = [f for f in sorted(infiles) if f.endswith('.ocr.oriented.pdf')]
+    groups = raster_groups(
+        [f for f in oriented
+         if not os.path.exists(batch_raster_name(f, '.png'))],
+        context)
+    if groups:
+        rasterize_in_batches(groups, '.png', log, context)
+    open(output_file, 'w').close()
+
+
+@pipeline_stage
+def rasterize_with_ghostscript(
+        input_file,
+        output_file,
+        log,
+        context):
+    if use_batch_raster(input_file, output_file, '.png', context.work):
+        return
+
+    device, dpi = get_raster_settings(input_file, context)
 
     log.debug("Rasterize {0} with {1}".format(
               os.path.basename(input_file), device))
 
-    # Produce the page image with square resolution or else deskew and OCR
-    # will not work properly
-    dpi = get_page_square_dpi(pageinfo)
     ghostscript.rasterize_pdf(
         input_file, output_file, xres=dpi, yres=dpi, raster_device=device,
         log=log)
 
 
-@posttask(partial(done_task, 'preprocess_remove_background'))
-@transform(
-    input=rasterize_with_ghostscript,
-    filter=suffix(".page.png"),
-    output=".pp-background.png",
-    extras=[_log, _pdfinfo, _pdfinfo_lock])
+@pipeline_stage
 def preprocess_remove_background(
         input_file,
         output_file,
         log,
-        pdfinfo,
-        pdfinfo_lock):
+        context):
 
-    if not options.remove_background:
+    if not context.options.remove_background:
         re_symlink(input_file, output_file, log)
         return
 
-    pageinfo = get_pageinfo(input_file, pdfinfo, pdfinfo_lock)
+    pageinfo = get_pageinfo(input_file, context)
 
     if any(image['bpc'] > 1 for image in pageinfo['images']):
         leptonica.remove_background(input_file, output_file)
@@ -870,94 +1570,279 @@ def preprocess_remove_background(
         re_symlink(input_file, output_file, log)
 
 
-@posttask(partial(done_task, 'preprocess_deskew'))
-@transform(
-    input=preprocess_remove_background,
-    filter=suffix(".pp-background.png"),
-    output=".pp-deskew.png",
-    extras=[_log, _pdfinfo, _pdfinfo_lock])
+@pipeline_stage
 def preprocess_deskew(
         input_file,
         output_file,
         log,
-        pdfinfo,
-        pdfinfo_lock):
+        context):
 
-    if not options.deskew:
+    if not context.options.deskew:
         re_symlink(input_file, output_file, log)
         return
 
-    pageinfo = get_pageinfo(input_file, pdfinfo, pdfinfo_lock)
-    dpi = get_page_square_dpi(pageinfo)
+    pageinfo = get_pageinfo(input_file, context)
+    dpi = get_page_square_dpi(pageinfo, context.options)
 
     leptonica.deskew(input_file, output_file, dpi)
 
 
-@posttask(partial(done_task, 'preprocess_clean'))
-@transform(
-    input=preprocess_deskew,
-    filter=suffix(".pp-deskew.png"),
-    output=".pp-clean.png",
-    extras=[_log, _pdfinfo, _pdfinfo_lock])
+@pipeline_stage
 def preprocess_clean(
         input_file,
         output_file,
         log,
-        pdfinfo,
-        pdfinfo_lock):
+        context):
 
-    if not options.clean:
+    if not context.options.clean:
         re_symlink(input_file, output_file, log)
         return
 
-    pageinfo = get_pageinfo(input_file, pdfinfo, pdfinfo_lock)
-    dpi = get_page_square_dpi(pageinfo)
+    pageinfo = get_pageinfo(input_file, context)
+    dpi = get_page_square_dpi(pageinfo, context.options)
 
     unpaper.clean(input_file, output_file, dpi, log)
 
 
-@posttask(partial(done_task, 'ocr_tesseract_hocr'))
-@active_if(options.pdf_renderer == 'hocr')
-@transform(
-    input=preprocess_clean,
-    filter=suffix(".pp-clean.png"),
-    output=".hocr",
-    extras=[_log, _pdfinfo, _pdfinfo_lock])
-@graphviz(fillcolor='"#00cc66"')
+# Passes of two_pass_ocr that made the hOCR of a page
+OCR_TIER_FAST = 1
+OCR_TIER_FULL = 2
+
+
+@pipeline_stage
 def ocr_tesseract_hocr(
         input_file,
         output_file,
         log,
-        pdfinfo,
-        pdfinfo_lock):
+        context):
+    options = context.options
+    pageinfo = get_pageinfo(input_file, context)
+    pageno = pageinfo['pageno']
+    dpi = get_page_square_dpi(pageinfo, options)
+    ocr_dpi = get_full_ocr_dpi(pageinfo, options)
+
+    if options.two_pass_ocr:
+        fast_dpi = min(ocr_dpi, float(options.fast_pass_dpi))
+        recognize(input_file, output_file, dpi, fast_dpi,
+                  options.tesseract_config + options.fast_pass_config,
+                  log, context)
+        confidence, count = hocr.mean_confidence(output_file)
+        good = confidence is not None and \
+            confidence >= options.fast_pass_confidence
+        log.info("{0:4d}: fast pass at {1:.0f} dpi: {2} words, mean "
+                 "confidence {3}{4}".format(
+                     pageno + 1, fast_dpi, count,
+                     'n/a' if confidence is None else
+                     '{0:.1f}'.format(confidence),
+                     ' - kept' if good else ' - OCR again'))
+        if confidence is not None:
+            context.pages.update(pageno, 'ocr_confidence', confidence)
+        if good:
+            context.pages.update(pageno, 'ocr_dpi', fast_dpi)
+            context.pages.update(pageno, 'ocr_tier', OCR_TIER_FAST)
+            return
+
+    recognize(input_file, output_file, dpi, ocr_dpi,
+              options.tesseract_config, log, context)
+    if options.two_pass_ocr:
+        context.pages.update(pageno, 'ocr_dpi', ocr_dpi)
+        context.pages.update(pageno, 'ocr_tier', OCR_TIER_FULL)
+
+
+def recognize(input_file, output_file, dpi, ocr_dpi, tessconfig, log,
+              context):
+    """Write the hOCR of the page image input_file of dpi
+
+    tesseract is given the image at ocr_dpi. Identical pages (cover
+    letters, terms and conditions) are recognized only once, also across
+    documents.
+    """
+    params = hocr_cache_params(context.options)
+    params['tesseract_config'] = tessconfig
+    if ocr_dpi != dpi:
+        params['ocr_dpi'] = ocr_dpi
+
+    cache = context.hocr_cache
+    key = None
+    if cache is not None:
+        key = content_key(input_file, params)
+        if cache.get(key, output_file):
+            log.debug("{0:4d}: using cached hOCR".format(
+                page_number(input_file)))
+            return
+
+    if ocr_dpi != dpi:
+        resampled = os.path.join(
+            os.path.dirname(output_file),
+            os.path.basename(input_file)[0:6] + '.ocr-input.png')
+        log.debug("{0:4d}: OCR at {1:.0f} instead of {2:.0f} dpi".format(
+            page_number(input_file), ocr_dpi, dpi))
+        resample_image(input_file, resampled, ocr_dpi / dpi, ocr_dpi)
+        try:
+            run_tesseract_hocr(
+                resampled, output_file, tessconfig, log, context)
+        finally:
+            with suppress(FileNotFoundError):
+                os.remove(resampled)
+    else:
+        run_tesseract_hocr(input_file, output_file, tessconfig, log, context)
+
+    # A timeout or an oversized image also produce an empty page, which must
+    # not be cached
+    if key is not None and hocr.has_words(output_file):
+        try:
+            cache.put(key, output_file)
+        except OSError as e:
+            log.warning("Could not store hOCR in cache: {0}".format(e))
+
 
-    tesseract.generate_hocr(
+def resample_image(input_file, output_file, scale, dpi):
+    """Scale a page image by scale and save it as PNG of dpi
+
+    Bilevel images are resampled as grayscale, so that thin strokes
+    survive downsampling.
+    """
+    with Image.open(input_file) as im:
+        if im.mode in ('1', 'P'):
+            im = im.convert('L')
+        size = (max(1, round(im.width * scale)),
+                max(1, round(im.height * scale)))
+        im.resize(size, Image.BICUBIC).save(
+            output_file, 'PNG', dpi=(round(dpi), round(dpi)))
+
+
+def limit_tesseract_threads(context):
+    """Apply options.tesseract_threads to tesseract run by this worker
+
+    The stages of a job with several workers run in worker processes of
+    that job only, so their environment is the job's to change. With a
+    single worker, stages run in the process of the job, where other jobs
+    run too; all CPUs are left to tesseract then, so nothing is changed.
+
+    pipeline_stage() calls this before every stage, so the limit is set
+    before the first stage of a worker loads the tesseract API, see
+    easydms.tessworker.
+    """
+    threads = context.options.tesseract_threads
+    if threads and os.getpid() != context.pid:
+        os.environ['OMP_THREAD_LIMIT'] = str(threads)
+
+
+def run_tesseract_hocr(input_file, output_file, tessconfig, log, context):
+    "Write the hOCR of input_file with the tesseract API or program"
+    options = context.options
+    done = call_tesseract_api(
+        tessworker.generate_hocr, options, log,
         input_file=input_file,
         output_hocr=output_file,
         language=options.language,
-        tessconfig=options.tesseract_config,
+        tessconfig=tessconfig,
         timeout=options.tesseract_timeout,
-        pageinfo_getter=partial(get_pageinfo, input_file, pdfinfo,
-                                pdfinfo_lock),
         pagesegmode=options.tesseract_pagesegmode,
-        log=log
-    )
+        log=log)
+    if not done:
+        tesseract.generate_hocr(
+            input_file=input_file,
+            output_hocr=output_file,
+            language=options.language,
+            tessconfig=tessconfig,
+            timeout=options.tesseract_timeout,
+            pageinfo_getter=partial(get_pageinfo, input_file, context),
+            pagesegmode=options.tesseract_pagesegmode,
+            log=log
+        )
+
+
+# Color spaces of JPEGs that are copied into the image layer unchanged
+PASSTHROUGH_COLORSPACES = ('/DeviceGray', '/DeviceRGB')
+
+
+def multiply_matrix(m, n):
+    "Product of two PDF transformation matrices, m applied first"
+    return [m[0] * n[0] + m[1] * n[2],
+            m[0] * n[1] + m[1] * n[3],
+            m[2] * n[0] + m[3] * n[2],
+            m[2] * n[1] + m[3] * n[3],
+            m[4] * n[0] + m[5] * n[2] + n[4],
+            m[4] * n[1] + m[5] * n[3] + n[5]]
+
+
+def get_page_jpeg(page_pdf):
+    """Return the JPEG data of a page that shows nothing but one JPEG
+
+    The image must fill the upright page, be stored with DCTDecode as its
+    only filter and be plain gray or RGB, so that its data can go into the
+    image layer unchanged. Returns None for any other page, or if pikepdf
+    is not installed.
+    """
+    if pikepdf is None:
+        return None
+    with pikepdf.open(page_pdf) as pdf:
+        page = pdf.pages[0]
+        if int(page.obj.get('/Rotate', 0)) % 360:
+            return None
+        resources = page.obj.get('/Resources', pikepdf.Dictionary())
+        if '/Font' in resources:
+            return None
+        xobjects = resources.get('/XObject', pikepdf.Dictionary())
+        if len(xobjects.keys()) != 1:
+            return None
+        name = next(iter(xobjects.keys()))
+        image = xobjects[name]
+        if image.get('/Subtype') != '/Image' or \
+                image.get('/Filter') != '/DCTDecode' or \
+                image.get('/ColorSpace') not in PASSTHROUGH_COLORSPACES or \
+                image.get('/BitsPerComponent') != 8 or \
+                any(key in image for key in (
+                    '/Decode', '/SMask', '/Mask', '/ImageMask')):
+            return None
+
+        # Only state changes and the one image may be drawn
+        ctm = [1, 0, 0, 1, 0, 0]
+        stack = []
+        drawn = None
+        for operands, operator in pikepdf.parse_content_stream(page):
+            operator = str(operator)
+            if operator == 'q':
+                stack.append(ctm)
+            elif operator == 'Q' and stack:
+                ctm = stack.pop()
+            elif operator == 'cm':
+                ctm = multiply_matrix([float(v) for v in operands], ctm)
+            elif operator == 'Do' and drawn is None and \
+                    str(operands[0]) == name:
+                drawn = ctm
+            else:
+                return None
+        if drawn is None:
+            return None
+        x0, y0, x1, y1 = (float(v) for v in page.obj.MediaBox)
+        expected = [x1 - x0, 0, 0, y1 - y0, x0, y0]
+        if any(abs(a - b) > 0.5 for a, b in zip(drawn, expected)):
+            return None
+        return image.read_raw_bytes()
+
+
+def uses_original_jpeg(image_suffix, pageinfo, options):
+    """Whether the original JPEG of a page may stand in for its raster
+
+    Only the hOCR renderer, which fits the image to the page, can take it;
+    tesseract sizes the page from the image, whose JPEG density is often
+    missing or wrong.
+    """
+    return options.pdf_renderer == 'hocr' and \
+        image_suffix == '.page.png' and not options.oversample and \
+        len(pageinfo['images']) == 1 and \
+        pageinfo['images'][0]['enc'] == 'jpeg'
 
 
-@posttask(partial(done_task, 'select_image_for_pdf'))
-@collate(
-    input=[rasterize_with_ghostscript, preprocess_remove_background,
-           preprocess_deskew, preprocess_clean],
-    filter=regex(r".*/(\d{6})(?:\.page|\.pp-.*)\.png"),
-    output=os.path.join(work_folder, r'\1.image'),
-    extras=[_log, _pdfinfo, _pdfinfo_lock])
-@graphviz(shape='diamond')
+@pipeline_stage
 def select_image_for_pdf(
         infiles,
         output_file,
         log,
-        pdfinfo,
-        pdfinfo_lock):
+        context):
+    options = context.options
     if options.clean_final:
         image_suffix = '.pp-clean.png'
     elif options.deskew:
@@ -968,7 +1853,26 @@ def select_image_for_pdf(
         image_suffix = '.page.png'
     image = next(ii for ii in infiles if ii.endswith(image_suffix))
 
-    pageinfo = get_pageinfo(image, pdfinfo, pdfinfo_lock)
+    pageinfo = get_pageinfo(image, context)
+    if uses_original_jpeg(image_suffix, pageinfo, options):
+        # The raster only shows the original JPEG, so use that instead
+        page_pdf = os.path.join(
+            os.path.dirname(image),
+            os.path.basename(image)[0:6] + '.ocr.oriented.pdf')
+        try:
+            jpeg = get_page_jpeg(page_pdf)
+        except Exception as e:
+            log.debug("{0:4d}: cannot reuse the JPEG: {1}".format(
+                page_number(image), e))
+            jpeg = None
+        if jpeg is not None:
+            log.debug("{0:4d}: reusing the original JPEG".format(
+                page_number(image)))
+            with open(output_file, 'wb') as f:
+                f.write(jpeg)
+            context.pages.update(pageinfo['pageno'], 'passthrough', True)
+            return
+
     if all(orig_image['enc'] == 'jpeg' for orig_image in pageinfo['images']):
         # If all images were JPEGs originally, produce a JPEG as output
         im = Image.open(image)
@@ -978,7 +1882,7 @@ def select_image_for_pdf(
         # DPI used to rasterize. When the preview image was rasterized, it
         # was also converted to square resolution, which is what we want to
         # give tesseract, so keep it square.
-        fallback_dpi = get_page_square_dpi(pageinfo)
+        fallback_dpi = get_page_square_dpi(pageinfo, options)
         dpi = im.info.get('dpi', (fallback_dpi, fallback_dpi))
 
         # Pillow requires integer DPI
@@ -988,34 +1892,44 @@ def select_image_for_pdf(
         re_symlink(image, output_file)
 
 
-@posttask(partial(done_task, 'select_image_layer'))
-@active_if(options.pdf_renderer == 'hocr')
-@collate(
-    input=[select_image_for_pdf, orient_page],
-    filter=regex(r".*/(\d{6})(?:\.image|\.ocr\.oriented\.pdf)"),
-    output=os.path.join(work_folder, r'\1.image-layer.pdf'),
-    extras=[_log, _pdfinfo, _pdfinfo_lock])
-@graphviz(fillcolor='"#00cc66"', shape='diamond')
+@pipeline_stage
 def select_image_layer(
         infiles,
         output_file,
         log,
-        pdfinfo,
-        pdfinfo_lock):
+        context):
+    options = context.options
 
     page_pdf = next(ii for ii in infiles if ii.endswith('.ocr.oriented.pdf'))
     image = next(ii for ii in infiles if ii.endswith('.image'))
 
-    if lossless_reconstruction:
+    if options.lossless_reconstruction:
         log.debug("{:4d}: page eligible for lossless reconstruction".format(
             page_number(page_pdf)))
         re_symlink(page_pdf, output_file)
     else:
-        pageinfo = get_pageinfo(image, pdfinfo, pdfinfo_lock)
-        dpi = get_page_dpi(pageinfo)
+        pageinfo = get_pageinfo(image, context)
+        if pageinfo.get('passthrough'):
+            # The original JPEG has its own resolution; make it fill the
+            # page just like the raster would
+            with Image.open(image) as im:
+                width, height = im.size
+            dpi = (width / pageinfo['width_inches'],
+                   height / pageinfo['height_inches'])
+        else:
+            dpi = get_page_dpi(pageinfo, options)
         dpi = float(dpi[0]), float(dpi[1])
-        layout_fun = img2pdf.get_fixed_dpi_layout_fun(dpi)
 
+        # Stream the image into the PDF, so that memory use does not grow
+        # with the page size; img2pdf reads the whole image
+        try:
+            imagepdf.convert(image, output_file, dpi)
+            return
+        except imagepdf.UnsupportedImageError as e:
+            log.debug('{0:4d}: {1}, using img2pdf'.format(
+                page_number(page_pdf), e))
+
+        layout_fun = img2pdf.get_fixed_dpi_layout_fun(dpi)
         with open(image, 'rb') as imfile, \
                 open(output_file, 'wb') as pdf:
             rawdata = imfile.read()
@@ -1026,49 +1940,33 @@ def select_image_layer(
             log.debug('{:4d}: convert done'.format(page_number(page_pdf)))
 
 
-@posttask(partial(done_task, 'render_hocr_page'))
-@active_if(options.pdf_renderer == 'hocr')
-@transform(
-    input=ocr_tesseract_hocr,
-    filter=suffix('.hocr'),
-    output='.hocr.pdf',
-    extras=[_log, _pdfinfo, _pdfinfo_lock])
-@graphviz(fillcolor='"#00cc66"')
+@pipeline_stage
 def render_hocr_page(
         input_file,
         output_file,
         log,
-        pdfinfo,
-        pdfinfo_lock):
+        context):
     hocr = input_file
-    pageinfo = get_pageinfo(hocr, pdfinfo, pdfinfo_lock)
-    dpi = get_page_square_dpi(pageinfo)
+    pageinfo = get_pageinfo(hocr, context)
+    # The coordinates are pixels of the image tesseract was given
+    dpi = get_ocr_dpi(pageinfo, context.options)
 
     hocrtransform = HocrTransform(hocr, dpi)
     hocrtransform.to_pdf(output_file, imageFileName=None,
                          showBoundingboxes=False, invisibleText=True)
 
 
-@posttask(partial(done_task, 'render_hocr_debug_page'))
-@active_if(options.pdf_renderer == 'hocr')
-@active_if(options.debug_rendering)
-@collate(
-    input=[select_image_for_pdf, ocr_tesseract_hocr],
-    filter=regex(r".*/(\d{6})(?:\.image|\.hocr)"),
-    output=os.path.join(work_folder, r'\1.debug.pdf'),
-    extras=[_log, _pdfinfo, _pdfinfo_lock])
-@graphviz(fillcolor='"#00cc66"')
+@pipeline_stage
 def render_hocr_debug_page(
         infiles,
         output_file,
         log,
-        pdfinfo,
-        pdfinfo_lock):
+        context):
     hocr = next(ii for ii in infiles if ii.endswith('.hocr'))
     image = next(ii for ii in infiles if ii.endswith('.image'))
 
-    pageinfo = get_pageinfo(image, pdfinfo, pdfinfo_lock)
-    dpi = get_page_square_dpi(pageinfo)
+    pageinfo = get_pageinfo(image, context)
+    dpi = get_ocr_dpi(pageinfo, context.options)
 
     hocrtransform = HocrTransform(hocr, dpi)
     hocrtransform.to_pdf(output_file, imageFileName=None,
@@ -1079,20 +1977,45 @@ class PdfMergeFailedError(Exception):
     pass
 
 
-@posttask(partial(done_task, 'add_text_layer'))
-@active_if(options.pdf_renderer == 'hocr')
-@collate(
-    input=[render_hocr_page, select_image_layer],
-    filter=regex(r".*/(\d{6})(?:\.hocr\.pdf|\.image-layer\.pdf)"),
-    output=os.path.join(work_folder, r'\1.rendered.pdf'),
-    extras=[_log, _pdfinfo, _pdfinfo_lock])
-@graphviz(fillcolor='"#00cc66"')
+def get_image_layer_transform(rotate, x1, y1, x2, y2):
+    """Get (rotation, tx, ty) that put an image layer onto its text page
+
+    The text page always will be oriented up by this stage but if
+    lossless_reconstruction, the image layer may have a rotation applied.
+    We have to eliminate the /Rotate tag (because it applies to the whole
+    page) and rotate the image layer to match the text page. Also, the image
+    layer may not have its mediabox (x1, y1, x2, y2) nailed to (0, 0), so
+    may need translation.
+    """
+    # /Rotate is a clockwise rotation: 90 means page facing "east"
+    # The negative of this value is the angle that eliminates that rotation
+    rotation = -rotate % 360
+
+    # Rotation occurs about the page's (0, 0). Most pages will have the media
+    # box at (0, 0) with all content in the first quadrant but some cropped
+    # files may have an offset mediabox. We translate the page so that its
+    # bottom left corner after rotation is pinned to (0, 0) with the image
+    # in the first quadrant.
+    if rotation == 0:
+        tx, ty = -x1, -y1
+    elif rotation == 90:
+        tx, ty = y2, -x1
+    elif rotation == 180:
+        tx, ty = x2, y2
+    elif rotation == 270:
+        tx, ty = -y1, x2
+    else:
+        raise ValueError("/Rotate must be a multiple of 90, not {0}".format(
+            rotate))
+    return rotation, tx, ty
+
+
+@pipeline_stage
 def add_text_layer(
         infiles,
         output_file,
         log,
-        pdfinfo,
-        pdfinfo_lock):
+        context):
     text = next(ii for ii in infiles if ii.endswith('.hocr.pdf'))
     image = next(ii for ii in infiles if ii.endswith('.image-layer.pdf'))
 
@@ -1100,13 +2023,6 @@ def add_text_layer(
     pdf_image = pypdf.PdfFileReader(open(image, "rb"))
 
     page_text = pdf_text.getPage(0)
-
-    # The text page always will be oriented up by this stage
-    # but if lossless_reconstruction, pdf_image may have a rotation applied
-    # We have to eliminate the /Rotate tag (because it applies to the whole
-    # page) and rotate the image layer to match the text page
-    # Also, pdf_image may not have its mediabox nailed to (0, 0), so may need
-    # translation
     page_image = pdf_image.getPage(0)
     try:
         # pypdf DictionaryObject.get() does not resolve indirect objects but
@@ -1115,30 +2031,12 @@ def add_text_layer(
     except KeyError:
         rotation = 0
 
-    # /Rotate is a clockwise rotation: 90 means page facing "east"
-    # The negative of this value is the angle that eliminates that rotation
-    rotation = -rotation % 360
-
-    x1 = page_image.mediaBox.getLowerLeft_x()
-    x2 = page_image.mediaBox.getUpperRight_x()
-    y1 = page_image.mediaBox.getLowerLeft_y()
-    y2 = page_image.mediaBox.getUpperRight_y()
-
-    # Rotation occurs about the page's (0, 0). Most pages will have the media
-    # box at (0, 0) with all content in the first quadrant but some cropped
-    # files may have an offset mediabox. We translate the page so that its
-    # bottom left corner after rotation is pinned to (0, 0) with the image
-    # in the first quadrant.
-    if rotation == 0:
-        tx, ty = -x1, -y1
-    elif rotation == 90:
-        tx, ty = y2, -x1
-    elif rotation == 180:
-        tx, ty = x2, y2
-    elif rotation == 270:
-        tx, ty = -y1, x2
-    else:
-        pass
+    rotation, tx, ty = get_image_layer_transform(
+        rotation,
+        page_image.mediaBox.getLowerLeft_x(),
+        page_image.mediaBox.getLowerLeft_y(),
+        page_image.mediaBox.getUpperRight_x(),
+        page_image.mediaBox.getUpperRight_y())
 
     if rotation != 0:
         log.info("{0:4d}: rotating image layer {1} degrees".format(
@@ -1158,20 +2056,119 @@ def add_text_layer(
         pdf_output.write(out)
 
 
-@posttask(partial(done_task, 'tesseract_ocr_and_render_pdf'))
-@active_if(options.pdf_renderer == 'tesseract')
-@collate(
-    input=[select_image_for_pdf, orient_page],
-    filter=regex(r".*/(\d{6})(?:\.image|\.ocr\.oriented\.pdf)"),
-    output=os.path.join(work_folder, r'\1.rendered.pdf'),
-    extras=[_log, _pdfinfo, _pdfinfo_lock])
-@graphviz(fillcolor='"#66ccff"')
+def overlay_image_layer(pdf, page, image_page, pageno, log):
+    """Draw image_page onto page of pdf, as add_text_layer does
+
+    Both are pikepdf pages; image_page may belong to another PDF.
+    """
+    page, image_page = pikepdf.Page(page), pikepdf.Page(image_page)
+    rotation, tx, ty = get_image_layer_transform(
+        int(image_page.obj.get('/Rotate', 0)),
+        *(float(v) for v in image_page.obj.MediaBox))
+    if rotation != 0:
+        log.info("{0:4d}: rotating image layer {1} degrees".format(
+            pageno, rotation))
+
+    xobject = pdf.copy_foreign(
+        image_page.as_form_xobject(handle_transformations=False))
+    resources = page.obj.get('/Resources')
+    if resources is None:
+        resources = page.obj.Resources = pikepdf.Dictionary()
+    if '/XObject' not in resources:
+        resources.XObject = pikepdf.Dictionary()
+    name = pikepdf.Name('/EasydmsImageLayer')
+    resources.XObject[name] = xobject
+
+    # Same matrix as PyPDF2's mergeRotatedScaledTranslatedPage at scale 1
+    angle = math.radians(rotation)
+    cos, sin = round(math.cos(angle), 6), round(math.sin(angle), 6)
+    # Adding 0.0 turns -0.0 into 0.0
+    matrix = (v + 0.0 for v in (cos, sin, -sin, cos, float(tx), float(ty)))
+    content = 'q {0} {1} {2} {3} {4} {5} cm {6} Do Q\n'.format(
+        *matrix, name)
+    page.contents_add(pikepdf.Stream(pdf, content.encode('ascii')),
+                      prepend=False)
+
+
+def overlay_pages(pages, output_file, log):
+    """Write the pages of the page number -> files dict pages to output_file
+
+    The source files stay open until output_file is saved, so callers pass
+    a limited number of pages at once.
+    """
+    pdf = pikepdf.new()
+    sources = []
+
+    def open_source(filename):
+        source = pikepdf.open(filename)
+        sources.append(source)
+        return source
+
+    try:
+        for pageno in sorted(pages):
+            files = pages[pageno]
+            text = next((ii for ii in files if ii.endswith('.hocr.pdf')), None)
+            image = next(
+                (ii for ii in files if ii.endswith('.image-layer.pdf')), None)
+            if text and image:
+                pdf.pages.append(open_source(text).pages[0])
+                overlay_image_layer(
+                    pdf, pdf.pages[-1], open_source(image).pages[0], pageno,
+                    log)
+            else:
+                skipped = next(ii for ii in files if ii.endswith('.done.pdf'))
+                pdf.pages.extend(open_source(skipped).pages)
+            debug = next((ii for ii in files if ii.endswith('.debug.pdf')),
+                         None)
+            if debug:
+                pdf.pages.extend(open_source(debug).pages)
+        pdf.save(output_file)
+    finally:
+        pdf.close()
+        for source in sources:
+            source.close()
+
+
+@pipeline_stage
+def overlay_text_layers(
+        infiles,
+        output_file,
+        log,
+        context):
+    metadata_file = next(ii for ii in infiles if ii.endswith('.repaired.pdf'))
+    pages = {}
+    for ii in infiles:
+        prefix = os.path.basename(ii)[0:6]
+        if prefix.isdigit():
+            pages.setdefault(int(prefix), []).append(ii)
+
+    pdfmark = get_pdfmark(pypdf.PdfFileReader(metadata_file), context.options)
+    pdfmark['/Producer'] = 'pikepdf ' + pikepdf.__version__
+
+    # A page opens up to three source files
+    batch = max(1, pdfmerge.MERGE_BATCH // 3)
+    numbers = sorted(pages)
+    parts = []
+    # Named apart from the parts that merge itself may write
+    pages_file = os.path.splitext(output_file)[0] + '.pages.pdf'
+    try:
+        for start in range(0, len(numbers), batch):
+            part = pdfmerge.part_name(pages_file, len(parts))
+            parts.append(part)
+            overlay_pages({n: pages[n] for n in numbers[start:start + batch]},
+                          part, log)
+        pdfmerge.merge(parts, output_file, pdfmark, log)
+    finally:
+        pdfmerge.remove_parts(parts)
+
+
+@pipeline_stage
 def tesseract_ocr_and_render_pdf(
         input_files,
         output_file,
         log,
-        pdfinfo,
-        pdfinfo_lock):
+        context):
+    options = context.options
 
     input_image = next((ii for ii in input_files if ii.endswith('.image')), '')
     input_pdf = next((ii for ii in input_files if ii.endswith('.pdf')))
@@ -1180,18 +2177,27 @@ def tesseract_ocr_and_render_pdf(
         re_symlink(input_pdf, output_file)
         return
 
-    tesseract.generate_pdf(
+    done = call_tesseract_api(
+        tessworker.generate_pdf, options, log,
         input_image=input_image,
-        skip_pdf=input_pdf,
         output_pdf=output_file,
         language=options.language,
         tessconfig=options.tesseract_config,
         timeout=options.tesseract_timeout,
-        pagesegmode=options.tesseract_pagesegmode,
-        log=log)
-
-
-def get_pdfmark(base_pdf):
+        pagesegmode=options.tesseract_pagesegmode)
+    if not done:
+        tesseract.generate_pdf(
+            input_image=input_image,
+            skip_pdf=input_pdf,
+            output_pdf=output_file,
+            language=options.language,
+            tessconfig=options.tesseract_config,
+            timeout=options.tesseract_timeout,
+            pagesegmode=options.tesseract_pagesegmode,
+            log=log)
+
+
+def get_pdfmark(base_pdf, options):
     def from_document_info(key):
         # pdf.documentInfo.get() DOES NOT behave as expected for a dict-like
         # object, so call with precautions.  TypeError may occur if the PDF
@@ -1220,38 +2226,28 @@ def get_pdfmark(base_pdf):
     pdfmark['/Creator'] = '{0} {1} / Tesseract OCR{2} {3}'.format(
         parser.prog, VERSION,
         '+PDF' if options.pdf_renderer == 'tesseract' else '',
-        tesseract.version())
+        tesseract_version())
     return pdfmark
 
 
-@posttask(partial(done_task, 'generate_postscript_stub'))
-@active_if(options.output_type == 'pdfa')
-@transform(
-    input=repair_pdf,
-    filter=formatter(r'\.repaired\.pdf'),
-    output=os.path.join(work_folder, 'pdfa_def.ps'),
-    extras=[_log])
+@pipeline_stage
 def generate_postscript_stub(
         input_file,
         output_file,
-        log):
+        log,
+        context):
 
     pdf = pypdf.PdfFileReader(input_file)
-    pdfmark = get_pdfmark(pdf)
+    pdfmark = get_pdfmark(pdf, context.options)
     generate_pdfa_def(output_file, pdfmark)
 
 
-@posttask(partial(done_task, 'skip_page'))
-@transform(
-    input=orient_page,
-    filter=suffix('.skip.oriented.pdf'),
-    output='.done.pdf',
-    output_dir=work_folder,
-    extras=[_log])
+@pipeline_stage
 def skip_page(
         input_file,
         output_file,
-        log):
+        log,
+        context):
     # The purpose of this step is its filter to forward only the skipped
     # files (.skip.oriented.pdf) while disregarding the processed ones
     # (.ocr.oriented.pdf).  Alternative would be for merge_pages to filter
@@ -1259,19 +2255,12 @@ def skip_page(
     re_symlink(input_file, output_file, log)
 
 
-@posttask(partial(done_task, 'merge_pages_ghostscript'))
-@active_if(options.output_type == 'pdfa')
-@merge(
-    input=[add_text_layer, render_hocr_debug_page, skip_page,
-           tesseract_ocr_and_render_pdf, generate_postscript_stub],
-    output=os.path.join(work_folder, 'merged.pdf'),
-    extras=[_log, _pdfinfo, _pdfinfo_lock])
+@pipeline_stage
 def merge_pages_ghostscript(
         input_files,
         output_file,
         log,
-        pdfinfo,
-        pdfinfo_lock):
+        context):
 
     def input_file_order(s):
         '''Sort order: All rendered pages followed
@@ -1286,24 +2275,30 @@ def merge_pages_ghostscript(
             key += 1
         return key
 
-    pdf_pages = sorted(input_files, key=input_file_order)
+    overlaid = [ii for ii in input_files if ii.endswith('overlaid.pdf')]
+    if overlaid:
+        # All pages were put together by overlay_text_layers already
+        pdf_pages = overlaid + [ii for ii in input_files if ii.endswith('.ps')]
+    else:
+        pdf_pages = sorted(input_files, key=input_file_order)
     log.debug("Final pages: " + "\n".join(pdf_pages))
-    ghostscript.generate_pdfa(pdf_pages, output_file, log, options.jobs or 1)
+    ghostscript.generate_pdfa(
+        pdf_pages, output_file, log, context.options.jobs or 1)
 
 
-@posttask(partial(done_task, 'merge_pages_qpdf'))
-@active_if(options.output_type == 'pdf')
-@merge(
-    input=[add_text_layer, render_hocr_debug_page, skip_page,
-           tesseract_ocr_and_render_pdf, repair_pdf],
-    output=os.path.join(work_folder, 'merged.pdf'),
-    extras=[_log, _pdfinfo, _pdfinfo_lock])
+@pipeline_stage
 def merge_pages_qpdf(
         input_files,
         output_file,
         log,
-        pdfinfo,
-        pdfinfo_lock):
+        context):
+
+    overlaid = next(
+        (ii for ii in input_files if ii.endswith('overlaid.pdf')), None)
+    if overlaid:
+        # overlay_text_layers wrote the complete document with its metadata
+        re_symlink(overlaid, output_file, log)
+        return
 
     metadata_file = next(
         (ii for ii in input_files if ii.endswith('.repaired.pdf')))
@@ -1321,8 +2316,15 @@ def merge_pages_qpdf(
     log.debug("Final pages: " + "\n".join(pdf_pages))
 
     reader_metadata = pypdf.PdfFileReader(metadata_file)
-    pdfmark = get_pdfmark(reader_metadata)
-    pdfmark['/Producer'] = 'qpdf ' + qpdf.version()
+    pdfmark = get_pdfmark(reader_metadata, context.options)
+
+    if pdfmerge.available():
+        # One pass over the pages that also shares fonts between pages
+        pdfmark['/Producer'] = 'pikepdf ' + pikepdf.__version__
+        pdfmerge.merge(pdf_pages, output_file, pdfmark, log)
+        return
+
+    pdfmark['/Producer'] = 'qpdf ' + qpdf_version()
 
     first_page = pypdf.PdfFileReader(pdf_pages[0])
 
@@ -1338,19 +2340,18 @@ def merge_pages_qpdf(
     qpdf.merge(pdf_pages, output_file)
 
 
-@posttask(partial(done_task, 'copy_final'))
-@merge(
-    input=[merge_pages_ghostscript, merge_pages_qpdf],
-    output=options.output_file,
-    extras=[_log, _pdfinfo, _pdfinfo_lock])
+@pipeline_stage
 def copy_final(
         input_files,
         output_file,
         log,
-        pdfinfo,
-        pdfinfo_lock):
+        context):
     input_file = next((ii for ii in input_files if ii.endswith('.pdf')))
+    write_output(input_file, output_file)
+
 
+def write_output(input_file, output_file):
+    "Copy the finished PDF input_file to output_file, which may be '-'"
     if output_file == '-':
         from shutil import copyfileobj
         with open(input_file, 'rb') as input_stream:
@@ -1359,9 +2360,323 @@ def copy_final(
         shutil.copy(input_file, output_file)
 
 
+def is_ocr_unnecessary(pdfinfo, log, options):
+    """True if the page info shows that no page of the document needs OCR
+
+    Only documents whose output the page pipeline would not change apart
+    from the final conversion qualify.
+    """
+    if not pdfinfo or options.force_ocr or not options.skip_text:
+        return False
+    if options.rotate_pages:
+        return False  # skipped pages are still turned upright
+    if options.blank_pages == 'drop':
+        return False  # blank pages are only dropped while splitting
+    if options.output_type == 'pdf' and any((
+            options.title, options.author, options.subject,
+            options.keywords)):
+        return False  # metadata is only set while merging the pages
+    return not any(is_ocr_required(pageinfo, log, options)
+                   for pageinfo in pdfinfo)
+
+
+def convert_without_ocr(input_file, log, context):
+    """Produce the output of a document none of whose pages need OCR
+
+    Nothing is split, rasterized or merged page by page: a PDF is copied
+    as it is and PDF/A is converted from the whole document at once. No
+    pipeline stage runs, so a cancelled job is only reported by OcrJob.run().
+    """
+    options = context.options
+    final = input_file
+    if options.output_type == 'pdfa':
+        stub = os.path.join(context.work_folder, 'pdfa_def.ps')
+        generate_pdfa_def(
+            stub, get_pdfmark(pypdf.PdfFileReader(input_file), options))
+        final = os.path.join(context.work_folder, 'merged.pdf')
+        # As in merge_pages_ghostscript, the stub goes last
+        ghostscript.generate_pdfa(
+            [input_file, stub], final, log, options.jobs or 1)
+    write_output(final, options.output_file)
+
+
+def build_pipeline(name, options, work_folder, log, context):
+    """Assemble the ruffus pipeline of one job
+
+    The tasks are bound to the job's work folder and options; each job gets
+    its own uniquely named pipeline.
+    """
+    pipeline = Pipeline(name)
+
+    task_triage = pipeline.transform(
+        task_func=triage,
+        input=os.path.join(work_folder, 'origin'),
+        filter=formatter('(?i)'),
+        output=os.path.join(work_folder, 'origin.pdf'),
+        extras=[log, context])
+    task_triage.posttask(partial(done_task, 'triage', context))
+
+    task_repair_pdf = pipeline.transform(
+        task_func=repair_pdf,
+        input=task_triage,
+        filter=suffix('.pdf'),
+        output='.repaired.pdf',
+        output_dir=work_folder,
+        extras=[log, context])
+    task_repair_pdf.posttask(partial(done_task, 'repair_pdf', context))
+
+    task_detect_blank_pages = pipeline.transform(
+        task_func=detect_blank_pages,
+        input=task_repair_pdf,
+        filter=suffix('.repaired.pdf'),
+        output='.blank',
+        output_dir=work_folder,
+        extras=[log, context])
+    task_detect_blank_pages.active_if(bool(options.blank_pages))
+    task_detect_blank_pages.posttask(
+        partial(done_task, 'detect_blank_pages', context))
+
+    task_split_pages = pipeline.split(
+        split_pages,
+        task_repair_pdf,
+        os.path.join(work_folder, '*.page.pdf'),
+        extras=[log, context])
+    task_split_pages.follows(task_detect_blank_pages)
+    task_split_pages.posttask(partial(done_task, 'split_pages', context))
+
+    task_rasterize_preview_batch = pipeline.merge(
+        task_func=rasterize_preview_batch,
+        input=task_split_pages,
+        output=os.path.join(work_folder, 'preview.batch'),
+        extras=[log, context])
+    task_rasterize_preview_batch.active_if(
+        options.rotate_pages and options.rasterize_batch)
+    task_rasterize_preview_batch.posttask(
+        partial(done_task, 'rasterize_preview_batch', context))
+
+    task_rasterize_preview = pipeline.transform(
+        task_func=rasterize_preview,
+        input=task_split_pages,
+        filter=regex(r".*/(\d{6}(?:\.ocr|\.skip))\.page\.pdf"),
+        output=os.path.join(work_folder, r'\1.preview.jpg'),
+        extras=[log, context])
+    task_rasterize_preview.follows(task_rasterize_preview_batch)
+    task_rasterize_preview.active_if(options.rotate_pages)
+    task_rasterize_preview.posttask(
+        partial(done_task, 'rasterize_preview', context))
+
+    task_orient_page = pipeline.collate(
+        task_func=orient_page,
+        input=[task_split_pages, task_rasterize_preview],
+        filter=regex(
+            r".*/(\d{6})(\.ocr|\.skip)(?:\.page\.pdf|\.preview\.jpg)"),
+        output=os.path.join(work_folder, r'\1\2.oriented.pdf'),
+        extras=[log, context])
+    task_orient_page.posttask(partial(done_task, 'orient_page', context))
+
+    task_rasterize_batch = pipeline.merge(
+        task_func=rasterize_batch,
+        input=task_orient_page,
+        output=os.path.join(work_folder, 'rasterize.batch'),
+        extras=[log, context])
+    task_rasterize_batch.active_if(options.rasterize_batch)
+    task_rasterize_batch.posttask(
+        partial(done_task, 'rasterize_batch', context))
+
+    task_rasterize_with_ghostscript = pipeline.transform(
+        task_func=rasterize_with_ghostscript,
+        input=task_orient_page,
+        filter=suffix('.ocr.oriented.pdf'),
+        output='.page.png',
+        output_dir=work_folder,
+        extras=[log, context])
+    task_rasterize_with_ghostscript.follows(task_rasterize_batch)
+    task_rasterize_with_ghostscript.posttask(
+        partial(done_task, 'rasterize_with_ghostscript', context))
+
+    task_preprocess_remove_background = pipeline.transform(
+        task_func=preprocess_remove_background,
+        input=task_rasterize_with_ghostscript,
+        filter=suffix(".page.png"),
+        output=".pp-background.png",
+        extras=[log, context])
+    task_preprocess_remove_background.posttask(
+        partial(done_task, 'preprocess_remove_background', context))
+
+    task_preprocess_deskew = pipeline.transform(
+        task_func=preprocess_deskew,
+        input=task_preprocess_remove_background,
+        filter=suffix(".pp-background.png"),
+        output=".pp-deskew.png",
+        extras=[log, context])
+    task_preprocess_deskew.posttask(
+        partial(done_task, 'preprocess_deskew', context))
+
+    task_preprocess_clean = pipeline.transform(
+        task_func=preprocess_clean,
+        input=task_preprocess_deskew,
+        filter=suffix(".pp-deskew.png"),
+        output=".pp-clean.png",
+        extras=[log, context])
+    task_preprocess_clean.posttask(
+        partial(done_task, 'preprocess_clean', context))
+
+    task_ocr_tesseract_hocr = pipeline.transform(
+        task_func=ocr_tesseract_hocr,
+        input=task_preprocess_clean,
+        filter=suffix(".pp-clean.png"),
+        output=".hocr",
+        extras=[log, context])
+    task_ocr_tesseract_hocr.active_if(options.pdf_renderer == 'hocr')
+    task_ocr_tesseract_hocr.graphviz(fillcolor='"#00cc66"')
+    task_ocr_tesseract_hocr.posttask(
+        partial(done_task, 'ocr_tesseract_hocr', context))
+
+    task_select_image_for_pdf = pipeline.collate(
+        task_func=select_image_for_pdf,
+        input=[task_rasterize_with_ghostscript,
+               task_preprocess_remove_background,
+               task_preprocess_deskew,
+               task_preprocess_clean],
+        filter=regex(r".*/(\d{6})(?:\.page|\.pp-.*)\.png"),
+        output=os.path.join(work_folder, r'\1.image'),
+        extras=[log, context])
+    task_select_image_for_pdf.graphviz(shape='diamond')
+    task_select_image_for_pdf.posttask(
+        partial(done_task, 'select_image_for_pdf', context))
+
+    task_select_image_layer = pipeline.collate(
+        task_func=select_image_layer,
+        input=[task_select_image_for_pdf, task_orient_page],
+        filter=regex(r".*/(\d{6})(?:\.image|\.ocr\.oriented\.pdf)"),
+        output=os.path.join(work_folder, r'\1.image-layer.pdf'),
+        extras=[log, context])
+    task_select_image_layer.active_if(options.pdf_renderer == 'hocr')
+    task_select_image_layer.graphviz(
+        fillcolor='"#00cc66"', shape='diamond')
+    task_select_image_layer.posttask(
+        partial(done_task, 'select_image_layer', context))
+
+    task_render_hocr_page = pipeline.transform(
+        task_func=render_hocr_page,
+        input=task_ocr_tesseract_hocr,
+        filter=suffix('.hocr'),
+        output='.hocr.pdf',
+        extras=[log, context])
+    task_render_hocr_page.active_if(options.pdf_renderer == 'hocr')
+    task_render_hocr_page.graphviz(fillcolor='"#00cc66"')
+    task_render_hocr_page.posttask(
+        partial(done_task, 'render_hocr_page', context))
+
+    task_render_hocr_debug_page = pipeline.collate(
+        task_func=render_hocr_debug_page,
+        input=[task_select_image_for_pdf, task_ocr_tesseract_hocr],
+        filter=regex(r".*/(\d{6})(?:\.image|\.hocr)"),
+        output=os.path.join(work_folder, r'\1.debug.pdf'),
+        extras=[log, context])
+    task_render_hocr_debug_page.active_if(options.pdf_renderer == 'hocr')
+    task_render_hocr_debug_page.active_if(options.debug_rendering)
+    task_render_hocr_debug_page.graphviz(fillcolor='"#00cc66"')
+    task_render_hocr_debug_page.posttask(
+        partial(done_task, 'render_hocr_debug_page', context))
+
+    task_add_text_layer = pipeline.collate(
+        task_func=add_text_layer,
+        input=[task_render_hocr_page, task_select_image_layer],
+        filter=regex(r".*/(\d{6})(?:\.hocr\.pdf|\.image-layer\.pdf)"),
+        output=os.path.join(work_folder, r'\1.rendered.pdf'),
+        extras=[log, context])
+    task_add_text_layer.active_if(options.pdf_renderer == 'hocr')
+    task_add_text_layer.active_if(options.text_overlay == 'page')
+    task_add_text_layer.graphviz(fillcolor='"#00cc66"')
+    task_add_text_layer.posttask(partial(done_task, 'add_text_layer', context))
+
+    task_tesseract_ocr_and_render_pdf = pipeline.collate(
+        task_func=tesseract_ocr_and_render_pdf,
+        input=[task_select_image_for_pdf, task_orient_page],
+        filter=regex(r".*/(\d{6})(?:\.image|\.ocr\.oriented\.pdf)"),
+        output=os.path.join(work_folder, r'\1.rendered.pdf'),
+        extras=[log, context])
+    task_tesseract_ocr_and_render_pdf.active_if(
+        options.pdf_renderer == 'tesseract')
+    task_tesseract_ocr_and_render_pdf.graphviz(fillcolor='"#66ccff"')
+    task_tesseract_ocr_and_render_pdf.posttask(
+        partial(done_task, 'tesseract_ocr_and_render_pdf', context))
+
+    task_generate_postscript_stub = pipeline.transform(
+        task_func=generate_postscript_stub,
+        input=task_repair_pdf,
+        filter=formatter(r'\.repaired\.pdf'),
+        output=os.path.join(work_folder, 'pdfa_def.ps'),
+        extras=[log, context])
+    task_generate_postscript_stub.active_if(options.output_type == 'pdfa')
+    task_generate_postscript_stub.posttask(
+        partial(done_task, 'generate_postscript_stub', context))
+
+    task_skip_page = pipeline.transform(
+        task_func=skip_page,
+        input=task_orient_page,
+        filter=suffix('.skip.oriented.pdf'),
+        output='.done.pdf',
+        output_dir=work_folder,
+        extras=[log, context])
+    task_skip_page.posttask(partial(done_task, 'skip_page', context))
+
+    task_overlay_text_layers = pipeline.merge(
+        task_func=overlay_text_layers,
+        input=[task_render_hocr_page,
+               task_select_image_layer,
+               task_render_hocr_debug_page,
+               task_skip_page,
+               task_repair_pdf],
+        output=os.path.join(work_folder, 'overlaid.pdf'),
+        extras=[log, context])
+    task_overlay_text_layers.active_if(options.pdf_renderer == 'hocr')
+    task_overlay_text_layers.active_if(options.text_overlay == 'document')
+    task_overlay_text_layers.posttask(
+        partial(done_task, 'overlay_text_layers', context))
+
+    task_merge_pages_ghostscript = pipeline.merge(
+        task_func=merge_pages_ghostscript,
+        input=[task_add_text_layer,
+               task_render_hocr_debug_page,
+               task_skip_page,
+               task_tesseract_ocr_and_render_pdf,
+               task_overlay_text_layers,
+               task_generate_postscript_stub],
+        output=os.path.join(work_folder, 'merged.pdf'),
+        extras=[log, context])
+    task_merge_pages_ghostscript.active_if(options.output_type == 'pdfa')
+    task_merge_pages_ghostscript.posttask(
+        partial(done_task, 'merge_pages_ghostscript', context))
+
+    task_merge_pages_qpdf = pipeline.merge(
+        task_func=merge_pages_qpdf,
+        input=[task_add_text_layer,
+               task_render_hocr_debug_page,
+               task_skip_page,
+               task_tesseract_ocr_and_render_pdf,
+               task_overlay_text_layers,
+               task_repair_pdf],
+        output=os.path.join(work_folder, 'merged.pdf'),
+        extras=[log, context])
+    task_merge_pages_qpdf.active_if(options.output_type == 'pdf')
+    task_merge_pages_qpdf.posttask(
+        partial(done_task, 'merge_pages_qpdf', context))
+
+    task_copy_final = pipeline.merge(
+        task_func=copy_final,
+        input=[task_merge_pages_ghostscript, task_merge_pages_qpdf],
+        output=options.output_file,
+        extras=[log, context])
+    task_copy_final.posttask(partial(done_task, 'copy_final', context))
+
+    return pipeline
+
+
 def available_cpu_count():
     try:
-        return multiprocessing.cpu_count()
+        return sysresources.cpu_count()
     except NotImplementedError:
         pass
 
@@ -1377,6 +2692,39 @@ def available_cpu_count():
     return 1
 
 
+def plan_resources(options, pdfinfo, log):
+    """Size the job to the CPUs and memory this process may use
+
+    Unless options.jobs is set, as many pages are processed in parallel as
+    there are CPUs and as fit in memory next to each other, judged by the
+    largest page. CPUs left over go to tesseract's OpenMP threads, unless
+    OMP_THREAD_LIMIT or options.tesseract_threads is set already. The
+    environment of this process, which other jobs share, is not changed:
+    limit_tesseract_threads() applies the limit in the workers.
+    """
+    cpus = available_cpu_count()
+    if options.jobs:
+        jobs = options.jobs
+        threads = max(1, cpus // jobs)
+    else:
+        largest = max(
+            (sysresources.page_memory(
+                pageinfo, get_page_square_dpi(pageinfo, options))
+             for pageinfo in pdfinfo),
+            default=sysresources.PAGE_BASE_MEMORY)
+        jobs, threads = sysresources.plan_jobs(
+            cpus, sysresources.available_memory(), largest)
+        options.jobs = jobs
+    if options.tesseract_threads:
+        threads = options.tesseract_threads
+    elif 'OMP_THREAD_LIMIT' in os.environ:
+        threads = os.environ['OMP_THREAD_LIMIT']
+    else:
+        options.tesseract_threads = threads
+    log.debug("Using {0} parallel jobs with {1} tesseract threads".format(
+        jobs, threads))
+
+
 def cleanup_ruffus_error_message(msg):
     msg = re.sub(r'\s+', r' ', msg, re.MULTILINE)
     msg = re.sub(r"\((.+?)\)", r'\1', msg)
@@ -1384,7 +2732,7 @@ def cleanup_ruffus_error_message(msg):
     return msg
 
 
-def do_ruffus_exception(ruffus_five_tuple):
+def do_ruffus_exception(ruffus_five_tuple, options, log):
     """Replace the elaborate ruffus stack trace with a user friendly
     description of the error message that occurred."""
 
@@ -1395,25 +2743,25 @@ def do_ruffus_exception(ruffus_five_tuple):
         exit_code = getattr(ExitCode, exit_code_name, 'other_error')
         return exit_code
     elif exc_name == 'ruffus.ruffus_exceptions.MissingInputFileError':
-        _log.error(cleanup_ruffus_error_message(exc_value))
+        log.error(cleanup_ruffus_error_message(exc_value))
         return ExitCode.input_file
     elif exc_name == 'builtins.TypeError':
         # Even though repair_pdf will fail, ruffus will still try
         # to call split_pages with no input files, likely due to a bug
         if task_name == 'split_pages':
-            _log.error("Input file '{0}' is not a valid PDF".format(
+            log.error("Input file '{0}' is not a valid PDF".format(
                 options.input_file))
             return ExitCode.input_file
     elif exc_name == 'builtins.KeyboardInterrupt':
-        _log.error("Interrupted by user")
+        log.error("Interrupted by user")
         return ExitCode.ctrl_c
     elif exc_name == 'subprocess.CalledProcessError':
         # It's up to the subprocess handler to report something useful
         msg = "Error occurred while running this command:"
-        _log.error(msg + '\n' + exc_value)
+        log.error(msg + '\n' + exc_value)
         return ExitCode.child_process_error
     elif exc_name == 'ocrmypdf.main.PdfMergeFailedError':
-        _log.error(textwrap.dedent("""\
+        log.error(textwrap.dedent("""\
             Failed to merge PDF image layer with OCR layer
 
             Usually this happens because the input PDF file is mal-formed and
@@ -1425,7 +2773,7 @@ def do_ruffus_exception(ruffus_five_tuple):
         return ExitCode.input_file
     elif exc_name == 'PyPDF2.utils.PdfReadError' and \
             'not been decrypted' in exc_value:
-        _log.error(textwrap.dedent("""\
+        log.error(textwrap.dedent("""\
             Input PDF uses either an encryption algorithm or a PDF security
             handler that is not supported by ocrmypdf.
 
@@ -1438,11 +2786,11 @@ def do_ruffus_exception(ruffus_five_tuple):
         return ExitCode.encrypted_pdf
 
     if not options.verbose:
-        _log.error(exc_stack)
+        log.error(exc_stack)
     return ExitCode.other_error
 
 
-def traverse_ruffus_exception(e_args):
+def traverse_ruffus_exception(e_args, options, log):
     """Walk through a RethrownJobError and find the first exception.
 
     The exit code will be based on this, even if multiple exceptions occurred
@@ -1450,19 +2798,57 @@ def traverse_ruffus_exception(e_args):
 
     if isinstance(e_args, Sequence) and isinstance(e_args[0], str) and \
             len(e_args) == 5:
-        return do_ruffus_exception(e_args)
+        return do_ruffus_exception(e_args, options, log)
     elif is_iterable_notstr(e_args):
         for exc in e_args:
-            return traverse_ruffus_exception(exc)
+            return traverse_ruffus_exception(exc, options, log)
+
 
+def ocr_tiers(context):
+    "Report which pass of two pass OCR made the text of each page"
+    tiers = {OCR_TIER_FAST: 'fast', OCR_TIER_FULL: 'full'}
+    if not context.pages.exists():
+        return []
+    return [{'page': n + 1,
+             'tier': tiers[page['ocr_tier']],
+             'confidence': page.get('ocr_confidence')}
+            for n, page in enumerate(context.pages.all())
+            if 'ocr_tier' in page]
 
-def run_pipeline():
-    # Any changes to options will not take effect for options that are already
-    # bound to function parameters in the pipeline. (For example
-    # options.input_file, options.pdf_renderer are already bound.)
-    global options
-    if not options.jobs:
-        options.jobs = available_cpu_count()
+
+def run_pipeline(name, options, work_folder, log, context):
+    """Run the pipeline of a job, then collect its metrics
+
+    The metrics are left in context.metrics and, if requested, written to
+    the job's file named after options.metrics_file.
+    """
+    try:
+        return execute_pipeline(name, options, work_folder, log, context)
+    finally:
+        context.metrics = JobMetrics.load(
+            context.metrics_file, name=options.input_file)
+        context.metrics.work_folder_peak = context.work.usage()[1]
+        if options.two_pass_ocr:
+            context.metrics.ocr_tiers = ocr_tiers(context)
+        log.debug("Work folder peak usage: {0:.1f} MB".format(
+            context.metrics.work_folder_peak / 1000000))
+        bottleneck = context.metrics.bottleneck()
+        if bottleneck is not None:
+            log.debug("Slowest stage: {0} ({1:.2f} s wall, {2:.2f} s CPU)"
+                      .format(bottleneck.name, bottleneck.wall,
+                              bottleneck.cpu))
+        if options.metrics_file:
+            try:
+                context.metrics.write(
+                    job_file(options.metrics_file, options.input_file),
+                    options.metrics_format)
+            except OSError as e:
+                log.warning("Could not write metrics: {0}".format(e))
+
+
+def execute_pipeline(name, options, work_folder, log, context):
+    # The pipeline is built from the options of this job only, so any
+    # changes to options must be made before calling this function.
     try:
         options.history_file = os.path.join(
             work_folder, 'ruffus_history.sqlite')
@@ -1471,29 +2857,46 @@ def run_pipeline():
 
         if options.input_file == '-':
             # stdin
-            _log.info('reading file from standard input')
+            log.info('reading file from standard input')
             with open(start_input_file, 'wb') as stream_buffer:
                 from shutil import copyfileobj
                 copyfileobj(sys.stdin.buffer, stream_buffer)
         else:
             try:
-                re_symlink(options.input_file, start_input_file, _log)
+                re_symlink(options.input_file, start_input_file, log)
             except FileNotFoundError:
-                _log.error("File not found - " + options.input_file)
+                log.error("File not found - " + options.input_file)
                 return ExitCode.input_file
 
         if options.output_file == '-':
             if sys.stdout.isatty():
-                _log.error(textwrap.dedent("""\
+                log.error(textwrap.dedent("""\
                     Output was set to stdout '-' but it looks like stdout
                     is connected to a terminal.  Please redirect stdout to a
                     file."""))
                 return ExitCode.bad_args
 
-        cmdline.run(options)
+        pdfinfo = read_input_pageinfo(start_input_file, context, log)
+        plan_resources(options, pdfinfo, log)
+
+        if is_ocr_unnecessary(pdfinfo, log, options):
+            log.info("No page needs OCR - skipping the page pipeline")
+            convert_without_ocr(start_input_file, log, context)
+        else:
+            pipeline = build_pipeline(
+                name, options, work_folder, log, context)
+            try:
+                pipeline.run(
+                    multiprocess=options.jobs,
+                    verbose=int(options.verbose),
+                    history_file=options.history_file,
+                    verbose_abbreviated_path=(
+                        options.verbose_abbreviated_path))
+            finally:
+                Pipeline.pipelines.pop(name, None)
     except ruffus_exceptions.RethrownJobError as e:
         if options.verbose:
-            _log.debug(str(e))  # stringify exception so logger doesn't have to
+            log.debug(str(e))  # stringify exception so logger doesn't have to
 
         # Ruffus flattens exception to 5 element tuples. Because of a bug
         # in <= 2.6.3 it may present either the single:
@@ -1510,15 +2913,15 @@ def run_pipeline():
         # which is probably in another process, so it's better to log only
         # data from the exception at this point.
 
-        exitcode = traverse_ruffus_exception(e.args)
+        exitcode = traverse_ruffus_exception(e.args, options, log)
         if exitcode is None:
-            _log.error("Unexpected ruffus exception: " + str(e))
-            _log.error(repr(e))
+            log.error("Unexpected ruffus exception: " + str(e))
+            log.error(repr(e))
             return ExitCode.other_error
         else:
             return exitcode
     except Exception as e:
-        _log.error(e)
+        log.error(e)
         return ExitCode.other_error
 
     if options.output_file != '-':
@@ -1526,33 +2929,554 @@ def run_pipeline():
             pdfa_info = file_claims_pdfa(options.output_file)
             if pdfa_info['pass']:
                 msg = 'Output file is a {} (as expected)'
-                _log.info(msg.format(pdfa_info['conformance']))
+                log.info(msg.format(pdfa_info['conformance']))
             else:
                 msg = 'Output file is okay but is not PDF/A (seems to be {})'
-                _log.warning(msg.format(pdfa_info['conformance']))
+                log.warning(msg.format(pdfa_info['conformance']))
 
                 return ExitCode.invalid_output_pdf
-        if not qpdf.check(options.output_file, _log):
-            _log.warning('Output file: The generated PDF is INVALID')
+        if not qpdf.check(options.output_file, log):
+            log.warning('Output file: The generated PDF is INVALID')
             return ExitCode.invalid_output_pdf
     else:
-        _log.info("Output sent to stdout")
-
-    with _pdfinfo_lock:
-        if options.verbose:
-            from pprint import pformat
-            referent = _pdfinfo._getvalue()  # get the real list out of proxy
-            _log.debug(pformat(referent))
-        direction = {0: 'n', 90: 'e',
-                     180: 's', 270: 'w'}
-        orientations = []
-        for n, page in enumerate(_pdfinfo):
-            angle = _pdfinfo[n].get('rotated', 0)
-            if angle != 0:
-                orientations.append('{0}{1}'.format(
-                    n + 1,
-                    direction.get(angle, '')))
-        if orientations:
-            _log.info('Page orientations detected: ' + ' '.join(orientations))
+        log.info("Output sent to stdout")
+
+    pdfinfo = context.pages.all()
+    if options.verbose:
+        from pprint import pformat
+        log.debug(pformat(pdfinfo))
+    direction = {0: 'n', 90: 'e',
+                 180: 's', 270: 'w'}
+    orientations = []
+    for n, page in enumerate(pdfinfo):
+        angle = page.get('rotated', 0)
+        if angle != 0:
+            orientations.append('{0}{1}'.format(
+                n + 1,
+                direction.get(angle, '')))
+    if orientations:
+        log.info('Page orientations detected: ' + ' '.join(orientations))
+    if options.two_pass_ocr:
+        fast = sum(1 for page in pdfinfo
+                   if page.get('ocr_tier') == OCR_TIER_FAST)
+        full = sum(1 for page in pdfinfo
+                   if page.get('ocr_tier') == OCR_TIER_FULL)
+        if fast or full:
+            log.info('Two pass OCR: {0} pages from the fast pass, {1} OCRed '
+                     'again'.format(fast, full))
+    blank = sum(1 for page in pdfinfo if page.get('blank'))
+    if blank:
+        dropped = options.blank_pages == 'drop' and blank < len(pdfinfo)
+        log.info('Blank pages detected: {0} ({1})'.format(
+            blank, 'dropped' if dropped else 'not OCRed'))
 
     return ExitCode.ok
+
+
+# -------------
+# Deferred PDF/A
+
+# Niceness of the processes that convert documents to PDF/A
+PDFA_NICENESS = 10
+
+
+def file_signature(path):
+    st = os.stat(path)
+    return (st.st_size, st.st_mtime_ns)
+
+
+def convert_to_pdfa(input_file, options, signature=None):
+    """Convert the finished PDF input_file to PDF/A in place
+
+    The PDF/A file is written next to input_file and must pass the checks
+    that the pipeline applies to its own PDF/A output. It then replaces
+    input_file atomically, unless input_file no longer has the size and
+    modification time of signature. Returns True if it was replaced.
+    """
+    log = logging.getLogger(__name__)
+    directory = os.path.dirname(os.path.abspath(input_file))
+    with tempfile.TemporaryDirectory(prefix='.pdfa.', dir=directory) as tmp:
+        stub = os.path.join(tmp, 'pdfa.ps')
+        output_file = os.path.join(tmp, 'pdfa.pdf')
+        generate_pdfa_def(
+            stub, get_pdfmark(pypdf.PdfFileReader(input_file), options))
+        ghostscript.generate_pdfa([input_file, stub], output_file, log, 1)
+
+        pdfa_info = file_claims_pdfa(output_file)
+        if not pdfa_info['pass']:
+            log.warning("{0}: conversion produced no PDF/A (seems to be "
+                        "{1})".format(input_file, pdfa_info['conformance']))
+            return False
+        if not qpdf.check(output_file, log):
+            log.warning("{0}: the generated PDF/A is INVALID".format(
+                input_file))
+            return False
+        if signature is not None and file_signature(input_file) != signature:
+            log.info("{0}: changed during PDF/A conversion, left as it "
+                     "is".format(input_file))
+            return False
+        os.replace(output_file, input_file)
+    log.info("{0}: converted to {1}".format(
+        input_file, pdfa_info['conformance']))
+    return True
+
+
+class PdfaQueue:
+    """Convert finished documents to PDF/A one after the other
+
+    Conversions run in a separate process with lowered priority, so they
+    neither block the interactive OCR jobs nor compete with them for the
+    CPU. Ghostscript, started from that process, inherits its priority.
+    """
+
+    def __init__(self, options):
+        self.options = options
+        self.executor = ProcessPoolExecutor(
+            max_workers=1,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=os.nice, initargs=(PDFA_NICENESS,))
+
+    def submit(self, path):
+        """Queue the conversion of path and return its Future
+
+        The result of the Future is True once path was replaced by its
+        PDF/A version.
+        """
+        return self.executor.submit(
+            convert_to_pdfa, path, self.options, file_signature(path))
+
+    def shutdown(self, wait=True):
+        self.executor.shutdown(wait=wait)
+
+
+# -------------
+# Quick OCR
+
+QUICK_OCR_DPI = 150
+# Fraction of the first page, from the top, that holds the letterhead
+QUICK_OCR_REGION = 0.25
+QUICK_OCR_TIMEOUT = 10
+
+
+def rasterize_first_page(input_file, output_file, dpi, log):
+    """Render the first page of a PDF, or copy an image, as a gray PNG"""
+    with open(input_file, 'rb') as f:
+        is_pdf = f.read(4) == b'%PDF'
+    if not is_pdf:
+        with Image.open(input_file) as im:
+            im.convert('L').save(output_file, 'PNG')
+        return
+    args_gs = [
+        get_program('gs'),
+        '-dQUIET',
+        '-dSAFER',
+        '-dBATCH',
+        '-dNOPAUSE',
+        '-sDEVICE=pnggray',
+        '-r{0}'.format(dpi),
+        '-dFirstPage=1',
+        '-dLastPage=1',
+        '-o', output_file,
+        '-f', input_file]
+    p = subprocess.run(
+        args_gs, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+        universal_newlines=True, timeout=QUICK_OCR_TIMEOUT)
+    if p.stdout:
+        log.debug(p.stdout)
+    if p.returncode != 0:
+        raise subprocess.CalledProcessError(
+            p.returncode, args_gs, output=p.stdout)
+
+
+def quick_ocr(input_file, options=None, region=QUICK_OCR_REGION,
+              dpi=QUICK_OCR_DPI):
+    """Return the text of the top region of the first page of input_file
+
+    Only the letterhead, the top region fraction of the page, is rendered
+    at low resolution and recognized without any preprocessing, which
+    takes a second or two. Meant for suggesting metadata while the full
+    OCR of the document runs. options are checked options, by default
+    those of the engine of ocr(). Returns '' if that fails.
+    """
+    log = get_logger()
+    if options is None:
+        engine = get_engine()
+        engine.start()
+        options = engine.options
+    with tempfile.TemporaryDirectory(prefix='easydms.quick.') as tmpdir:
+        page = os.path.join(tmpdir, 'page.png')
+        top = os.path.join(tmpdir, 'top.png')
+        try:
+            rasterize_first_page(input_file, page, dpi, log)
+            with Image.open(page) as im:
+                im.crop((0, 0, im.width, max(1, int(im.height * region)))) \
+                    .save(top, 'PNG', dpi=(dpi, dpi))
+
+            text = call_tesseract_api(
+                tessworker.get_text, options, log, input_file=top,
+                language=options.language, timeout=QUICK_OCR_TIMEOUT)
+            if text is None:
+                args_tesseract = [
+                    get_program('tesseract'), top, 'stdout',
+                    '-l', '+'.join(options.language)]
+                text = subprocess.run(
+                    args_tesseract, stdout=subprocess.PIPE,
+                    stderr=subprocess.DEVNULL, check=True,
+                    universal_newlines=True,
+                    timeout=QUICK_OCR_TIMEOUT).stdout
+        except (subprocess.CalledProcessError, subprocess.TimeoutExpired,
+                OSError) as e:
+            log.warning("Quick OCR of {0} failed: {1}".format(input_file, e))
+            return ''
+    return text
+
+
+# -------------
+# Jobs
+
+OcrResult = namedtuple('OcrResult', ('input_file', 'output_file', 'exitcode'))
+
+
+def page_done_stages(options):
+    """Stages after which a page needs no more work of its own"""
+    if options.pdf_renderer == 'tesseract':
+        return ('tesseract_ocr_and_render_pdf', 'skip_page')
+    if options.text_overlay == 'document':
+        return ('render_hocr_page', 'skip_page')
+    return ('add_text_layer', 'skip_page')
+
+
+def count_output_pages(context):
+    """Number of pages that go through the page stages"""
+    pdfinfo = context.pages.all()
+    if context.options.blank_pages == 'drop':
+        kept = sum(1 for page in pdfinfo if not page.get('blank'))
+        if kept:
+            return kept
+    return len(pdfinfo)
+
+
+# Work folders of resumable jobs that were not touched for this many
+# seconds are removed
+RESUME_MAX_AGE = 7 * 24 * 3600
+
+
+class OcrJob:
+    """One document on its way through the OCR pipeline
+
+    A job owns its options, work folder, page information and output file,
+    so any number of jobs can be in flight in the same process. After run(),
+    metrics holds the easydms.ocrmetrics.JobMetrics of the pipeline.
+
+    If progress is given, it is called with an
+    easydms.ocrprogress.ProgressEvent whenever a page starts, a stage
+    finishes on it or it is done, and once at the end of the job. The calls
+    come from a thread of their own.
+
+    cancel() may be called from any thread to stop the job early.
+
+    Without output_file, the output is written to a folder of the engine
+    that close() removes, so move the result elsewhere before closing the
+    job. Jobs are context managers that close on exit.
+    """
+    _serial = itertools.count(1)
+
+    def __init__(self, engine, input_file, output_file=None, slots=None,
+                 progress=None):
+        self.options = copy.copy(engine.options)
+        self.options.input_file = input_file
+        if self.options.output_type == 'pdfa' and \
+                self.options.pdfa_deferred:
+            # PDF/A conversion is left to OcrEngine.defer_pdfa()
+            self.options.output_type = 'pdf'
+        # Folder of the default output, which the job owns
+        self.output_dir = None
+        if output_file is None:
+            self.output_dir = mkdtemp(prefix='job.', dir=engine.tmp_dir.name)
+            output_file = os.path.join(self.output_dir, 'output_file.pdf')
+        self.options.output_file = output_file
+        self.name = 'easydms.ocr.{0}'.format(next(OcrJob._serial))
+        self.slots = slots
+        self.progress = progress
+        self.cache = engine.cache
+        self.hocr_cache = engine.hocr_cache
+        self.work_folder = None
+        self.context = None
+        self.exitcode = None
+        self.metrics = None
+        self.cancelled = False
+        self.running = False
+        self.lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        "Remove the default output of the job"
+        if self.output_dir is not None:
+            shutil.rmtree(self.output_dir, ignore_errors=True)
+            self.output_dir = None
+
+    @property
+    def input_file(self):
+        return self.options.input_file
+
+    @property
+    def output_file(self):
+        return self.options.output_file
+
+    def run(self):
+        """Run the pipeline to completion and return its ExitCode
+
+        With a result cache, a document that was processed before with the
+        same options is copied from the cache instead. With
+        options.resume_dir, the work folder is kept unless the job completes
+        or is cancelled, see make_work_folder().
+        """
+        log = get_logger()
+        key = None
+        if (self.cache is not None or self.options.resume_dir) and \
+                '-' not in (self.input_file, self.output_file):
+            with suppress(OSError):
+                key = cache_key(self.options)
+            if key is not None and self.cache is not None and \
+                    self.cache.get(key, self.output_file):
+                log.info("{0}: using cached OCR result".format(
+                    self.input_file))
+                self.exitcode = ExitCode.ok
+                if self.progress is not None:
+                    self.progress(ProgressEvent(
+                        'job_done', self.input_file, None, None, 0, None,
+                        0.0, 0.0))
+                return self.exitcode
+
+        with self.lock:
+            if self.cancelled:
+                self.exitcode = ExitCode.ctrl_c
+                return self.exitcode
+            self.work_folder, folder_lock = self.make_work_folder(key, log)
+            context = self.context = JobContext(
+                self.options, self.work_folder, self.slots, self.hocr_cache)
+            context.clear_run_state()
+            self.running = True
+        monitor = None
+        if self.progress is not None:
+            monitor = ProgressMonitor(
+                context.metrics_file, self.progress, self.input_file,
+                page_done_stages(self.options),
+                partial(count_output_pages, context), log=log)
+            monitor.start()
+        try:
+            self.exitcode = run_pipeline(
+                self.name, self.options, self.work_folder, log, context)
+        finally:
+            with self.lock:
+                self.running = False
+            if monitor is not None:
+                monitor.stop()
+            self.metrics = context.metrics
+            context.pages.close()
+            if folder_lock is not None and not self.cancelled and \
+                    self.exitcode != ExitCode.ok:
+                log.info("{0}: work folder kept for resuming: {1}".format(
+                    self.input_file, self.work_folder))
+            else:
+                if not self.options.keep_temporary_files:
+                    context.work.remove_spill()
+                cleanup_working_files(self.work_folder, self.options)
+            if folder_lock is not None:
+                folder_lock.close()
+
+        if self.cancelled:
+            log.info("{0}: OCR cancelled".format(self.input_file))
+            self.exitcode = ExitCode.ctrl_c
+            if self.output_file != '-':
+                with suppress(FileNotFoundError):
+                    os.remove(self.output_file)
+        if key is not None and self.exitcode == ExitCode.ok:
+            try:
+                self.cache.put(key, self.output_file)
+            except OSError as e:
+                log.warning("Could not store OCR result in cache: {0}".format(
+                    e))
+        return self.exitcode
+
+    def make_work_folder(self, key, log):
+        """Return the work folder for run() and the lock held on it
+
+        With options.resume_dir, the folder is named after key, so a job
+        that did not complete before leaves its finished stages to the
+        next run with the same input and options. Otherwise, or if another
+        job uses that folder right now, a fresh folder without a lock is
+        returned.
+        """
+        resume_dir = self.options.resume_dir
+        if resume_dir and key is not None:
+            os.makedirs(resume_dir, exist_ok=True)
+            remove_stale(resume_dir, RESUME_MAX_AGE)
+            path = os.path.join(resume_dir, key)
+            resumed = os.path.isdir(path)
+            os.makedirs(path, exist_ok=True)
+            folder_lock = lock_folder(path)
+            if folder_lock is not None:
+                if resumed:
+                    log.info("{0}: resuming from {1}".format(
+                        self.input_file, path))
+                return path, folder_lock
+            log.info("{0}: already being processed, starting afresh".format(
+                self.input_file))
+        path = mkdtemp(
+            prefix="com.github.ocrmypdf.", dir=self.options.work_dir)
+        return path, None
+
+    def cancel(self):
+        """Stop the job as soon as possible
+
+        Stages that have not started yet exit right away and the programs
+        of running stages are terminated, so run() returns ExitCode.ctrl_c
+        promptly after removing the work folder and any partial output.
+        """
+        with self.lock:
+            self.cancelled = True
+            if not self.running:
+                return
+            with suppress(FileNotFoundError):
+                open(self.context.cancel_file, 'w').close()
+            interrupt_workers(self.context, get_logger())
+
+
+# Documents of OcrEngine.ocr_many() in flight at once
+DOCUMENTS_IN_FLIGHT = 2
+
+
+class OcrEngine:
+    """Validated OCR settings from which any number of OcrJobs are made
+
+    Creating an engine is cheap: dependencies and options are checked when
+    the first job is made. The default outputs of its jobs are kept in a
+    folder of the engine until the jobs are closed. If cache is an
+    easydms.ocrcache.FileCache, finished results are stored in it and reused
+    for identical input; hocr_cache does the same for single pages.
+
+    With options.pdfa_deferred, jobs produce plain PDFs; pass them, once
+    they have their final place, to defer_pdfa() for PDF/A conversion.
+    """
+
+    def __init__(self, options=None, cache=None, hocr_cache=None):
+        if options is None:
+            options = ocrOptions()
+        self.options = options
+        self.cache = cache
+        self.hocr_cache = hocr_cache
+        self.tmp_dir = None
+        self.pdfa_queue = None
+        self.lock = threading.Lock()
+
+    def start(self):
+        with self.lock:
+            if self.tmp_dir is None:
+                check_dependencies()
+                check_options(self.options)
+                self.tmp_dir = tempfile.TemporaryDirectory()
+
+    def defer_pdfa(self, path):
+        """Convert path to PDF/A in the background and replace it
+
+        Returns a concurrent.futures.Future whose result is True once path
+        was replaced.
+        """
+        with self.lock:
+            if self.pdfa_queue is None:
+                self.pdfa_queue = PdfaQueue(self.options)
+        return self.pdfa_queue.submit(path)
+
+    def job(self, input_file, output_file=None, slots=None, progress=None):
+        self.start()
+        return OcrJob(self, input_file, output_file, slots, progress)
+
+    def ocr_many(self, paths, jobs=None, documents=None, progress=None):
+        """OCR several documents at once and return a list of OcrResult
+
+        All documents share one budget of jobs worker slots, see
+        easydms.workerslots: every pipeline stage holds a slot while it
+        runs, and so does every further Ghostscript of batch rasterizing.
+        Up to documents pipelines, by default two, are in flight, so the
+        serial stages of one document (repair, split, merge, PDF/A
+        conversion) overlap with page OCR of the other. Each of them may use
+        all slots, but never more than are free. Results are returned in
+        the order of paths. progress receives the progress events of all
+        documents.
+
+        The outputs are temporary files that the caller removes; those of
+        documents that failed do not exist.
+        """
+        self.start()
+        paths = list(paths)
+        if not jobs:
+            jobs = self.options.jobs or available_cpu_count()
+        if not documents:
+            documents = DOCUMENTS_IN_FLIGHT
+
+        slot_dir = mkdtemp(prefix='slots.', dir=self.tmp_dir.name)
+        try:
+            slots = WorkerSlots(slot_dir, jobs)
+            ocrjobs = [self.job(path, temporary_output(), slots=slots,
+                                progress=progress)
+                       for path in paths]
+            for job in ocrjobs:
+                job.options.jobs = jobs
+            with ThreadPoolExecutor(max_workers=documents) as executor:
+                exitcodes = list(executor.map(OcrJob.run, ocrjobs))
+        finally:
+            shutil.rmtree(slot_dir, ignore_errors=True)
+
+        for job, exitcode in zip(ocrjobs, exitcodes):
+            if exitcode != ExitCode.ok:
+                with suppress(FileNotFoundError):
+                    os.remove(job.output_file)
+        return [OcrResult(job.input_file, job.output_file, exitcode)
+                for job, exitcode in zip(ocrjobs, exitcodes)]
+
+
+_engine = None
+_engine_lock = threading.Lock()
+
+
+def get_engine():
+    """Return the engine used by ocr(), creating it on first use"""
+    global _engine
+    with _engine_lock:
+        if _engine is None:
+            _engine = OcrEngine()
+    return _engine
+
+
+def temporary_output():
+    """Return the name of a new, empty file for an output the caller owns"""
+    fd, path = tempfile.mkstemp(prefix='easydms.', suffix='.pdf')
+    os.close(fd)
+    return path
+
+
+def ocr(input_file, progress=None):
+    """OCR input_file and return the name of the output
+
+    The output is a temporary file that the caller removes. It does not
+    exist if OCR failed.
+    """
+    job = get_engine().job(input_file, temporary_output(), progress=progress)
+    if job.run() == ExitCode.ok:
+        print("done")
+    else:
+        with suppress(FileNotFoundError):
+            os.remove(job.output_file)
+        print("error")
+
+    return job.output_file
+
+
+def ocr_many(paths, jobs=None, documents=None, progress=None):
+    return get_engine().ocr_many(paths, jobs, documents, progress)
@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of easydms.
+# Copyright (c) 2016 Peter Kessen
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject
+# to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+# OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4
+
+"""Live progress of OCR jobs
+
+The pipeline stages write their start and end to the metrics file of the
+job (see easydms.ocrmetrics). A ProgressMonitor follows that file from a
+thread of the process that runs the job and turns the records into
+ProgressEvents for a callback.
+"""
+
+import json
+import threading
+import time
+from collections import namedtuple
+
+ProgressEvent = namedtuple('ProgressEvent', (
+    'kind',         # 'page_started', 'stage_finished', 'page_done' or
+                    # 'job_done'
+    'input_file',   # the document of the job
+    'stage',        # the stage that finished, if any
+    'page',         # page number counted from 1, if any
+    'pages_done',
+    'pages_total',  # None until the document was split into pages
+    'elapsed',      # seconds since the job started
+    'eta',          # estimated seconds until the job is done, if known
+))
+
+
+class ProgressMonitor(object):
+    """Report the progress recorded in the metrics file path to callback
+
+    A page is done when one of page_done_stages has finished on it.
+    count_pages is called once the first page event arrives and returns
+    the number of pages that will be done.
+    """
+    def __init__(self, path, callback, input_file, page_done_stages,
+                 count_pages, interval=0.25, log=None):
+        self.path = path
+        self.callback = callback
+        self.input_file = input_file
+        self.page_done_stages = frozenset(page_done_stages)
+        self.count_pages = count_pages
+        self.interval = interval
+        self.log = log
+        self.started = set()
+        self.done = set()
+        self.total = None
+        self.offset = 0
+        self.start_time = time.time()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(
+            target=self._run, name='progress ' + str(self.input_file),
+            daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop following the file, report what is left and the job end"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.poll()
+        self._emit('job_done')
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.poll()
+
+    def _emit(self, kind, stage=None, page=None):
+        elapsed = time.time() - self.start_time
+        eta = None
+        if kind == 'job_done':
+            eta = 0.0
+        elif self.done and self.total:
+            eta = elapsed / len(self.done) * max(
+                0, self.total - len(self.done))
+        event = ProgressEvent(
+            kind, self.input_file, stage, page, len(self.done), self.total,
+            elapsed, eta)
+        try:
+            self.callback(event)
+        except Exception as e:
+            if self.log is not None:
+                self.log.warning("Progress callback failed: {0}".format(e))
+
+    def poll(self):
+        """Report the records written since the last poll"""
+        try:
+            with open(self.path, 'rb') as f:
+                f.seek(self.offset)
+                data = f.read()
+        except FileNotFoundError:
+            return
+        # A line may still be half written
+        end = data.rfind(b'\n') + 1
+        self.offset += end
+        for line in data[:end].splitlines():
+            if line.strip():
+                self.handle(json.loads(line.decode('utf-8')))
+
+    def handle(self, record):
+        page = record.get('page')
+        if page is not None and self.total is None:
+            self.total = self.count_pages()
+        if 'begin' in record:
+            if page is not None and page not in self.started:
+                self.started.add(page)
+                self._emit('page_started', record['stage'], page)
+        elif 'wall' in record:
+            self._emit('stage_finished', record['stage'], page)
+            if page is not None and page not in self.done and \
+                    record['stage'] in self.page_done_stages:
+                self.done.add(page)
+                self._emit('page_done', record['stage'], page)
@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of easydms.
+# Copyright (c) 2016 Peter Kessen
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject
+# to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+# OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4
+
+"""File-backed page information shared by all pipeline workers
+
+The page information of a document is computed once and written to a
+table file: a header, an index of offsets and one pickled dict per page.
+Workers map the table into memory and decode only the pages they touch,
+so looking up a page does not depend on the size of the document and
+needs no inter-process communication.
+
+The table itself is never rewritten. Values that stages find out later
+(e.g. the rotation applied by orient_page) go to a second file of fixed
+size records, one float64 per field and page, that is updated in place.
+"""
+
+import mmap
+import os
+import pickle
+import struct
+import threading
+
+_MAGIC = b'EDMSPGI1'
+_header = struct.Struct('<8sI')
+_offset = struct.Struct('<Q')
+_value = struct.Struct('<d')
+
+# Fields that can be updated after the table was written, with the type
+# their values are returned as
+UPDATE_FIELDS = (
+    ('rotated', int),
+    ('blank', bool),
+    ('passthrough', bool),
+    ('ocr_dpi', float),
+    ('ocr_tier', int),
+    ('ocr_confidence', float),
+)
+
+_RECORD_SIZE = _value.size * len(UPDATE_FIELDS)
+_NOT_SET = float('nan')
+
+# Per process cache of mapped tables, by path
+_tables = {}
+_tables_lock = threading.Lock()
+
+
+class _Table(object):
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.count = _header.unpack_from(self.map, 0)
+        if magic != _MAGIC:
+            raise ValueError("{0} is not a page info table".format(path))
+        self.pages = [None] * self.count
+
+    def page(self, pageno):
+        if self.pages[pageno] is None:
+            base = _header.size + pageno * _offset.size
+            start, = _offset.unpack_from(self.map, base)
+            end, = _offset.unpack_from(self.map, base + _offset.size)
+            self.pages[pageno] = pickle.loads(self.map[start:end])
+        return self.pages[pageno]
+
+
+class PageInfoStore(object):
+    """Page information of one document, by zero based page number
+
+    Only the path is pickled, so stores can be passed to worker processes
+    freely.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.updates_path = path + '.updates'
+
+    def __repr__(self):
+        return '{0}({1!r})'.format(self.__class__.__name__, self.path)
+
+    def __len__(self):
+        return self._table().count
+
+    def exists(self):
+        return os.path.exists(self.path)
+
+    def write(self, pageinfos):
+        """Create the table from a sequence of page info dicts"""
+        blobs = [pickle.dumps(dict(page), pickle.HIGHEST_PROTOCOL)
+                 for page in pageinfos]
+        offset = _header.size + (len(blobs) + 1) * _offset.size
+        index = []
+        for blob in blobs:
+            index.append(_offset.pack(offset))
+            offset += len(blob)
+        index.append(_offset.pack(offset))
+
+        with open(self.updates_path, 'wb') as f:
+            f.write(_value.pack(_NOT_SET) * len(UPDATE_FIELDS) * len(blobs))
+        tmpname = self.path + '.tmp'
+        with open(tmpname, 'wb') as f:
+            f.write(_header.pack(_MAGIC, len(blobs)))
+            f.writelines(index)
+            f.writelines(blobs)
+        os.replace(tmpname, self.path)
+        self.close()
+
+    def _table(self):
+        with _tables_lock:
+            table = _tables.get(self.path)
+            if table is None:
+                table = _tables[self.path] = _Table(self.path)
+            return table
+
+    def get(self, pageno):
+        """Return a copy of the page info dict of page pageno"""
+        pageinfo = self._table().page(pageno).copy()
+        with open(self.updates_path, 'rb') as f:
+            f.seek(pageno * _RECORD_SIZE)
+            record = f.read(_RECORD_SIZE)
+        for n, (field, convert) in enumerate(UPDATE_FIELDS):
+            value, = _value.unpack_from(record, n * _value.size)
+            if value == value:  # not NaN
+                pageinfo[field] = convert(value)
+        return pageinfo
+
+    def update(self, pageno, field, value):
+        """Set field of page pageno; field must be one of UPDATE_FIELDS"""
+        n = [name for name, _ in UPDATE_FIELDS].index(field)
+        with open(self.updates_path, 'r+b') as f:
+            f.seek(pageno * _RECORD_SIZE + n * _value.size)
+            f.write(_value.pack(float(value)))
+
+    def close(self):
+        """Release the mapping of the table in this process"""
+        with _tables_lock:
+            table = _tables.pop(self.path, None)
+        if table is not None:
+            table.map.close()
+
+    def all(self):
+        """Return the page info dicts of all pages"""
+        return [self.get(n) for n in range(len(self))]
@@ -0,0 +1,180 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of easydms.
+# Copyright (c) 2016 Peter Kessen
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject
+# to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+# OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4
+
+"""Assembling PDF documents from many single page PDFs with pikepdf
+
+Pages rendered one by one each carry their own copy of shared resources,
+most notably the font of the invisible text layer. While the pages are
+appended to the output, resources whose content is identical to one seen
+before are replaced by that one, so every font ends up in the output only
+once. Page content is not loaded into memory: qpdf copies the streams
+from the input files while the output is written. Therefore the inputs
+stay open until then, and long lists of inputs are merged in batches.
+"""
+
+import hashlib
+import os
+
+try:
+    import pikepdf
+except ImportError:
+    pikepdf = None
+
+# Resource categories that are shared between pages
+SHARED_RESOURCES = ('/Font', '/ExtGState', '/ColorSpace')
+
+# Input files that are open at the same time while merging
+MERGE_BATCH = 64
+
+
+def available():
+    return pikepdf is not None
+
+
+def object_digest(obj, memo):
+    """Return a digest of the content of the pikepdf object obj
+
+    Indirect objects are digested once; memo maps their object and
+    generation numbers to their digests, which also breaks cycles.
+    """
+    objgen = obj.objgen if getattr(obj, 'is_indirect', False) else None
+    if objgen is not None:
+        if objgen in memo:
+            return memo[objgen]
+        memo[objgen] = 'cycle {0} {1}'.format(*objgen)
+
+    h = hashlib.sha256()
+    if isinstance(obj, pikepdf.Stream):
+        h.update(b'stream')
+        h.update(obj.read_raw_bytes())
+        items = ((k, v) for k, v in obj.stream_dict.items() if k != '/Length')
+        for key, value in sorted(items):
+            h.update(key.encode('utf-8'))
+            h.update(object_digest(value, memo).encode('ascii'))
+    elif isinstance(obj, pikepdf.Dictionary):
+        h.update(b'dict')
+        for key in sorted(obj.keys()):
+            h.update(key.encode('utf-8'))
+            h.update(object_digest(obj[key], memo).encode('ascii'))
+    elif isinstance(obj, pikepdf.Array):
+        h.update(b'array')
+        for item in obj:
+            h.update(object_digest(item, memo).encode('ascii'))
+    else:
+        h.update(repr(obj).encode('utf-8'))
+    digest = h.hexdigest()
+    if objgen is not None:
+        memo[objgen] = digest
+    return digest
+
+
+class ResourceDeduplicator(object):
+    """Replace resources of pages by identical ones seen on earlier pages"""
+    def __init__(self):
+        self.canonical = {}
+        self.memo = {}
+        self.replaced = 0
+
+    def __call__(self, page):
+        resources = page.obj.get('/Resources')
+        if resources is None:
+            return
+        for category in SHARED_RESOURCES:
+            entries = resources.get(category)
+            if not isinstance(entries, pikepdf.Dictionary):
+                continue
+            for name in list(entries.keys()):
+                resource = entries[name]
+                if not resource.is_indirect:
+                    continue
+                digest = object_digest(resource, self.memo)
+                canonical = self.canonical.setdefault(digest, resource)
+                if canonical.objgen != resource.objgen:
+                    entries[name] = canonical
+                    self.replaced += 1
+
+
+def part_name(output_file, index):
+    """Return the name of the index'th temporary part of output_file"""
+    root, ext = os.path.splitext(output_file)
+    return '{0}.part{1:04d}{2}'.format(root, index, ext)
+
+
+def remove_parts(parts):
+    for part in parts:
+        try:
+            os.unlink(part)
+        except FileNotFoundError:
+            pass
+
+
+def _merge(input_files, output_file, docinfo, log):
+    pdf = pikepdf.new()
+    sources = []
+    dedup = ResourceDeduplicator()
+    try:
+        for filename in input_files:
+            source = pikepdf.open(filename)
+            sources.append(source)
+            for page in source.pages:
+                pdf.pages.append(page)
+                dedup(pikepdf.Page(pdf.pages[-1]))
+
+        for key, value in docinfo.items():
+            if value:
+                pdf.docinfo[pikepdf.Name(key)] = value
+        pdf.save(output_file,
+                 object_stream_mode=pikepdf.ObjectStreamMode.generate)
+        log.debug("Merged {0} files, {1} duplicate resources removed".format(
+            len(input_files), dedup.replaced))
+    finally:
+        pdf.close()
+        for source in sources:
+            source.close()
+
+
+def merge(input_files, output_file, docinfo, log, batch=MERGE_BATCH):
+    """Write the pages of all input_files in order to output_file
+
+    docinfo is a dict of document info entries like '/Title'; empty values
+    are left out. At most batch input files are open at once: longer lists
+    are first merged in runs of batch files into temporary parts next to
+    output_file, which are removed again.
+    """
+    input_files = list(input_files)
+    parts = []
+    try:
+        while len(input_files) > batch:
+            merged = []
+            for start in range(0, len(input_files), batch):
+                part = part_name(output_file, len(parts))
+                parts.append(part)
+                _merge(input_files[start:start + batch], part, {}, log)
+                merged.append(part)
+            input_files = merged
+        _merge(input_files, output_file, docinfo, log)
+    finally:
+        remove_parts(parts)
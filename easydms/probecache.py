@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of easydms.
+# Copyright (c) 2016 Peter Kessen
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject
+# to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+# OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4
+
+"""On-disk cache for capability probes of external programs
+
+Asking tesseract for its version or its languages costs a process start
+every time, while the answer only changes when the binary is replaced.
+Results are therefore stored per binary path and invalidated by the
+binary's modification time and size. Probes whose answer also depends on
+other files, like the languages on the traineddata files of tesseract,
+name these files or their directories, whose modification times are
+checked as well.
+"""
+
+import json
+import os
+import shutil
+import tempfile
+import threading
+from contextlib import suppress
+
+import easydms.config
+
+PROBE_CACHE_FILENAME = 'probes.json'
+
+
+class ProbeCache(object):
+    """Remember the results of probing external programs
+
+    The cache file is only read on the first lookup, so creating an instance
+    is free of side effects.
+    """
+    def __init__(self, path=None):
+        if path is None:
+            path = os.path.join(easydms.config.cache_location(),
+                                PROBE_CACHE_FILENAME)
+        self.path = path
+        self.data = None
+        self.lock = threading.Lock()
+
+    def _load(self):
+        try:
+            with open(self.path, 'r') as f:
+                self.data = json.load(f)
+        except (OSError, ValueError):
+            self.data = {}
+
+    def _save(self):
+        directory = os.path.dirname(self.path)
+        with suppress(OSError):
+            os.makedirs(directory, exist_ok=True)
+            fd, tmpname = tempfile.mkstemp(dir=directory, suffix='.tmp')
+            try:
+                with os.fdopen(fd, 'w') as f:
+                    json.dump(self.data, f, indent=1, sort_keys=True)
+                os.replace(tmpname, self.path)
+            except OSError:
+                os.unlink(tmpname)
+                raise
+
+    def get(self, program, probe, func, depends=()):
+        """Return the result of func() for the named probe of program
+
+        program is a name on the PATH or a path to the binary. The result
+        of func must be serializable as JSON. If the binary cannot be found
+        func is called every time so that it can report the problem.
+        depends lists further paths the result depends on; it is probed
+        again when one of them appears, disappears or is modified.
+        """
+        binary = shutil.which(program)
+        if binary is None:
+            return func()
+        binary = os.path.realpath(binary)
+        st = os.stat(binary)
+        stamp = [st.st_mtime_ns, st.st_size]
+        depends_stamp = [[path, path_mtime(path)] for path in depends] or None
+
+        with self.lock:
+            if self.data is None:
+                self._load()
+            entry = self.data.get(binary, {})
+            if entry.get('stamp') == stamp and probe in entry and \
+                    entry.get('depends', {}).get(probe) == depends_stamp:
+                return entry[probe]
+
+        value = func()
+
+        with self.lock:
+            entry = self.data.get(binary, {})
+            if entry.get('stamp') != stamp:
+                entry = {'stamp': stamp}
+            entry[probe] = value
+            if depends_stamp is None:
+                entry.get('depends', {}).pop(probe, None)
+            else:
+                entry.setdefault('depends', {})[probe] = depends_stamp
+            self.data[binary] = entry
+            self._save()
+        return value
+
+
+def path_mtime(path):
+    """Modification time of path in ns, or None if it does not exist"""
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of easydms.
+# Copyright (c) 2016 Peter Kessen
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject
+# to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+# OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4
+
+"""Processes and their children as seen in /proc
+
+A cancelled OCR job has to stop the ghostscript, tesseract and unpaper
+processes started by its pipeline workers. Python keeps no record of the
+children of other processes, so they are looked up in /proc. Elsewhere
+no children are found and only the processes named directly are
+signalled.
+
+proc is the mount point of procfs so the lookup can be tested on a fake
+file system.
+"""
+
+import os
+import signal
+
+
+def parent_pid(pid, proc='/proc'):
+    """Return the parent of process pid, or None if it has gone"""
+    try:
+        with open(os.path.join(proc, str(pid), 'stat')) as f:
+            stat = f.read()
+    except (OSError, UnicodeDecodeError):
+        return None
+    # The command name in parentheses may contain spaces and parentheses
+    fields = stat.rpartition(')')[2].split()
+    try:
+        return int(fields[1])
+    except (IndexError, ValueError):
+        return None
+
+
+def command_line(pid, proc='/proc'):
+    """Return the arguments of process pid, or [] if it has gone"""
+    try:
+        with open(os.path.join(proc, str(pid), 'cmdline'), 'rb') as f:
+            cmdline = f.read()
+    except OSError:
+        return []
+    return [arg.decode('utf-8', 'replace')
+            for arg in cmdline.split(b'\0') if arg]
+
+
+def descendants(pid, proc='/proc'):
+    """Return the children of process pid, their children and so on
+
+    Parents come before their children.
+    """
+    try:
+        pids = [int(entry) for entry in os.listdir(proc) if entry.isdigit()]
+    except OSError:
+        return []
+    children = {}
+    for other in pids:
+        children.setdefault(parent_pid(other, proc), []).append(other)
+    found = []
+    pending = [pid]
+    while pending:
+        for child in sorted(children.get(pending.pop(0), [])):
+            found.append(child)
+            pending.append(child)
+    return found
+
+
+def send_signal(pids, sig=signal.SIGTERM):
+    """Send sig to every process of pids that still exists
+
+    Returns the number of processes that were signalled.
+    """
+    count = 0
+    for pid in pids:
+        try:
+            os.kill(pid, sig)
+        except (ProcessLookupError, PermissionError):
+            continue
+        count += 1
+    return count
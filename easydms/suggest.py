@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of easydms.
+# Copyright (c) 2016 Peter Kessen
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject
+# to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+# OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4
+
+"""Suggestions for the metadata of a document from its OCRed text
+
+The letterhead of a document usually names the sender and the date of
+the letter. Dates are found in the common German and English notations;
+company names are the known ones (the folders of the DMS) that appear in
+the text, tolerating a few OCR errors.
+"""
+
+import datetime
+import difflib
+import re
+from collections import namedtuple
+
+Suggestions = namedtuple('Suggestions', ('text', 'dates', 'companies'))
+
+MONTHS = {
+    'jan': 1, 'januar': 1, 'january': 1, 'jänner': 1,
+    'feb': 2, 'februar': 2, 'february': 2,
+    'mär': 3, 'mar': 3, 'märz': 3, 'march': 3,
+    'apr': 4, 'april': 4,
+    'mai': 5, 'may': 5,
+    'jun': 6, 'juni': 6, 'june': 6,
+    'jul': 7, 'juli': 7, 'july': 7,
+    'aug': 8, 'august': 8,
+    'sep': 9, 'sept': 9, 'september': 9,
+    'okt': 10, 'oct': 10, 'oktober': 10, 'october': 10,
+    'nov': 11, 'november': 11,
+    'dez': 12, 'dec': 12, 'dezember': 12, 'december': 12,
+}
+
+_month_names = '|'.join(sorted(MONTHS, key=len, reverse=True))
+
+# Each pattern captures day, month and year by name
+DATE_PATTERNS = (
+    # 24.12.2016, 24.12.16, 24/12/2016, 24-12-2016
+    re.compile(r'\b(?P<day>\d{1,2})\s?[./-]\s?(?P<month>\d{1,2})\s?[./-]'
+               r'\s?(?P<year>\d{4}|\d{2})\b'),
+    # 2016-12-24
+    re.compile(r'\b(?P<year>\d{4})-(?P<month>\d{1,2})-(?P<day>\d{1,2})\b'),
+    # 24. Dezember 2016, 24 Dec. 2016
+    re.compile(r'\b(?P<day>\d{1,2})\.?\s*(?P<month>%s)\.?\s*'
+               r'(?P<year>\d{4})\b' % _month_names, re.IGNORECASE),
+    # December 24, 2016
+    re.compile(r'\b(?P<month>%s)\.?\s*(?P<day>\d{1,2})'
+               r'(?:st|nd|rd|th)?,?\s*(?P<year>\d{4})\b' % _month_names,
+               re.IGNORECASE),
+)
+
+# Two digit years up to this are taken to be in this century
+TWO_DIGIT_YEAR_PIVOT = 69
+
+# Known company names must resemble text this much to be suggested
+COMPANY_MIN_SIMILARITY = 0.85
+
+
+def _year(text):
+    year = int(text)
+    if len(text) == 2:
+        year += 2000 if year <= TWO_DIGIT_YEAR_PIVOT else 1900
+    return year
+
+
+def find_dates(text):
+    """Return the valid dates in text, in order of appearance
+
+    A date that appears more than once is returned once, at its first
+    position.
+    """
+    found = []
+    for pattern in DATE_PATTERNS:
+        for match in pattern.finditer(text):
+            month = match.group('month')
+            if month.isdigit():
+                month = int(month)
+            else:
+                month = MONTHS[month.lower()]
+            try:
+                date = datetime.date(
+                    _year(match.group('year')), month,
+                    int(match.group('day')))
+            except ValueError:
+                continue
+            found.append((match.start(), date))
+    dates = []
+    for _, date in sorted(found, key=lambda item: item[0]):
+        if date not in dates:
+            dates.append(date)
+    return dates
+
+
+def _normalize(text):
+    return ' '.join(re.findall(r'\w+', text.lower()))
+
+
+def company_score(name, text):
+    """Return how well the company name appears in text, from 0 to 1
+
+    The name is compared with every run of as many words of the text, so
+    a letter misread by OCR costs a little similarity only. Names only match
+    whole words: a run that merely contains the name, like "Baumarkt" for
+    "Bau", does not count.
+    """
+    name = _normalize(name)
+    if not name:
+        return 0.0
+    words = _normalize(text).split()
+    if ' {0} '.format(name) in ' {0} '.format(' '.join(words)):
+        return 1.0
+    size = len(name.split())
+    best = 0.0
+    matcher = difflib.SequenceMatcher(b=name, autojunk=False)
+    for start in range(max(1, len(words) - size + 1)):
+        window = ' '.join(words[start:start + size])
+        if name in window:
+            continue
+        matcher.set_seq1(window)
+        if matcher.real_quick_ratio() > best and matcher.quick_ratio() > best:
+            best = max(best, matcher.ratio())
+    return best
+
+
+def find_companies(text, names):
+    """Return the known company names that appear in text, best first"""
+    scored = []
+    for name in names:
+        score = company_score(name, text)
+        if score >= COMPANY_MIN_SIMILARITY:
+            scored.append((score, name))
+    scored.sort(key=lambda item: (-item[0], item[1]))
+    return [name for _, name in scored]
+
+
+def suggest(text, names):
+    """Return the Suggestions for a document whose text starts with text"""
+    return Suggestions(text, find_dates(text), find_companies(text, names))
@@ -0,0 +1,184 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of easydms.
+# Copyright (c) 2016 Peter Kessen
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject
+# to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+# OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4
+
+"""CPUs and memory that this process may actually use
+
+Inside a container the host's CPU count and memory size are meaningless:
+the cgroup of the container limits the CPU time (a quota per period) and
+the memory. Starting one job per host CPU then makes the jobs fight over
+a few CPUs and run out of memory. The functions here take cgroup v1 and
+v2 limits and the CPU affinity of the process into account.
+
+All paths are relative to sysroot so the detection can be tested on a
+fake file system.
+"""
+
+import math
+import os
+
+# Limits of cgroup v1 above this value mean "no limit"
+_UNLIMITED = 1 << 60
+
+# Rough memory needs of OCRing one page: tesseract with its language
+# models plus the page raster and its preprocessed copies
+PAGE_BASE_MEMORY = 200 * 1024 * 1024
+BYTES_PER_PIXEL = 4
+RASTER_COPIES = 6
+
+
+def _read(sysroot, path):
+    try:
+        with open(os.path.join(sysroot, path.lstrip('/'))) as f:
+            return f.read().strip()
+    except (OSError, UnicodeDecodeError):
+        return None
+
+
+def _cgroup_paths(sysroot):
+    """Return the cgroup path of this process per controller
+
+    The cgroup v2 hierarchy is returned under the key ''.
+    """
+    paths = {}
+    content = _read(sysroot, '/proc/self/cgroup') or ''
+    for line in content.splitlines():
+        parts = line.split(':', 2)
+        if len(parts) != 3:
+            continue
+        for controller in parts[1].split(','):
+            paths[controller] = parts[2]
+    return paths
+
+
+def _candidates(mount, path):
+    """Directories from the cgroup of the process up to the root
+
+    In a container with its own cgroup namespace, the path does not exist
+    below the mount point and the root is the cgroup of the container.
+    """
+    dirs = []
+    path = path or '/'
+    while True:
+        dirs.append(os.path.join(mount, path.lstrip('/')))
+        if path in ('/', ''):
+            break
+        path = os.path.dirname(path)
+    return dirs
+
+
+def _v1_dir(sysroot, controller, paths):
+    for name in (controller, controller + ',cpuacct', 'cpuacct,' + controller):
+        mount = os.path.join('/sys/fs/cgroup', name)
+        if os.path.isdir(os.path.join(sysroot, mount.lstrip('/'))):
+            return _candidates(mount, paths.get(controller))
+    return []
+
+
+def cgroup_cpu_limit(sysroot='/'):
+    """Return the number of CPUs the cgroup quota allows, or None"""
+    paths = _cgroup_paths(sysroot)
+    limits = []
+    if '' in paths:
+        for d in _candidates('/sys/fs/cgroup', paths['']):
+            content = _read(sysroot, os.path.join(d, 'cpu.max'))
+            if content:
+                quota, _, period = content.partition(' ')
+                if quota != 'max' and period:
+                    limits.append(int(quota) / int(period))
+    for d in _v1_dir(sysroot, 'cpu', paths):
+        quota = _read(sysroot, os.path.join(d, 'cpu.cfs_quota_us'))
+        period = _read(sysroot, os.path.join(d, 'cpu.cfs_period_us'))
+        if quota and period and int(quota) > 0 and int(period) > 0:
+            limits.append(int(quota) / int(period))
+    return min(limits) if limits else None
+
+
+def cgroup_memory_limit(sysroot='/'):
+    """Return the memory limit of the cgroup in bytes, or None"""
+    paths = _cgroup_paths(sysroot)
+    limits = []
+    if '' in paths:
+        for d in _candidates('/sys/fs/cgroup', paths['']):
+            content = _read(sysroot, os.path.join(d, 'memory.max'))
+            if content and content != 'max':
+                limits.append(int(content))
+    for d in _v1_dir(sysroot, 'memory', paths):
+        content = _read(sysroot, os.path.join(d, 'memory.limit_in_bytes'))
+        if content and int(content) < _UNLIMITED:
+            limits.append(int(content))
+    return min(limits) if limits else None
+
+
+def available_memory(sysroot='/'):
+    """Return the memory available to this process in bytes, or None"""
+    limits = []
+    meminfo = _read(sysroot, '/proc/meminfo') or ''
+    for line in meminfo.splitlines():
+        if line.startswith('MemAvailable:'):
+            limits.append(int(line.split()[1]) * 1024)
+    cgroup = cgroup_memory_limit(sysroot)
+    if cgroup is not None:
+        limits.append(cgroup)
+    return min(limits) if limits else None
+
+
+def cpu_count(sysroot='/'):
+    """Return the number of CPUs this process can use
+
+    Raises NotImplementedError if the number of CPUs is unknown.
+    """
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cpus = os.cpu_count()
+    if not cpus:
+        raise NotImplementedError("Could not get CPU count")
+    quota = cgroup_cpu_limit(sysroot)
+    if quota is not None:
+        cpus = min(cpus, max(1, int(math.ceil(quota))))
+    return cpus
+
+
+def page_memory(pageinfo, dpi):
+    """Estimate the memory needed to OCR a page at dpi in bytes"""
+    width = pageinfo.get('width_inches', 8.5) * dpi
+    height = pageinfo.get('height_inches', 11) * dpi
+    pixels = width * height
+    return PAGE_BASE_MEMORY + int(pixels * BYTES_PER_PIXEL * RASTER_COPIES)
+
+
+def plan_jobs(cpus, memory=None, page_memory=PAGE_BASE_MEMORY):
+    """Return (jobs, threads): parallel pages and OpenMP threads per page
+
+    As many pages as there are CPUs are processed at once, unless they
+    would not fit in memory; CPUs left over go to tesseract's threads.
+    """
+    jobs = cpus
+    if memory is not None:
+        jobs = min(jobs, memory // max(1, page_memory))
+    jobs = max(1, jobs)
+    threads = max(1, cpus // jobs)
+    return jobs, threads
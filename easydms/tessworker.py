@@ -0,0 +1,216 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of easydms.
+# Copyright (c) 2016 Peter Kessen
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject
+# to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+# OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4
+
+"""Tesseract running inside the pipeline worker processes
+
+Starting the tesseract program for every page reloads its language models
+each time, which takes longer than recognizing a light page. If tesserocr
+is installed, every worker process instead keeps one initialized
+tesseract API per set of languages and settings and feeds it page after
+page. The pipeline has one worker process per CPU, so the models are
+loaded once per CPU. An API must not be used by two threads at once, so
+stages that run in threads of the same process each get their own.
+
+All functions raise TesseractApiError if the API cannot do the job; the
+caller is expected to fall back to the tesseract program then.
+
+tesserocr is imported on first use, not with this module: it loads
+tesseract's OpenMP runtime, which reads OMP_THREAD_LIMIT only at that
+moment. The pipeline sets the thread limit of a worker process before its
+first stage runs, so the API obeys it. If the limit changed after tesserocr
+was loaded, for instance in a worker forked from a process that used the
+API before, available() is False and the program, which reads the limit
+anew, runs instead.
+"""
+
+import os
+import shutil
+import threading
+from collections import namedtuple
+
+from PIL import Image
+
+# tesserocr once load() imported it, None if it is not installed
+tesserocr = None
+_loaded = False
+# OMP_THREAD_LIMIT at the time tesserocr was imported
+_thread_limit = None
+
+OrientationConfidence = namedtuple(
+    'OrientationConfidence', ('angle', 'confidence'))
+
+HOCR_TEMPLATE = """<?xml version="1.0" encoding="UTF-8"?>
+<!DOCTYPE html PUBLIC "-//W3C//DTD XHTML 1.0 Transitional//EN"
+    "http://www.w3.org/TR/xhtml1/DTD/xhtml1-transitional.dtd">
+<html xmlns="http://www.w3.org/1999/xhtml" xml:lang="en" lang="en">
+ <head>
+  <title></title>
+  <meta http-equiv="Content-Type" content="text/html;charset=utf-8" />
+  <meta name='ocr-system' content='tesseract {version}' />
+  <meta name='ocr-capabilities' content='{capabilities}'/>
+ </head>
+ <body>
+{page}
+ </body>
+</html>
+"""
+
+NULL_PAGE = "<div class='ocr_page' id='page_1' title='bbox 0 0 {0} {1}'></div>"
+
+# Initialized APIs of the current thread, in the attribute apis by
+# (languages, page segmentation mode, config files, purpose)
+_local = threading.local()
+
+
+class TesseractApiError(Exception):
+    pass
+
+
+def load():
+    """Import tesserocr unless done already; True if it is installed"""
+    global tesserocr, _loaded, _thread_limit
+    if not _loaded:
+        try:
+            import tesserocr as module
+        except ImportError:
+            module = None
+        tesserocr = module
+        _thread_limit = os.environ.get('OMP_THREAD_LIMIT')
+        _loaded = True
+    return tesserocr is not None
+
+
+def available():
+    """Whether the API is installed and obeys the current thread limit"""
+    return load() and _thread_limit == os.environ.get('OMP_THREAD_LIMIT')
+
+
+def _language(language):
+    if not language:
+        return 'eng'
+    if isinstance(language, str):
+        return language
+    return '+'.join(language)
+
+
+def get_api(language, pagesegmode=None, configs=(), purpose=None):
+    """Return the cached tesseract API of this thread for these settings"""
+    if not load():
+        raise TesseractApiError("tesserocr is not installed")
+    key = (_language(language), pagesegmode, tuple(configs or ()), purpose)
+    try:
+        apis = _local.apis
+    except AttributeError:
+        apis = _local.apis = {}
+    api = apis.get(key)
+    if api is None:
+        try:
+            api = tesserocr.PyTessBaseAPI(init=False)
+            api.InitFull(lang=key[0], configs=list(key[2]))
+        except RuntimeError as e:
+            raise TesseractApiError(str(e))
+        if pagesegmode is not None:
+            api.SetPageSegMode(int(pagesegmode))
+        apis[key] = api
+    return api
+
+
+def _set_image(api, input_file):
+    api.Clear()
+    try:
+        api.SetImageFile(input_file)
+    except RuntimeError as e:
+        raise TesseractApiError(str(e))
+
+
+def write_hocr(output_hocr, page):
+    """Write the hOCR document of a single page div"""
+    with open(output_hocr, 'w', encoding='utf-8') as f:
+        f.write(HOCR_TEMPLATE.format(
+            version=tesserocr.tesseract_version().split()[1],
+            capabilities='ocr_page ocr_carea ocr_par ocr_line ocrx_word',
+            page=page))
+
+
+def generate_hocr(input_file, output_hocr, language, tessconfig, timeout,
+                  log, pagesegmode=None):
+    """Recognize the image input_file and write its hOCR to output_hocr
+
+    Like the tesseract program, a page that takes longer than timeout
+    seconds is written without text. Returns True.
+    """
+    api = get_api(language, pagesegmode, tessconfig)
+    _set_image(api, input_file)
+    if not api.Recognize(int(timeout * 1000)):
+        log.warning("{0}: took too long to OCR - skipping".format(
+            os.path.basename(input_file)))
+        with Image.open(input_file) as im:
+            write_hocr(output_hocr, NULL_PAGE.format(*im.size))
+        return True
+    write_hocr(output_hocr, api.GetHOCRText(0))
+    return True
+
+
+def get_orientation(input_file):
+    """Detect the orientation of the text in the image input_file"""
+    api = get_api('osd', tesserocr.PSM.OSD_ONLY)
+    _set_image(api, input_file)
+    result = api.DetectOrientationScript()
+    if not result:
+        # Too little text to decide, just as the program reports
+        return OrientationConfidence(angle=0, confidence=0.0)
+    return OrientationConfidence(
+        angle=int(result['orient_deg']),
+        confidence=float(result['orient_conf']))
+
+
+def generate_pdf(input_image, output_pdf, language, tessconfig, timeout,
+                 pagesegmode=None):
+    """Recognize input_image and write it as PDF with text to output_pdf
+
+    Returns True.
+    """
+    api = get_api(language, pagesegmode, tessconfig, purpose='pdf')
+    api.SetVariable('tessedit_create_pdf', '1')
+    outputbase = os.path.splitext(output_pdf)[0] + '.tess'
+    if not api.ProcessPages(outputbase, input_image,
+                            timeout=int(timeout * 1000)):
+        raise TesseractApiError(
+            "{0}: could not render PDF".format(input_image))
+    shutil.move(outputbase + '.pdf', output_pdf)
+    return True
+
+
+def get_text(input_file, language, timeout):
+    """Recognize the image input_file and return its plain text
+
+    Returns '' if recognizing takes longer than timeout seconds.
+    """
+    api = get_api(language, purpose='text')
+    _set_image(api, input_file)
+    if not api.Recognize(int(timeout * 1000)):
+        return ''
+    return api.GetUTF8Text()
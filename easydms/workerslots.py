@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of easydms.
+# Copyright (c) 2016 Peter Kessen
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject
+# to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+# OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4
+
+"""A budget of worker slots shared by several OCR jobs
+
+When several documents are processed at once, their pipeline stages run
+in the worker processes of different jobs. Each stage holds a slot while
+it runs, and stages that start several programs hold one per program, so
+no more programs run than there are slots, whichever job they belong to.
+
+A slot is an flock on a file of the budget's directory. Taking a free
+slot is a system call in the process that needs it, without a round trip
+to a server process, and the kernel frees the slots of a worker that
+dies. Without fcntl the number of slots is not enforced.
+"""
+
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# Seconds to wait before looking for a free slot again
+POLL_INTERVAL = 0.02
+
+# Slot files held by this process; a child made by fork must not keep
+# them, or the slots would stay taken after the parent frees them
+_held = set()
+_held_lock = threading.Lock()
+
+
+def _close_held():
+    for fd in _held:
+        os.close(fd)
+    _held.clear()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_close_held)
+
+
+class WorkerSlots(object):
+    """count slots in directory, which is created if needed
+
+    Instances can be pickled into worker processes.
+    """
+    def __init__(self, directory, count):
+        self.directory = directory
+        self.count = count
+        os.makedirs(directory, exist_ok=True)
+
+    def __repr__(self):
+        return '{0}({1!r}, {2!r})'.format(
+            self.__class__.__name__, self.directory, self.count)
+
+    def _take(self, fds, count):
+        """Add free slots to fds until it holds count of them"""
+        for n in range(self.count):
+            if len(fds) >= count:
+                return
+            fd = os.open(os.path.join(self.directory, 'slot{0}'.format(n)),
+                         os.O_RDWR | os.O_CREAT, 0o600)
+            if fcntl is not None:
+                try:
+                    fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except OSError:
+                    os.close(fd)
+                    continue
+            with _held_lock:
+                _held.add(fd)
+            fds.append(fd)
+
+    def _release(self, fds):
+        with _held_lock:
+            for fd in fds:
+                _held.discard(fd)
+                os.close(fd)  # releases the lock
+
+    @contextmanager
+    def hold(self, count=1, least=None):
+        """Hold up to count slots while the block runs
+
+        Waits until at least least slots, by default count, are free and
+        yields the number of slots taken.
+        """
+        count = min(count, self.count)
+        least = count if least is None else min(least, count)
+        fds = []
+        try:
+            self._take(fds, count)
+            while len(fds) < least:
+                self._release(fds)
+                fds = []
+                time.sleep(POLL_INTERVAL)
+                self._take(fds, count)
+            yield len(fds)
+        finally:
+            self._release(fds)
@@ -0,0 +1,241 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of easydms.
+# Copyright (c) 2016 Peter Kessen
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject
+# to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+# OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4
+
+"""Accounting of the space used by a job's work folder
+
+The work folder can be put on a small, fast file system such as a tmpfs
+with a quota. All pipeline stages, in whatever worker process they run,
+add the size of their output files to a counter file in the work folder.
+Once the quota is exceeded, large output files are moved to a spill
+directory on disk and replaced by symbolic links, so later stages find
+them where they expect them. Stages that write many files at once reserve
+their space beforehand, and files that are removed or moved away are
+taken off the counter.
+
+Work folders of resumable jobs outlive the process that created them.
+Such a folder is locked while a job uses it, and folders that nobody
+used for a long time are removed.
+"""
+
+import os
+import shutil
+import stat
+import struct
+import time
+from contextlib import suppress
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+USAGE_FILE = '.usage'
+LOCK_FILE = '.lock'
+
+# Outputs smaller than this stay in the work folder; moving them would
+# not gain much
+SPILL_MIN_SIZE = 256 * 1024
+
+_usage = struct.Struct('<qq')
+
+
+def _flatten(files):
+    if isinstance(files, str):
+        yield files
+    else:
+        for f in files:
+            yield from _flatten(f)
+
+
+def _file_size(path):
+    """Size of the regular file path; links and missing files count 0"""
+    try:
+        st = os.lstat(path)
+    except OSError:
+        return 0
+    return st.st_size if stat.S_ISREG(st.st_mode) else 0
+
+
+class WorkFolder(object):
+    """Usage accounting of the work folder path
+
+    quota is in bytes, None for no limit. Spilled files go to a directory
+    named after the work folder below spill_dir.
+    """
+    def __init__(self, path, quota=None, spill_dir=None):
+        self.path = path
+        self.quota = quota
+        self.spill_path = None
+        if spill_dir is not None:
+            self.spill_path = os.path.join(
+                spill_dir, os.path.basename(path.rstrip(os.sep)))
+
+    def __repr__(self):
+        return '{0}({1!r}, quota={2!r})'.format(
+            self.__class__.__name__, self.path, self.quota)
+
+    def _update(self, delta, limit=None):
+        """Add delta to the usage, return (current, peak)
+
+        If the usage would exceed limit, it is left alone and None is
+        returned.
+        """
+        fd = os.open(os.path.join(self.path, USAGE_FILE),
+                     os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            if fcntl is not None:
+                fcntl.lockf(fd, fcntl.LOCK_EX)
+            data = os.read(fd, _usage.size)
+            current, peak = _usage.unpack(data) if data else (0, 0)
+            if limit is not None and current + delta > limit:
+                return None
+            current += delta
+            peak = max(peak, current)
+            os.lseek(fd, 0, os.SEEK_SET)
+            os.write(fd, _usage.pack(current, peak))
+            return current, peak
+        finally:
+            os.close(fd)  # releases the lock
+
+    def usage(self):
+        """Return (current, peak) bytes used by accounted files"""
+        try:
+            with open(os.path.join(self.path, USAGE_FILE), 'rb') as f:
+                data = f.read(_usage.size)
+        except FileNotFoundError:
+            return 0, 0
+        return _usage.unpack(data) if data else (0, 0)
+
+    def _sizes(self, files):
+        """Sizes of those of files that are counted in this folder"""
+        folder = os.path.abspath(self.path)
+        return {f: _file_size(f) for f in _flatten(files)
+                if os.path.dirname(os.path.abspath(f)) == folder}
+
+    def _spill_largest(self, sizes, current, log, pending=0):
+        """Spill the largest of sizes until current usage and pending bytes
+        are within the quota"""
+        for f, size in sorted(sizes.items(), key=lambda item: -item[1]):
+            if current + pending <= self.quota or size < SPILL_MIN_SIZE:
+                break
+            self.spill(f)
+            current, _ = self._update(-size)
+            if log is not None:
+                log.debug("Work folder over quota, moved {0} to {1}".format(
+                    os.path.basename(f), self.spill_path))
+        return current
+
+    def account(self, files, log=None, reserved=0):
+        """Count the output files of a stage, spilling if over quota
+
+        reserved is the space reserve() counted for these files already.
+        """
+        sizes = self._sizes(files)
+        current, _ = self._update(sum(sizes.values()) - reserved)
+        if self.quota is None or self.spill_path is None:
+            return
+        self._spill_largest(sizes, current, log)
+
+    def reserve(self, size, log=None):
+        """Count size bytes that are about to be written, if they fit
+
+        Files already in the folder are spilled to make room if need be.
+        Returns False, counting nothing, if size does not fit into the
+        quota. Otherwise pass size as reserved to account() once the
+        files are written.
+        """
+        if self._update(size, self.quota) is not None:
+            return True
+        if self.spill_path is None:
+            return False
+        with os.scandir(self.path) as entries:
+            files = [entry.path for entry in entries]
+        current, _ = self.usage()
+        self._spill_largest(self._sizes(files), current, log, size)
+        return self._update(size, self.quota) is not None
+
+    def release(self, files):
+        """Stop counting files, which are about to be moved or removed"""
+        self._update(-sum(self._sizes(files).values()))
+
+    def remove(self, path):
+        """Remove the counted file path"""
+        self.release(path)
+        with suppress(FileNotFoundError):
+            os.unlink(path)
+
+    def spill(self, path):
+        """Move the file path to the spill directory, leaving a link"""
+        os.makedirs(self.spill_path, exist_ok=True)
+        target = os.path.join(self.spill_path, os.path.basename(path))
+        shutil.move(path, target)
+        os.symlink(target, path)
+
+    def remove_spill(self):
+        if self.spill_path is not None:
+            shutil.rmtree(self.spill_path, ignore_errors=True)
+
+
+def lock_folder(path):
+    """Lock the work folder path against use by other jobs
+
+    Returns an open file that holds the lock until it is closed, or None
+    if another job, in this or another process, holds the lock. Without
+    fcntl the folder is not actually locked.
+    """
+    f = open(os.path.join(path, LOCK_FILE), 'a')
+    if fcntl is not None:
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            f.close()
+            return None
+    return f
+
+
+def remove_stale(directory, max_age):
+    """Remove folders in directory that were not modified for max_age
+    seconds and are not locked; return their number"""
+    removed = 0
+    limit = time.time() - max_age
+    try:
+        entries = list(os.scandir(directory))
+    except FileNotFoundError:
+        return 0
+    for entry in entries:
+        try:
+            if not entry.is_dir(follow_symlinks=False) or \
+                    entry.stat().st_mtime > limit:
+                continue
+            lock = lock_folder(entry.path)
+        except OSError:
+            continue
+        if lock is None:
+            continue
+        with lock:
+            shutil.rmtree(entry.path, ignore_errors=True)
+        removed += 1
+    return removed
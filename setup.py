@@ -62,6 +62,11 @@ setup(
 #        'ocrmypdf',
     ],
 
+    extras_require={
+        'tesseract-api': ['tesserocr'],
+        'pikepdf': ['pikepdf'],
+    },
+
     classifiers=[
         'Topic :: Office/Business',
         'License :: OSI Approved :: MIT License',
@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of easydms.
+# Copyright (c) 2015 Peter Kessen
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject
+# to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+# OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4
+
+"""Test reading of hOCR files."""
+
+from _common import TestCase
+import os
+
+import easydms.hocr
+
+HOCR = """<?xml version="1.0" encoding="UTF-8"?>
+<!DOCTYPE html PUBLIC "-//W3C//DTD XHTML 1.0 Transitional//EN"
+    "http://www.w3.org/TR/xhtml1/DTD/xhtml1-transitional.dtd">
+<html xmlns="http://www.w3.org/1999/xhtml" xml:lang="en" lang="en">
+ <body>
+  <div class='ocr_page' id='page_1' title='bbox 0 0 2480 3508'>
+   <span class='ocr_line' id='line_1_1' title='bbox 36 92 580 116'>
+    {words}
+   </span>
+  </div>
+ </body>
+</html>
+"""
+
+
+class TestHocr(TestCase):
+    def _hocr(self, words):
+        path = os.path.join(self.temp_dir, 'page.hocr')
+        with open(path, 'w') as f:
+            f.write(HOCR.format(words=words))
+        return path
+
+    def test_words(self):
+        """Check that words and their confidences are found"""
+        path = self._hocr(
+            "<span class='ocrx_word' title='bbox 1 2 3 4; x_wconf 91'>"
+            "Rechnung</span> "
+            "<span class='ocrx_word' title='bbox 5 6 7 8; x_wconf 42'>"
+            "<strong>Nr.</strong></span>")
+        self.assertEqual(easydms.hocr.words(path),
+                         [('Rechnung', 91), ('Nr.', 42)])
+        self.assertTrue(easydms.hocr.has_words(path))
+
+    def test_empty_page(self):
+        """Check that pages without recognized text have no words"""
+        path = self._hocr(
+            "<span class='ocrx_word' title='bbox 1 2 3 4; x_wconf 0'> </span>")
+        self.assertFalse(easydms.hocr.has_words(path))
+
+    def test_broken_file(self):
+        """Check that a truncated hOCR file has no words"""
+        path = self._hocr("<span class='ocrx_word'>Text")
+        self.assertEqual(easydms.hocr.words(path), [])
+
+    def test_mean_confidence(self):
+        """Check the mean confidence of the words of a page"""
+        path = self._hocr(
+            "<span class='ocrx_word' title='bbox 1 2 3 4; x_wconf 90'>"
+            "Rechnung</span> "
+            "<span class='ocrx_word' title='bbox 5 6 7 8'>ohne</span> "
+            "<span class='ocrx_word' title='bbox 5 6 7 8; x_wconf 60'>"
+            "Nr.</span>")
+        self.assertEqual(easydms.hocr.mean_confidence(path), (75.0, 2))
+        empty = self._hocr("")
+        self.assertEqual(easydms.hocr.mean_confidence(empty), (None, 0))
@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of easydms.
+# Copyright (c) 2015 Peter Kessen
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject
+# to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+# OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4
+
+"""Test building image layer PDFs from page images."""
+
+from _common import TestCase
+import os
+import re
+import struct
+import zlib
+
+import easydms.imagepdf as imagepdf
+
+
+def png_chunk(kind, data):
+    return struct.pack('>I4s', len(data), kind) + data + \
+        struct.pack('>I', zlib.crc32(kind + data) & 0xffffffff)
+
+
+def png(width, height, color_type=2, bpc=8, interlace=0, idat_parts=2,
+        extra=b''):
+    colors = {0: 1, 2: 3, 3: 1, 6: 4}[color_type]
+    row = b'\0' + bytes(n % 256 for n in range(width * colors * bpc // 8))
+    data = zlib.compress(row * height)
+    size = -(-len(data) // idat_parts)
+    chunks = [png_chunk(b'IDAT', data[n:n + size])
+              for n in range(0, len(data), size)]
+    ihdr = struct.pack('>IIBBBBB', width, height, bpc, color_type, 0, 0,
+                       interlace)
+    return imagepdf.PNG_SIGNATURE + png_chunk(b'IHDR', ihdr) + extra + \
+        b''.join(chunks) + png_chunk(b'IEND', b''), data
+
+
+def jpeg(width, height, components=3):
+    sof = struct.pack('>BHHB', 8, height, width, components) + \
+        b'\x01\x22\x00' * components
+    return b'\xff\xd8' + b'\xff\xe0' + struct.pack('>H', 16) + \
+        b'JFIF\0\x01\x01\x00\x00\x01\x00\x01\x00\x00' + \
+        b'\xff\xc0' + struct.pack('>H', len(sof) + 2) + sof + \
+        b'\xff\xda\x00\x02' + b'scan data' + b'\xff\xd9'
+
+
+class TestImagePdf(TestCase):
+    def _file(self, name, content):
+        path = os.path.join(self.temp_dir, name)
+        with open(path, 'wb') as f:
+            f.write(content)
+        return path
+
+    def _convert(self, content, dpi=(300, 300)):
+        image = self._file('page.img', content)
+        output = os.path.join(self.temp_dir, 'page.pdf')
+        imagepdf.convert(image, output, dpi)
+        with open(output, 'rb') as f:
+            return f.read()
+
+    def assertValidXref(self, pdf):
+        xref = int(re.search(rb'startxref\n(\d+)\n%%EOF\n$', pdf).group(1))
+        self.assertTrue(pdf[xref:].startswith(b'xref\n0 6\n'))
+        entries = pdf[xref:].split(b'\n')[3:8]
+        for number, entry in enumerate(entries, start=1):
+            offset = int(entry[:10])
+            self.assertTrue(pdf[offset:].startswith(
+                '{0} 0 obj\n'.format(number).encode('ascii')))
+
+    def _stream(self, pdf):
+        match = re.search(
+            rb'/Subtype /Image .*?/Length (\d+) >>\nstream\n', pdf)
+        start = match.end()
+        return match.group(0), pdf[start:start + int(match.group(1))]
+
+    def test_png(self):
+        """Check that the PNG data is copied with its predictor"""
+        content, data = png(40, 10)
+        pdf = self._convert(content, dpi=(200, 100))
+        self.assertValidXref(pdf)
+        header, stream = self._stream(pdf)
+        self.assertEqual(stream, data)
+        self.assertIn(b'/ColorSpace /DeviceRGB', header)
+        self.assertIn(b'/Filter /FlateDecode', header)
+        self.assertIn(b'/Predictor 15 /Colors 3 /BitsPerComponent 8 '
+                      b'/Columns 40', header)
+        self.assertIn(b'/MediaBox [0 0 14.4 7.2]', pdf)
+
+    def test_version(self):
+        """Check that 16 bit images get the PDF version that has them"""
+        pdf = self._convert(png(4, 4)[0])
+        self.assertTrue(pdf.startswith(b'%PDF-1.4\n'))
+        content, data = png(4, 4, color_type=0, bpc=16)
+        pdf = self._convert(content)
+        self.assertTrue(pdf.startswith(b'%PDF-1.5\n'))
+        self.assertValidXref(pdf)
+        header, stream = self._stream(pdf)
+        self.assertEqual(stream, data)
+        self.assertIn(b'/BitsPerComponent 16', header)
+
+    def test_chunked_copy(self):
+        """Check that data larger than a copy chunk arrives complete"""
+        content, data = png(300, 200, idat_parts=5)
+        old_size, imagepdf.CHUNK_SIZE = imagepdf.CHUNK_SIZE, 7
+        try:
+            pdf = self._convert(content)
+        finally:
+            imagepdf.CHUNK_SIZE = old_size
+        self.assertEqual(self._stream(pdf)[1], data)
+        self.assertValidXref(pdf)
+
+    def test_palette(self):
+        """Check that a palette PNG becomes an indexed image"""
+        palette = png_chunk(b'PLTE', b'\x00\x00\x00\xff\xff\xff')
+        content, _ = png(8, 2, color_type=3, bpc=1, extra=palette)
+        header, _ = self._stream(self._convert(content))
+        self.assertIn(b'/ColorSpace [/Indexed /DeviceRGB 1 <000000ffffff>]',
+                      header)
+        self.assertIn(b'/BitsPerComponent 1', header)
+
+    def test_jpeg(self):
+        """Check that a JPEG is copied unchanged"""
+        content = jpeg(600, 800, components=1)
+        pdf = self._convert(content)
+        self.assertValidXref(pdf)
+        header, stream = self._stream(pdf)
+        self.assertEqual(stream, content)
+        self.assertIn(b'/Width 600 /Height 800', header)
+        self.assertIn(b'/ColorSpace /DeviceGray', header)
+        self.assertIn(b'/Filter /DCTDecode', header)
+
+    def test_unsupported(self):
+        """Check that images PDF cannot take as they are are refused"""
+        for content in (png(4, 4, interlace=1)[0],
+                        png(4, 4, color_type=6)[0],
+                        png(4, 4, extra=png_chunk(b'tRNS', b'\0\0'))[0],
+                        jpeg(4, 4, components=4),
+                        b'GIF89a'):
+            with self.assertRaises(imagepdf.UnsupportedImageError):
+                self._convert(content)
@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of easydms.
+# Copyright (c) 2015 Peter Kessen
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject
+# to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+# OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4
+
+"""Test the content-addressed OCR result cache."""
+
+from _common import TestCase
+import os
+import pickle
+from unittest import mock
+
+import easydms.ocrcache
+
+
+class TestOcrCache(TestCase):
+    def setUp(self):
+        super(TestOcrCache, self).setUp()
+        self.cachedir = os.path.join(self.temp_dir, 'cache')
+
+    def _file(self, name, content):
+        path = os.path.join(self.temp_dir, name)
+        with open(path, 'wb') as f:
+            f.write(content)
+        return path
+
+    def test_roundtrip(self):
+        """Check that a stored file is returned and hits are counted"""
+        cache = easydms.ocrcache.FileCache(self.cachedir, suffix='.pdf')
+        source = self._file('result.pdf', b'%PDF-1.4 result')
+        target = os.path.join(self.temp_dir, 'out.pdf')
+
+        self.assertFalse(cache.get('abcdef', target))
+        cache.put('abcdef', source)
+        self.assertTrue(cache.get('abcdef', target))
+        with open(target, 'rb') as f:
+            self.assertEqual(f.read(), b'%PDF-1.4 result')
+
+        stats = cache.stats()
+        self.assertEqual(stats['hits'], 1)
+        self.assertEqual(stats['misses'], 1)
+        self.assertEqual(stats['entries'], 1)
+
+    def test_lru_eviction(self):
+        """Check that the least recently used entries are evicted first"""
+        cache = easydms.ocrcache.FileCache(self.cachedir, max_size=20)
+        for i, key in enumerate(('aa01', 'bb02')):
+            cache.put(key, self._file(key, b'x' * 10))
+            os.utime(cache.path(key), (1000 + i, 1000 + i))
+        # Using the older entry makes the other one least recently used
+        cache.get('aa01', os.path.join(self.temp_dir, 'out'))
+        cache.put('cc03', self._file('cc03', b'x' * 10))
+
+        self.assertExists(cache.path('aa01'))
+        self.assertNotExists(cache.path('bb02'))
+        self.assertExists(cache.path('cc03'))
+        self.assertLessEqual(cache.size(), 20)
+
+    def test_eviction_counts(self):
+        """Check that entries are only listed now and then"""
+        cache = easydms.ocrcache.FileCache(self.cachedir, max_size=1000)
+        with mock.patch.object(cache, 'entries',
+                               wraps=cache.entries) as entries:
+            for i in range(40):
+                cache.put('{0:04x}'.format(i),
+                          self._file('source', b'x' * 10))
+            # The first put counts, then every tenth of max_size
+            self.assertEqual(entries.call_count, 4)
+            for i in range(40, 120):
+                cache.put('{0:04x}'.format(i),
+                          self._file('source', b'x' * 10))
+        self.assertLessEqual(cache.size(), 1000)
+        self.assertGreaterEqual(cache.size(), 900)
+
+    def test_content_key(self):
+        """Check that keys depend on file content and parameters only"""
+        a = self._file('a.pdf', b'same')
+        b = self._file('b.pdf', b'same')
+        c = self._file('c.pdf', b'other')
+        key = easydms.ocrcache.content_key
+        self.assertEqual(key(a, {'language': ['deu']}),
+                         key(b, {'language': ['deu']}))
+        self.assertNotEqual(key(a, {'language': ['deu']}),
+                            key(c, {'language': ['deu']}))
+        self.assertNotEqual(key(a, {'language': ['deu']}),
+                            key(a, {'language': ['eng']}))
+
+    def test_pickle(self):
+        """Check that caches can be handed to worker processes"""
+        cache = easydms.ocrcache.FileCache(self.cachedir, max_size=42)
+        clone = pickle.loads(pickle.dumps(cache))
+        self.assertEqual(clone.directory, self.cachedir)
+        self.assertEqual(clone.max_size, 42)
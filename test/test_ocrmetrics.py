@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of easydms.
+# Copyright (c) 2015 Peter Kessen
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject
+# to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+# OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4
+
+"""Test collecting and reporting of pipeline stage metrics."""
+
+from _common import TestCase
+import json
+import os
+import threading
+import time
+
+import easydms.ocrmetrics
+
+
+class TestOcrMetrics(TestCase):
+    def setUp(self):
+        super(TestOcrMetrics, self).setUp()
+        self.path = os.path.join(self.temp_dir, 'metrics.jsonl')
+        for start, stage, wall, pages in (
+                (100.0, 'rasterize_with_ghostscript', 1.0, 1),
+                (100.5, 'rasterize_with_ghostscript', 2.0, 1),
+                (103.0, 'ocr_tesseract_hocr', 4.0, 1),
+                (103.0, 'ocr_tesseract_hocr', 5.0, 1),
+                (110.0, 'merge_pages_ghostscript', 0.5, 2)):
+            easydms.ocrmetrics.append_record(self.path, {
+                'stage': stage, 'start': start, 'wall': wall,
+                'cpu': wall / 2, 'pages': pages})
+        easydms.ocrmetrics.stage_done(self.path, 'ocr_tesseract_hocr')
+
+    def test_aggregate(self):
+        """Check that invocations are summed up per stage"""
+        metrics = easydms.ocrmetrics.JobMetrics.load(self.path, 'a.pdf')
+        self.assertEqual(list(metrics.stages), [
+            'rasterize_with_ghostscript', 'ocr_tesseract_hocr',
+            'merge_pages_ghostscript'])
+        ocr = metrics.stages['ocr_tesseract_hocr']
+        self.assertEqual(ocr.calls, 2)
+        self.assertEqual(ocr.pages, 2)
+        self.assertAlmostEqual(ocr.wall, 9.0)
+        self.assertAlmostEqual(ocr.cpu, 4.5)
+        self.assertAlmostEqual(ocr.span, 5.0)
+        self.assertAlmostEqual(metrics.wall, 10.5)
+        self.assertEqual(metrics.pages, 2)
+        self.assertIs(metrics.bottleneck(), ocr)
+
+    def test_measure(self):
+        """Check that measured blocks are recorded"""
+        path = os.path.join(self.temp_dir, 'measure.jsonl')
+        with easydms.ocrmetrics.measure(path, 'split_pages', 3):
+            time.sleep(0.01)
+        stage = easydms.ocrmetrics.JobMetrics.load(path).stages['split_pages']
+        self.assertEqual(stage.pages, 3)
+        self.assertGreaterEqual(stage.wall, 0.01)
+
+    def test_json_report(self):
+        """Check the JSON report"""
+        report = os.path.join(self.temp_dir, 'report.json')
+        easydms.ocrmetrics.JobMetrics.load(self.path, 'a.pdf').write(report)
+        with open(report) as f:
+            data = json.load(f)
+        self.assertEqual(data['job'], 'a.pdf')
+        self.assertEqual(data['stages']['merge_pages_ghostscript']['pages'],
+                         2)
+        self.assertNotIn('ocr_tiers', data)
+
+    def test_ocr_tiers(self):
+        """Check that the pass of two pass OCR of each page is reported"""
+        metrics = easydms.ocrmetrics.JobMetrics.load(self.path, 'a.pdf')
+        metrics.ocr_tiers = [
+            {'page': 1, 'tier': 'fast', 'confidence': 91.5},
+            {'page': 2, 'tier': 'full', 'confidence': 62.0}]
+        self.assertEqual(metrics.to_dict()['ocr_tiers'][1]['tier'], 'full')
+        lines = metrics.prometheus().splitlines()
+        self.assertIn('easydms_ocr_job_pages_by_ocr_tier{job="a.pdf",'
+                      'tier="fast"} 1.0', lines)
+
+    def test_prometheus_report(self):
+        """Check the Prometheus textfile"""
+        report = os.path.join(self.temp_dir, 'ocr.prom')
+        easydms.ocrmetrics.JobMetrics.load(self.path, 'a.pdf').write(
+            report, 'prometheus')
+        with open(report) as f:
+            lines = f.read().splitlines()
+        self.assertIn('# TYPE easydms_ocr_stage_wall_seconds gauge', lines)
+        self.assertIn('easydms_ocr_stage_wall_seconds{job="a.pdf",'
+                      'stage="ocr_tesseract_hocr"} 9.0', lines)
+
+    def test_job_file(self):
+        """Check that every job gets a metrics file of its own"""
+        path = os.path.join(self.temp_dir, 'ocr.prom')
+        first = easydms.ocrmetrics.job_file(path, '/scans/a/invoice.pdf')
+        second = easydms.ocrmetrics.job_file(path, '/scans/b/invoice.pdf')
+        self.assertNotEqual(first, second)
+        self.assertEqual(os.path.dirname(first), self.temp_dir)
+        self.assertTrue(os.path.basename(first).startswith('ocr.invoice-'))
+        self.assertTrue(first.endswith('.prom'))
+        self.assertEqual(
+            first, easydms.ocrmetrics.job_file(path, '/scans/a/invoice.pdf'))
+
+    def test_concurrent_write(self):
+        """Check that reports written at once leave no temporary files"""
+        report = os.path.join(self.temp_dir, 'report.json')
+        metrics = easydms.ocrmetrics.JobMetrics.load(self.path, 'a.pdf')
+        errors = []
+
+        def write():
+            try:
+                for _ in range(20):
+                    metrics.write(report)
+            except OSError as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=write) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+        with open(report) as f:
+            self.assertEqual(json.load(f)['job'], 'a.pdf')
+        self.assertEqual(sorted(os.listdir(self.temp_dir)),
+                         ['metrics.jsonl', 'report.json'])
+
+    def test_resumed_run(self):
+        """Check that only the stages of the last run are summed up"""
+        easydms.ocrmetrics.start_run(self.path)
+        with easydms.ocrmetrics.measure(self.path, 'ocr_tesseract_hocr', 1,
+                                        page=2):
+            pass
+        metrics = easydms.ocrmetrics.JobMetrics.load(self.path)
+        self.assertEqual(list(metrics.stages), ['ocr_tesseract_hocr'])
+        self.assertEqual(metrics.stages['ocr_tesseract_hocr'].calls, 1)
@@ -0,0 +1,811 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of easydms.
+# Copyright (c) 2015 Peter Kessen
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject
+# to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+# OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4
+
+
+"""Test helpers of the OCR pipeline that need no external programs."""
+
+from _common import TestCase
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+import types
+import unittest
+from unittest import mock
+
+from easydms.pageinfostore import PageInfoStore
+from easydms.workerslots import WorkerSlots
+from easydms.workfolder import WorkFolder
+
+try:
+    import easydms.ocrmypdfwrapper as wrapper
+except ImportError:
+    wrapper = None
+
+pikepdf = wrapper.pikepdf if wrapper else None
+
+
+def write_pdf(filename, content, size=(200, 100), rotate=None):
+    pdf = pikepdf.new()
+    pdf.add_blank_page(page_size=size)
+    page = pdf.pages[0]
+    page.Contents = pdf.make_stream(content)
+    if rotate is not None:
+        page.Rotate = rotate
+    pdf.save(filename)
+    pdf.close()
+
+
+@unittest.skipIf(wrapper is None, "ocrmypdf is not installed")
+class TestResources(TestCase):
+    def setUp(self):
+        TestCase.setUp(self)
+        self.log = logging.getLogger('test_ocrmypdfwrapper')
+
+    def test_plan_keeps_environment(self):
+        """Check that planning a job leaves the environment alone"""
+        options = wrapper.ocrOptions()
+        options.jobs = 2
+        with mock.patch.dict(os.environ, clear=False):
+            os.environ.pop('OMP_THREAD_LIMIT', None)
+            with mock.patch.object(wrapper, 'available_cpu_count',
+                                   return_value=8):
+                wrapper.plan_resources(options, [], self.log)
+            self.assertNotIn('OMP_THREAD_LIMIT', os.environ)
+        self.assertEqual(options.tesseract_threads, 4)
+
+    def test_plan_per_job(self):
+        """Check that every job gets the threads of its own plan"""
+        first, second = wrapper.ocrOptions(), wrapper.ocrOptions()
+        first.jobs, second.jobs = 1, 4
+        with mock.patch.dict(os.environ, clear=False):
+            os.environ.pop('OMP_THREAD_LIMIT', None)
+            with mock.patch.object(wrapper, 'available_cpu_count',
+                                   return_value=8):
+                wrapper.plan_resources(first, [], self.log)
+                wrapper.plan_resources(second, [], self.log)
+        self.assertEqual(first.tesseract_threads, 8)
+        self.assertEqual(second.tesseract_threads, 2)
+
+    def test_tessdata_prefix(self):
+        """Check that the languages depend on the TESSDATA_PREFIX folders"""
+        with mock.patch.dict(os.environ, TESSDATA_PREFIX=self.temp_dir):
+            self.assertEqual(
+                wrapper.tesseract_tessdata(),
+                [self.temp_dir, os.path.join(self.temp_dir, 'tessdata')])
+
+    def test_limit_in_workers_only(self):
+        """Check that the thread limit is set in worker processes only"""
+        options = wrapper.ocrOptions()
+        options.tesseract_threads = 3
+        context = types.SimpleNamespace(options=options, pid=os.getpid())
+        with mock.patch.dict(os.environ, clear=False):
+            os.environ.pop('OMP_THREAD_LIMIT', None)
+            wrapper.limit_tesseract_threads(context)
+            self.assertNotIn('OMP_THREAD_LIMIT', os.environ)
+            context.pid = os.getpid() + 1
+            wrapper.limit_tesseract_threads(context)
+            self.assertEqual(os.environ['OMP_THREAD_LIMIT'], '3')
+
+
+@unittest.skipIf(wrapper is None, "ocrmypdf is not installed")
+class TestScheduling(TestCase):
+    def setUp(self):
+        TestCase.setUp(self)
+        self.log = logging.getLogger('test_ocrmypdfwrapper')
+        self.lock = threading.Lock()
+        self.running = 0
+        self.peak = 0
+        self.chunks = []
+
+    def rasterize_pdfs(self, chunk, outputs, xres, yres, device, log):
+        with self.lock:
+            self.chunks.append(len(chunk))
+            self.running += 1
+            self.peak = max(self.peak, self.running)
+        time.sleep(0.02)
+        with self.lock:
+            self.running -= 1
+        for output in outputs:
+            with open(output, 'wb') as f:
+                f.write(b'\0' * 1000)
+
+    def render(self, slots, jobs=4, work=None):
+        options = wrapper.ocrOptions()
+        options.jobs = jobs
+        pages = types.SimpleNamespace(get=lambda pageno: {})
+        if work is None:
+            work = WorkFolder(self.temp_dir)
+        context = types.SimpleNamespace(
+            options=options, slots=slots, pages=pages, work=work)
+        groups = {('png16m', 300, 300): [
+            os.path.join(self.temp_dir, '{0:06d}.page.pdf'.format(n))
+            for n in range(1, 9)]}
+        with mock.patch.object(wrapper, 'rasterize_pdfs',
+                               self.rasterize_pdfs):
+            wrapper.rasterize_in_batches(groups, '.png', self.log, context)
+
+    def test_batches_without_budget(self):
+        """Check that a single job runs as many Ghostscripts as jobs"""
+        self.render(None)
+        self.assertEqual(self.chunks, [2, 2, 2, 2])
+        self.assertEqual(self.peak, 4)
+
+    def test_batches_within_quota(self):
+        """Check that batch rasters are only made if they fit the quota"""
+        # A letter page at 300 dpi takes about 25 MB uncompressed
+        work = WorkFolder(self.temp_dir, quota=150 * 1000 * 1000)
+        self.render(None, jobs=1, work=work)
+        self.assertEqual(self.chunks, [])
+        self.assertEqual(work.usage(), (0, 0))
+
+        work = WorkFolder(self.temp_dir, quota=250 * 1000 * 1000)
+        self.render(None, jobs=1, work=work)
+        self.assertEqual(self.chunks, [8])
+        # The reservation is replaced by the actual size
+        self.assertEqual(work.usage()[0], 8000)
+
+    def test_batches_within_budget(self):
+        """Check that Ghostscripts only use the free worker slots"""
+        slots = WorkerSlots(os.path.join(self.temp_dir, 'slots'), 4)
+        # One slot is the stage's own, another one runs a stage elsewhere
+        with slots.hold(2):
+            self.render(slots)
+            # Chunks finish in whatever order the threads run
+            self.assertEqual(sorted(self.chunks), [2, 3, 3])
+            self.assertEqual(self.peak, 3)
+            with slots.hold(2):
+                self.chunks = []
+                self.render(slots)
+                self.assertEqual(self.chunks, [8])
+
+
+@unittest.skipIf(wrapper is None, "ocrmypdf is not installed")
+class TestOcrMany(TestCase):
+    def setUp(self):
+        TestCase.setUp(self)
+        self.lock = threading.Lock()
+        self.slots = set()
+        self.running = 0
+        self.peak = 0
+
+    def run_pipeline(self, name, options, work_folder, log, context):
+        with context.slots.hold(2) as count:
+            with self.lock:
+                self.slots.add(context.slots)
+                self.running += count
+                self.peak = max(self.peak, self.running)
+            time.sleep(0.05)
+            with self.lock:
+                self.running -= count
+        with open(options.output_file, 'wb') as f:
+            f.write(options.input_file.encode())
+        return wrapper.ExitCode.ok
+
+    def test_shared_budget(self):
+        """Check that documents share the slots and all outputs are made"""
+        options = wrapper.ocrOptions()
+        options.work_dir = self.temp_dir
+        engine = wrapper.OcrEngine(options)
+        paths = [os.path.join(self.temp_dir, name)
+                 for name in ('first.pdf', 'second.pdf')]
+        with mock.patch.object(wrapper, 'check_dependencies'), \
+                mock.patch.object(wrapper, 'check_options'), \
+                mock.patch.object(wrapper, 'run_pipeline',
+                                  self.run_pipeline):
+            results = engine.ocr_many(paths, jobs=3)
+        try:
+            self.assertEqual([r.input_file for r in results], paths)
+            for result in results:
+                self.assertEqual(result.exitcode, wrapper.ExitCode.ok)
+                with open(result.output_file, 'rb') as f:
+                    self.assertEqual(f.read(), result.input_file.encode())
+        finally:
+            for result in results:
+                os.remove(result.output_file)
+        # Both jobs held slots of one budget, never more than it has
+        self.assertEqual(len(self.slots), 1)
+        self.assertLessEqual(self.peak, 3)
+        self.assertGreaterEqual(self.peak, 2)
+
+
+@unittest.skipIf(wrapper is None, "ocrmypdf is not installed")
+class TestFastPath(TestCase):
+    def setUp(self):
+        TestCase.setUp(self)
+        self.log = logging.getLogger('test_ocrmypdfwrapper')
+        self.options = wrapper.ocrOptions()
+        self.options.skip_text = True
+        self.options.rotate_pages = False
+        self.pdfinfo = [{'has_text': True}, {'has_text': True}]
+
+    def test_text_only(self):
+        """Check that a document with text on every page skips OCR"""
+        with mock.patch.object(wrapper, 'is_ocr_required',
+                               return_value=False):
+            self.assertTrue(wrapper.is_ocr_unnecessary(
+                self.pdfinfo, self.log, self.options))
+            self.options.blank_pages = 'skip'
+            self.assertTrue(wrapper.is_ocr_unnecessary(
+                self.pdfinfo, self.log, self.options))
+
+    def test_drop_blank_pages(self):
+        """Check that dropping blank pages takes the page pipeline"""
+        self.options.blank_pages = 'drop'
+        with mock.patch.object(wrapper, 'is_ocr_required',
+                               return_value=False):
+            self.assertFalse(wrapper.is_ocr_unnecessary(
+                self.pdfinfo, self.log, self.options))
+
+    def convert(self, output_type):
+        """Run convert_without_ocr for a job that was cancelled"""
+        input_file = os.path.join(self.temp_dir, 'origin')
+        with open(input_file, 'wb') as f:
+            f.write(b'%PDF')
+        cancel_file = os.path.join(self.temp_dir, 'cancel')
+        open(cancel_file, 'w').close()
+        self.options.output_type = output_type
+        self.options.output_file = os.path.join(self.temp_dir, 'out.pdf')
+        # Neither slots nor metrics may be used outside of a pipeline
+        context = types.SimpleNamespace(
+            options=self.options, work_folder=self.temp_dir,
+            cancel_file=cancel_file, slots=None, metrics_file=None)
+
+        def generate_pdfa(inputs, output_file, log, threads):
+            shutil.copy(inputs[0], output_file)
+
+        with mock.patch.object(wrapper.ghostscript, 'generate_pdfa',
+                               side_effect=generate_pdfa), \
+                mock.patch.object(wrapper, 'generate_pdfa_def'), \
+                mock.patch.object(wrapper, 'get_pdfmark'), \
+                mock.patch.object(wrapper.pypdf, 'PdfFileReader'):
+            wrapper.convert_without_ocr(input_file, self.log, context)
+        with open(self.options.output_file, 'rb') as f:
+            self.assertEqual(f.read(), b'%PDF')
+
+    def test_convert_cancelled(self):
+        """Check that the fast path leaves cancellation to the job"""
+        self.convert('pdf')
+        self.convert('pdfa')
+
+
+@unittest.skipIf(wrapper is None, "ocrmypdf is not installed")
+class TestOcrDpi(TestCase):
+    def setUp(self):
+        TestCase.setUp(self)
+        self.options = types.SimpleNamespace(
+            oversample=0, ocr_dpi_max=None, ocr_dpi_min=None)
+
+    def test_unlimited(self):
+        """Check that the page resolution is used without limits"""
+        pageinfo = {'xres': 600, 'yres': 300}
+        self.assertEqual(wrapper.get_full_ocr_dpi(pageinfo, self.options),
+                         600.0)
+        self.options.oversample = 800
+        self.assertEqual(wrapper.get_full_ocr_dpi(pageinfo, self.options),
+                         800.0)
+
+    def test_cap(self):
+        """Check that high resolutions are capped"""
+        self.options.ocr_dpi_max = 300
+        self.assertEqual(wrapper.get_full_ocr_dpi(
+            {'xres': 600, 'yres': 600}, self.options), 300.0)
+        self.assertEqual(wrapper.get_full_ocr_dpi(
+            {'xres': 200, 'yres': 200}, self.options), 200.0)
+
+    def test_floor(self):
+        """Check that low resolutions are raised"""
+        self.options.ocr_dpi_min = 150
+        self.assertEqual(wrapper.get_full_ocr_dpi(
+            {'xres': 72, 'yres': 96}, self.options), 150.0)
+        self.assertEqual(wrapper.get_full_ocr_dpi(
+            {'xres': 300, 'yres': 300}, self.options), 300.0)
+        # Vector pages are rendered at VECTOR_PAGE_DPI
+        self.options.ocr_dpi_min = wrapper.VECTOR_PAGE_DPI + 100
+        self.assertEqual(wrapper.get_full_ocr_dpi({}, self.options),
+                         float(wrapper.VECTOR_PAGE_DPI + 100))
+
+    def test_recorded(self):
+        """Check that the resolution recorded for a page takes precedence"""
+        self.options.ocr_dpi_max = 300
+        pageinfo = {'xres': 600, 'yres': 600}
+        self.assertEqual(wrapper.get_ocr_dpi(pageinfo, self.options), 300.0)
+        pageinfo['ocr_dpi'] = 400.0
+        self.assertEqual(wrapper.get_ocr_dpi(pageinfo, self.options), 400.0)
+
+
+@unittest.skipIf(wrapper is None, "ocrmypdf is not installed")
+class TestResume(TestCase):
+    def run_job(self, stages):
+        """Run a job in the work folder whose pipeline runs stages"""
+        options = wrapper.ocrOptions()
+        options.input_file = 'in.pdf'
+        context = wrapper.JobContext(options, self.temp_dir)
+        context.clear_run_state()
+
+        def execute_pipeline(name, options, work_folder, log, context):
+            for stage in stages:
+                with wrapper.measure(context.metrics_file, stage, 1, 1):
+                    pass
+            return 0
+
+        with mock.patch.object(wrapper, 'execute_pipeline',
+                               execute_pipeline):
+            wrapper.run_pipeline('test', options, self.temp_dir,
+                                 logging.getLogger('test_ocrmypdfwrapper'),
+                                 context)
+        context.pages.close()
+        return context.metrics
+
+    def test_resume_metrics(self):
+        """Check that stages of an interrupted run are not counted twice"""
+        first = self.run_job(['split_pages', 'ocr_tesseract_hocr'])
+        self.assertEqual(first.stages['ocr_tesseract_hocr'].calls, 1)
+        # The resumed run only redoes the stage that did not complete
+        second = self.run_job(['ocr_tesseract_hocr'])
+        self.assertEqual(list(second.stages), ['ocr_tesseract_hocr'])
+        self.assertEqual(second.stages['ocr_tesseract_hocr'].calls, 1)
+        self.assertEqual(second.pages, 1)
+
+
+@unittest.skipIf(wrapper is None, "ocrmypdf is not installed")
+class TestPdfaQueue(TestCase):
+    def setUp(self):
+        TestCase.setUp(self)
+        self.input_file = os.path.join(self.temp_dir, 'doc.pdf')
+        with open(self.input_file, 'wb') as f:
+            f.write(b'original')
+        self.options = wrapper.ocrOptions()
+
+    def convert(self, signature, modify=False):
+        """Run convert_to_pdfa with Ghostscript writing b'pdfa'"""
+        def generate_pdfa(inputs, output_file, log, threads):
+            with open(output_file, 'wb') as f:
+                f.write(b'pdfa')
+            if modify:
+                with open(self.input_file, 'ab') as f:
+                    f.write(b' changed')
+
+        with mock.patch.object(wrapper.ghostscript, 'generate_pdfa',
+                               side_effect=generate_pdfa), \
+                mock.patch.object(wrapper, 'file_claims_pdfa',
+                                  return_value={'pass': True,
+                                                'conformance': 'PDF/A-2B'}), \
+                mock.patch.object(wrapper.qpdf, 'check', return_value=True), \
+                mock.patch.object(wrapper, 'generate_pdfa_def'), \
+                mock.patch.object(wrapper, 'get_pdfmark'), \
+                mock.patch.object(wrapper.pypdf, 'PdfFileReader'):
+            return wrapper.convert_to_pdfa(
+                self.input_file, self.options, signature)
+
+    def test_file_signature(self):
+        """Check that the signature of a file changes with its content"""
+        signature = wrapper.file_signature(self.input_file)
+        self.assertEqual(wrapper.file_signature(self.input_file), signature)
+        with open(self.input_file, 'ab') as f:
+            f.write(b' changed')
+        self.assertNotEqual(wrapper.file_signature(self.input_file),
+                            signature)
+
+    def test_replace(self):
+        """Check that an unchanged document is replaced by its PDF/A"""
+        signature = wrapper.file_signature(self.input_file)
+        self.assertTrue(self.convert(signature))
+        with open(self.input_file, 'rb') as f:
+            self.assertEqual(f.read(), b'pdfa')
+        self.assertEqual(os.listdir(self.temp_dir), ['doc.pdf'])
+
+    def test_changed(self):
+        """Check that a document changed meanwhile is left as it is"""
+        signature = wrapper.file_signature(self.input_file)
+        self.assertFalse(self.convert(signature, modify=True))
+        with open(self.input_file, 'rb') as f:
+            self.assertEqual(f.read(), b'original changed')
+        self.assertEqual(os.listdir(self.temp_dir), ['doc.pdf'])
+
+    def test_submit(self):
+        """Check that the queue converts with the signature at submission"""
+        with mock.patch.object(wrapper, 'ProcessPoolExecutor') as executor:
+            queue = wrapper.PdfaQueue(self.options)
+            queue.submit(self.input_file)
+            queue.shutdown()
+        self.assertEqual(executor.call_args[1]['max_workers'], 1)
+        self.assertEqual(executor.call_args[1]['initargs'],
+                         (wrapper.PDFA_NICENESS,))
+        executor.return_value.submit.assert_called_once_with(
+            wrapper.convert_to_pdfa, self.input_file, self.options,
+            wrapper.file_signature(self.input_file))
+        executor.return_value.shutdown.assert_called_once_with(wait=True)
+
+
+@unittest.skipIf(wrapper is None, "ocrmypdf is not installed")
+class TestJobOutput(TestCase):
+    def setUp(self):
+        TestCase.setUp(self)
+        self.engine = wrapper.OcrEngine()
+        # Started without checking for the external programs
+        self.engine.tmp_dir = tempfile.TemporaryDirectory(dir=self.temp_dir)
+        self.addCleanup(self.engine.tmp_dir.cleanup)
+
+    def test_default_output_removed(self):
+        """Check that closing a job removes its default output"""
+        with wrapper.OcrJob(self.engine, 'in.pdf') as job:
+            output_dir = os.path.dirname(job.output_file)
+            open(job.output_file, 'w').close()
+            self.assertExists(job.output_file)
+        self.assertNotExists(output_dir)
+        self.assertEqual(os.listdir(self.engine.tmp_dir.name), [])
+
+    def test_given_output_kept(self):
+        """Check that an output the caller named is left alone"""
+        output = os.path.join(self.temp_dir, 'out.pdf')
+        open(output, 'w').close()
+        job = wrapper.OcrJob(self.engine, 'in.pdf', output)
+        job.close()
+        self.assertExists(output)
+
+    def test_temporary_output(self):
+        """Check that every temporary output is a new file"""
+        first, second = wrapper.temporary_output(), wrapper.temporary_output()
+        try:
+            self.assertNotEqual(first, second)
+            self.assertTrue(first.endswith('.pdf'))
+            self.assertExists(first)
+        finally:
+            os.remove(first)
+            os.remove(second)
+
+
+@unittest.skipIf(wrapper is None, "ocrmypdf is not installed")
+class TestPreview(TestCase):
+    def test_needs_preview(self):
+        """Check that dropped blank pages get no preview"""
+        self.assertTrue(wrapper.needs_preview('/w/000001.ocr.page.pdf'))
+        self.assertTrue(wrapper.needs_preview('/w/000002.skip.page.pdf'))
+        self.assertFalse(wrapper.needs_preview('/w/000003.drop.page.pdf'))
+        self.assertFalse(wrapper.needs_preview('/w/000003.page.pdf'))
+
+
+@unittest.skipIf(wrapper is None, "ocrmypdf is not installed")
+class TestBlankPages(TestCase):
+    def setUp(self):
+        TestCase.setUp(self)
+        self.log = logging.getLogger('test_ocrmypdfwrapper')
+
+    def page(self, name, specks=(), block=None):
+        """Write a white page of a letter at BLANK_DPI, return its name"""
+        image = os.path.join(self.temp_dir, name)
+        im = wrapper.Image.new('L', (340, 440), 255)
+        for xy in specks:
+            im.putpixel(xy, 0)
+        if block is not None:
+            im.paste(0, block)
+        im.save(image, 'PNG')
+        im.close()
+        return image
+
+    def test_ink_coverage(self):
+        """Check that only pages with text-sized ink are blank"""
+        threshold = wrapper.ocrOptions().blank_threshold
+        white = wrapper.ink_coverage(self.page('white.png'))
+        self.assertEqual(white, 0.0)
+        specks = wrapper.ink_coverage(self.page(
+            'specks.png', specks=[(50 + 20 * n, 100) for n in range(10)]))
+        self.assertGreater(specks, 0.0)
+        self.assertLess(specks, threshold)
+        # Margins are not looked at, e.g. punch holes and scanner edges
+        edge = wrapper.ink_coverage(self.page(
+            'edge.png', block=(0, 0, 10, 440)))
+        self.assertEqual(edge, 0.0)
+        # Hardly more than a line of text
+        text = wrapper.ink_coverage(self.page(
+            'text.png', block=(40, 60, 140, 66)))
+        self.assertGreater(text, threshold)
+
+    def test_skip(self):
+        """Check that blank pages are detected and skipped"""
+        images = [self.page('1.png'),
+                  self.page('2.png', block=(40, 60, 300, 200)),
+                  self.page('3.png', specks=[(100, 100)])]
+        options = wrapper.ocrOptions()
+        options.blank_pages = 'skip'
+        options.skip_text = True
+        pages = PageInfoStore(os.path.join(self.temp_dir, 'pageinfo'))
+        pages.write([{'pageno': n, 'images': [{'enc': 'image'}],
+                      'has_text': False} for n in range(3)])
+        self.addCleanup(pages.close)
+        context = types.SimpleNamespace(
+            options=options, pages=pages, work_folder=self.temp_dir,
+            work=WorkFolder(self.temp_dir))
+
+        def rasterize_pdfs(input_files, outputs, xres, yres, device, log):
+            for image, output in zip(images, outputs):
+                shutil.copy(image, output)
+
+        with mock.patch.object(wrapper, 'rasterize_pdfs', rasterize_pdfs):
+            wrapper.detect_blank_pages.__wrapped__(
+                'origin.repaired.pdf',
+                os.path.join(self.temp_dir, 'origin.blank'),
+                self.log, context)
+        self.assertEqual([bool(page.get('blank')) for page in pages.all()],
+                         [True, False, True])
+
+        def split_pages(input_file, work_folder, npages):
+            for n in range(npages):
+                open(os.path.join(
+                    work_folder, '{0:06d}.page.pdf'.format(n + 1)),
+                    'w').close()
+
+        with mock.patch.object(wrapper.qpdf, 'get_npages', return_value=3), \
+                mock.patch.object(wrapper.qpdf, 'split_pages', split_pages):
+            wrapper.split_pages.__wrapped__(
+                ['origin.repaired.pdf'], [], self.log, context)
+        for name in ('000001.skip.page.pdf', '000002.ocr.page.pdf',
+                     '000003.skip.page.pdf'):
+            self.assertExists(os.path.join(self.temp_dir, name))
+
+
+@unittest.skipIf(wrapper is None, "ocrmypdf is not installed")
+class TestRotateFromRaster(TestCase):
+    def test_uses_full_raster(self):
+        """Check that only pages to OCR are previewed from their raster"""
+        options = types.SimpleNamespace(rotate_from_raster=True)
+        self.assertTrue(wrapper.uses_full_raster(
+            '/w/000001.ocr.page.pdf', options))
+        self.assertFalse(wrapper.uses_full_raster(
+            '/w/000002.skip.page.pdf', options))
+        options.rotate_from_raster = False
+        self.assertFalse(wrapper.uses_full_raster(
+            '/w/000001.ocr.page.pdf', options))
+
+    def test_rotate_raster(self):
+        """Check that a raster is turned counterclockwise with its DPI"""
+        raster = os.path.join(self.temp_dir, '000001.page.png')
+        im = wrapper.Image.new('L', (20, 10), 255)
+        im.putpixel((0, 0), 0)
+        im.save(raster, 'PNG', dpi=(300, 200))
+        im.close()
+
+        wrapper.rotate_raster(raster, 90)
+        with wrapper.Image.open(raster) as im:
+            self.assertEqual(im.size, (10, 20))
+            self.assertEqual(im.getpixel((0, 19)), 0)
+            self.assertEqual([round(d) for d in im.info['dpi']], [200, 300])
+
+        wrapper.rotate_raster(raster, 180)
+        with wrapper.Image.open(raster) as im:
+            self.assertEqual(im.size, (10, 20))
+            self.assertEqual(im.getpixel((9, 0)), 0)
+
+        wrapper.rotate_raster(raster, 90)
+        with wrapper.Image.open(raster) as im:
+            self.assertEqual(im.size, (20, 10))
+            self.assertEqual(im.getpixel((0, 0)), 0)
+            self.assertEqual([round(d) for d in im.info['dpi']], [300, 200])
+
+
+@unittest.skipIf(wrapper is None, "ocrmypdf is not installed")
+class TestImageLayer(TestCase):
+    def test_transform(self):
+        """Check that rotated and offset image layers are put back"""
+        self.assertEqual(wrapper.get_image_layer_transform(0, 0, 0, 20, 10),
+                         (0, 0, 0))
+        self.assertEqual(wrapper.get_image_layer_transform(0, 5, 7, 20, 10),
+                         (0, -5, -7))
+        self.assertEqual(wrapper.get_image_layer_transform(90, 0, 0, 20, 10),
+                         (270, 0, 20))
+        self.assertEqual(wrapper.get_image_layer_transform(270, 0, 0, 20, 10),
+                         (90, 10, 0))
+        self.assertEqual(wrapper.get_image_layer_transform(180, 0, 0, 20, 10),
+                         (180, 20, 10))
+        with self.assertRaises(ValueError):
+            wrapper.get_image_layer_transform(45, 0, 0, 20, 10)
+
+
+@unittest.skipIf(pikepdf is None, "pikepdf is not installed")
+class TestJpegPassthrough(TestCase):
+    def path(self, name):
+        return os.path.join(self.temp_dir, name)
+
+    def write_jpeg_page(self, content=b'q 200 0 0 100 0 0 cm /Im0 Do Q',
+                        mode='RGB', colorspace=None, rotate=None):
+        """Write a page that shows a JPEG, return the JPEG data"""
+        jpeg = self.path('image.jpg')
+        wrapper.Image.new(mode, (20, 10)).save(jpeg, 'JPEG')
+        with open(jpeg, 'rb') as f:
+            data = f.read()
+        pdf = pikepdf.new()
+        pdf.add_blank_page(page_size=(200, 100))
+        page = pdf.pages[0]
+        image = pikepdf.Stream(pdf, data)
+        image.Type = pikepdf.Name.XObject
+        image.Subtype = pikepdf.Name.Image
+        image.Width = 20
+        image.Height = 10
+        image.BitsPerComponent = 8
+        image.ColorSpace = pikepdf.Name(colorspace or (
+            '/DeviceGray' if mode == 'L' else '/DeviceRGB'))
+        image.Filter = pikepdf.Name.DCTDecode
+        page.Resources = pikepdf.Dictionary(
+            XObject=pikepdf.Dictionary(Im0=image))
+        page.Contents = pdf.make_stream(content)
+        if rotate is not None:
+            page.Rotate = rotate
+        pdf.save(self.path('page.pdf'))
+        pdf.close()
+        return data
+
+    def test_uses_original_jpeg(self):
+        """Check that only the hOCR renderer takes the original JPEG"""
+        options = types.SimpleNamespace(pdf_renderer='hocr', oversample=0)
+        pageinfo = {'images': [{'enc': 'jpeg'}]}
+        self.assertTrue(wrapper.uses_original_jpeg(
+            '.page.png', pageinfo, options))
+        self.assertFalse(wrapper.uses_original_jpeg(
+            '.pp-deskew.png', pageinfo, options))
+        self.assertFalse(wrapper.uses_original_jpeg(
+            '.page.png', {'images': [{'enc': 'jpeg'}, {'enc': 'jpeg'}]},
+            options))
+        self.assertFalse(wrapper.uses_original_jpeg(
+            '.page.png', {'images': [{'enc': 'image'}]}, options))
+        options.oversample = 300
+        self.assertFalse(wrapper.uses_original_jpeg(
+            '.page.png', pageinfo, options))
+        # tesseract would size its page from the JPEG
+        options.oversample = 0
+        options.pdf_renderer = 'tesseract'
+        self.assertFalse(wrapper.uses_original_jpeg(
+            '.page.png', pageinfo, options))
+
+    def select_image(self, pdf_renderer):
+        """Run select_image_for_pdf on a page that shows only a JPEG"""
+        data = self.write_jpeg_page()
+        os.rename(self.path('page.pdf'), self.path('000001.ocr.oriented.pdf'))
+        raster = self.path('000001.page.png')
+        wrapper.Image.new('RGB', (60, 30)).save(raster, 'PNG', dpi=(72, 72))
+        options = wrapper.ocrOptions()
+        options.pdf_renderer = pdf_renderer
+        pages = mock.Mock()
+        pages.get.return_value = {
+            'pageno': 0, 'xres': 72, 'yres': 72, 'images': [{'enc': 'jpeg'}]}
+        context = types.SimpleNamespace(options=options, pages=pages)
+        wrapper.select_image_for_pdf.__wrapped__(
+            [raster], self.path('000001.image'),
+            logging.getLogger('test_ocrmypdfwrapper'), context)
+        return data, pages
+
+    def test_select_hocr(self):
+        """Check that the hOCR renderer gets the original JPEG"""
+        data, pages = self.select_image('hocr')
+        with open(self.path('000001.image'), 'rb') as f:
+            self.assertEqual(f.read(), data)
+        pages.update.assert_called_once_with(0, 'passthrough', True)
+
+    def test_select_tesseract(self):
+        """Check that tesseract gets the raster at the page resolution"""
+        data, pages = self.select_image('tesseract')
+        with wrapper.Image.open(self.path('000001.image')) as im:
+            self.assertEqual(im.format, 'JPEG')
+            self.assertEqual(im.size, (60, 30))
+            self.assertEqual(im.info['dpi'], (72, 72))
+        pages.update.assert_not_called()
+
+    def test_multiply_matrix(self):
+        """Check that transformation matrices are combined in order"""
+        scale = [2, 0, 0, 3, 0, 0]
+        move = [1, 0, 0, 1, 5, 7]
+        self.assertEqual(wrapper.multiply_matrix(scale, move),
+                         [2, 0, 0, 3, 5, 7])
+        self.assertEqual(wrapper.multiply_matrix(move, scale),
+                         [2, 0, 0, 3, 10, 21])
+
+    def test_passthrough(self):
+        """Check that a JPEG filling the page is reused unchanged"""
+        data = self.write_jpeg_page()
+        self.assertEqual(wrapper.get_page_jpeg(self.path('page.pdf')), data)
+        data = self.write_jpeg_page(mode='L')
+        self.assertEqual(wrapper.get_page_jpeg(self.path('page.pdf')), data)
+        data = self.write_jpeg_page(
+            b'q 1 0 0 1 0 0 cm q 2 0 0 1 0 0 cm 100 0 0 100 0 0 cm '
+            b'/Im0 Do Q Q')
+        self.assertEqual(wrapper.get_page_jpeg(self.path('page.pdf')), data)
+
+    def test_no_passthrough(self):
+        """Check that JPEGs that cannot be copied as they are are rejected"""
+        # Not filling the page
+        self.write_jpeg_page(b'q 100 0 0 100 0 0 cm /Im0 Do Q')
+        self.assertIsNone(wrapper.get_page_jpeg(self.path('page.pdf')))
+        # Drawn upside down
+        self.write_jpeg_page(b'q -200 0 0 -100 200 100 cm /Im0 Do Q')
+        self.assertIsNone(wrapper.get_page_jpeg(self.path('page.pdf')))
+        # Something else is drawn as well
+        self.write_jpeg_page(b'q 200 0 0 100 0 0 cm /Im0 Do Q 0 0 5 5 re f')
+        self.assertIsNone(wrapper.get_page_jpeg(self.path('page.pdf')))
+        # Rotated page
+        self.write_jpeg_page(rotate=90)
+        self.assertIsNone(wrapper.get_page_jpeg(self.path('page.pdf')))
+        # CMYK
+        self.write_jpeg_page(mode='CMYK', colorspace='/DeviceCMYK')
+        self.assertIsNone(wrapper.get_page_jpeg(self.path('page.pdf')))
+
+
+@unittest.skipIf(pikepdf is None, "pikepdf is not installed")
+class TestOverlay(TestCase):
+    def setUp(self):
+        TestCase.setUp(self)
+        self.log = logging.getLogger('test_ocrmypdfwrapper')
+
+    def path(self, name):
+        return os.path.join(self.temp_dir, name)
+
+    def test_overlay_image_layer(self):
+        """Check that the image page is drawn onto the text page"""
+        write_pdf(self.path('image.pdf'), b'0 0 1 rg 0 0 200 100 re f',
+                  rotate=90)
+        pdf = pikepdf.new()
+        pdf.add_blank_page(page_size=(200, 100))
+        with pikepdf.open(self.path('image.pdf')) as image:
+            wrapper.overlay_image_layer(
+                pdf, pdf.pages[0], image.pages[0], 1, self.log)
+            pdf.save(self.path('out.pdf'))
+        pdf.close()
+
+        with pikepdf.open(self.path('out.pdf')) as out:
+            page = pikepdf.Page(out.pages[0])
+            xobject = page.obj.Resources.XObject.EasydmsImageLayer
+            self.assertEqual(xobject.Subtype, '/Form')
+            self.assertIn(b'0 0 200 100 re', xobject.read_bytes())
+            content = b''.join(stream.read_bytes()
+                               for stream in page.obj.Contents) \
+                if isinstance(page.obj.Contents, pikepdf.Array) \
+                else page.obj.Contents.read_bytes()
+            self.assertIn(b'cm /EasydmsImageLayer Do', content)
+            self.assertIn(b'q 0.0 -1.0 1.0 0.0 0.0 200.0 cm', content)
+
+    def test_overlay_pages(self):
+        """Check that pages are put together in order and sources closed"""
+        write_pdf(self.path('000001.hocr.pdf'), b'BT ET')
+        write_pdf(self.path('000001.image-layer.pdf'), b'0 0 5 5 re f')
+        write_pdf(self.path('000002.done.pdf'), b'0 0 7 7 re f')
+        pages = {
+            1: [self.path('000001.hocr.pdf'),
+                self.path('000001.image-layer.pdf')],
+            2: [self.path('000002.done.pdf')],
+        }
+        wrapper.overlay_pages(pages, self.path('out.pdf'), self.log)
+        with pikepdf.open(self.path('out.pdf')) as out:
+            self.assertEqual(len(out.pages), 2)
+            self.assertIn('/EasydmsImageLayer',
+                          out.pages[0].Resources.XObject)
+            self.assertIn(b'0 0 7 7 re', out.pages[1].Contents.read_bytes())
+        # The sources can be removed, they are not referred to anymore
+        for files in pages.values():
+            for filename in files:
+                os.unlink(filename)
+        with pikepdf.open(self.path('out.pdf')) as out:
+            self.assertEqual(len(out.pages), 2)
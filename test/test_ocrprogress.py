@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of easydms.
+# Copyright (c) 2015 Peter Kessen
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject
+# to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+# OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4
+
+"""Test following the progress of OCR jobs."""
+
+from _common import TestCase
+import os
+
+import easydms.ocrmetrics
+import easydms.ocrprogress
+
+
+class TestOcrProgress(TestCase):
+    def setUp(self):
+        super(TestOcrProgress, self).setUp()
+        self.path = os.path.join(self.temp_dir, 'metrics.jsonl')
+        self.events = []
+        self.monitor = easydms.ocrprogress.ProgressMonitor(
+            self.path, self.events.append, 'a.pdf',
+            ('ocr_tesseract_hocr',), lambda: 2)
+
+    def kinds(self):
+        return [(e.kind, e.page) for e in self.events]
+
+    def test_pages(self):
+        """Check that started and done pages are reported"""
+        with easydms.ocrmetrics.measure(self.path, 'split_pages', 2):
+            pass
+        for page in (1, 2):
+            with easydms.ocrmetrics.measure(
+                    self.path, 'ocr_tesseract_hocr', 1, page):
+                pass
+        self.monitor.poll()
+        self.assertEqual(self.kinds(), [
+            ('stage_finished', None),
+            ('page_started', 1),
+            ('stage_finished', 1),
+            ('page_done', 1),
+            ('page_started', 2),
+            ('stage_finished', 2),
+            ('page_done', 2),
+        ])
+        done = self.events[3]
+        self.assertEqual(done.pages_done, 1)
+        self.assertEqual(done.pages_total, 2)
+        self.assertIsNotNone(done.eta)
+        self.assertEqual(self.events[-1].pages_done, 2)
+        self.assertEqual(self.events[-1].eta, 0.0)
+
+    def test_partial_line(self):
+        """Check that a half written record is read once it is complete"""
+        easydms.ocrmetrics.append_record(self.path, {
+            'stage': 'ocr_tesseract_hocr', 'begin': 1.0, 'page': 1})
+        with open(self.path, 'a') as f:
+            f.write('{"stage": "ocr_tesseract_hocr", ')
+        self.monitor.poll()
+        self.assertEqual(self.kinds(), [('page_started', 1)])
+        with open(self.path, 'a') as f:
+            f.write('"start": 1.0, "wall": 1.0, "cpu": 1.0, "pages": 1, '
+                    '"page": 1}\n')
+        self.monitor.poll()
+        self.assertEqual(self.kinds()[-1], ('page_done', 1))
+
+    def test_job_done(self):
+        """Check that stopping reports the end of the job"""
+        self.monitor.start()
+        with easydms.ocrmetrics.measure(
+                self.path, 'ocr_tesseract_hocr', 1, 1):
+            pass
+        self.monitor.stop()
+        self.assertEqual(self.kinds()[-1], ('job_done', None))
+        self.assertEqual(self.events[-1].pages_done, 1)
+        self.assertEqual(
+            [e.kind for e in self.events].count('page_done'), 1)
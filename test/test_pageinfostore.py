@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of easydms.
+# Copyright (c) 2015 Peter Kessen
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject
+# to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+# OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4
+
+"""Test the file-backed page information store."""
+
+from _common import TestCase
+import multiprocessing
+import os
+import pickle
+
+import easydms.pageinfostore
+
+
+def _rotate_page(store, pageno):
+    store.update(pageno, 'rotated', 270)
+
+
+class TestPageInfoStore(TestCase):
+    def setUp(self):
+        super(TestPageInfoStore, self).setUp()
+        self.pages = [
+            {'pageno': n, 'width_inches': 8.27, 'images': [{'enc': 'jpeg'}]}
+            for n in range(5)]
+        self.store = easydms.pageinfostore.PageInfoStore(
+            os.path.join(self.temp_dir, 'pageinfo'))
+        self.store.write(self.pages)
+
+    def tearDown(self):
+        self.store.close()
+        super(TestPageInfoStore, self).tearDown()
+
+    def test_roundtrip(self):
+        """Check that every page reads back as written"""
+        self.assertEqual(len(self.store), 5)
+        self.assertEqual(self.store.get(3), self.pages[3])
+        self.assertEqual(self.store.all(), self.pages)
+
+    def test_copies(self):
+        """Check that callers may modify the dicts they get"""
+        self.store.get(1)['rotated'] = 90
+        self.assertNotIn('rotated', self.store.get(1))
+
+    def test_update(self):
+        """Check that updates are visible only on the page they concern"""
+        self.store.update(2, 'rotated', 180)
+        self.assertEqual(self.store.get(2)['rotated'], 180)
+        self.assertNotIn('rotated', self.store.get(1))
+        self.assertNotIn('rotated', self.store.get(3))
+
+    def test_update_from_other_process(self):
+        """Check that workers share updates without further IPC"""
+        self.store.get(4)  # map the table in this process first
+        clone = pickle.loads(pickle.dumps(self.store))
+        proc = multiprocessing.Process(target=_rotate_page, args=(clone, 4))
+        proc.start()
+        proc.join()
+        self.assertEqual(self.store.get(4)['rotated'], 270)
+
+    def test_rewrite(self):
+        """Check that writing a new table replaces a mapped one"""
+        self.store.update(0, 'rotated', 90)
+        self.store.write(self.pages[:2])
+        self.assertEqual(len(self.store), 2)
+        self.assertNotIn('rotated', self.store.get(0))
@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of easydms.
+# Copyright (c) 2015 Peter Kessen
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject
+# to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+# OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4
+
+
+"""Test merging single page PDFs with pdfmerge."""
+
+from _common import TestCase
+import logging
+import os
+import unittest
+
+import easydms.pdfmerge as pdfmerge
+
+pikepdf = pdfmerge.pikepdf
+
+
+def font(pdf, name=b'Helvetica'):
+    return pdf.make_indirect(pikepdf.Dictionary(
+        Type=pikepdf.Name.Font, Subtype=pikepdf.Name.Type1,
+        BaseFont=pikepdf.Name('/' + name.decode('ascii'))))
+
+
+def write_page(filename, text, name=b'Helvetica'):
+    """Write a one page PDF showing text in its own copy of a font"""
+    pdf = pikepdf.new()
+    pdf.add_blank_page(page_size=(200, 100))
+    page = pdf.pages[0]
+    page.Resources = pikepdf.Dictionary(
+        Font=pikepdf.Dictionary(F1=font(pdf, name)))
+    page.Contents = pdf.make_stream(
+        'BT /F1 12 Tf 10 50 Td ({0}) Tj ET'.format(text).encode('ascii'))
+    pdf.save(filename)
+    pdf.close()
+
+
+@unittest.skipUnless(pdfmerge.available(), "pikepdf is not installed")
+class TestPdfMerge(TestCase):
+    def setUp(self):
+        TestCase.setUp(self)
+        self.log = logging.getLogger('test_pdfmerge')
+
+    def make_pages(self, count):
+        files = []
+        for n in range(count):
+            filename = os.path.join(self.temp_dir, '{0:06d}.pdf'.format(n))
+            write_page(filename, 'page {0}'.format(n))
+            files.append(filename)
+        return files
+
+    def test_object_digest(self):
+        """Check that digests depend on content, not on object numbers"""
+        pdf = pikepdf.new()
+        first, second, other = font(pdf), font(pdf), font(pdf, b'Courier')
+        memo = {}
+        self.assertNotEqual(first.objgen, second.objgen)
+        self.assertEqual(pdfmerge.object_digest(first, memo),
+                         pdfmerge.object_digest(second, memo))
+        self.assertNotEqual(pdfmerge.object_digest(first, memo),
+                            pdfmerge.object_digest(other, memo))
+        self.assertIn(first.objgen, memo)
+
+    def test_object_digest_cycle(self):
+        """Check that objects referring to themselves are digested"""
+        pdf = pikepdf.new()
+        node = pdf.make_indirect(pikepdf.Dictionary(Type=pikepdf.Name.Node))
+        node.Self = node
+        self.assertTrue(pdfmerge.object_digest(node, {}))
+
+    def test_deduplicate(self):
+        """Check that identical fonts of different pages are shared"""
+        pdf = pikepdf.new()
+        for _ in range(3):
+            pdf.add_blank_page()
+            pdf.pages[-1].Resources = pikepdf.Dictionary(
+                Font=pikepdf.Dictionary(F1=font(pdf)))
+        dedup = pdfmerge.ResourceDeduplicator()
+        for page in pdf.pages:
+            dedup(pikepdf.Page(page))
+        self.assertEqual(dedup.replaced, 2)
+        fonts = set(page.Resources.Font.F1.objgen for page in pdf.pages)
+        self.assertEqual(len(fonts), 1)
+
+    def test_merge(self):
+        """Check that pages are merged in order with one font"""
+        output = os.path.join(self.temp_dir, 'out.pdf')
+        files = self.make_pages(3)
+        pdfmerge.merge(files, output, {'/Title': 'Test', '/Author': ''},
+                       self.log)
+        with pikepdf.open(output) as pdf:
+            self.assertEqual(len(pdf.pages), 3)
+            self.assertIn(b'page 2', pdf.pages[2].Contents.read_bytes())
+            fonts = set(page.Resources.Font.F1.objgen for page in pdf.pages)
+            self.assertEqual(len(fonts), 1)
+            self.assertEqual(str(pdf.docinfo.Title), 'Test')
+            self.assertNotIn('/Author', pdf.docinfo)
+
+    def test_merge_batches(self):
+        """Check that long lists are merged in batches without leftovers"""
+        output = os.path.join(self.temp_dir, 'out.pdf')
+        files = self.make_pages(10)
+        pdfmerge.merge(files, output, {}, self.log, batch=3)
+        with pikepdf.open(output) as pdf:
+            self.assertEqual(len(pdf.pages), 10)
+            for n, page in enumerate(pdf.pages):
+                self.assertIn('page {0}'.format(n).encode('ascii'),
+                              page.Contents.read_bytes())
+        expected = [os.path.basename(f) for f in files] + ['out.pdf']
+        self.assertEqual(sorted(os.listdir(self.temp_dir)), sorted(expected))
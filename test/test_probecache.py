@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of easydms.
+# Copyright (c) 2015 Peter Kessen
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject
+# to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+# OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4
+
+"""Test caching of external program probes."""
+
+from _common import TestCase
+import os
+import stat
+
+import easydms.config
+import easydms.probecache
+
+
+class TestProbeCache(TestCase):
+    def setUp(self):
+        super(TestProbeCache, self).setUp()
+        self.binary = os.path.join(self.temp_dir, 'fakeprog')
+        with open(self.binary, 'w') as f:
+            f.write('#!/bin/sh\n')
+        os.chmod(self.binary, stat.S_IRWXU)
+        self.cachefile = os.path.join(self.temp_dir, 'cache', 'probes.json')
+        self.calls = 0
+
+    def _probe(self):
+        self.calls += 1
+        return ['deu', 'eng']
+
+    def test_cached_across_instances(self):
+        """Check that a probe runs only once for an unchanged binary"""
+        cache = easydms.probecache.ProbeCache(self.cachefile)
+        self.assertEqual(cache.get(self.binary, 'langs', self._probe),
+                         ['deu', 'eng'])
+        self.assertEqual(cache.get(self.binary, 'langs', self._probe),
+                         ['deu', 'eng'])
+        self.assertExists(self.cachefile)
+
+        cache = easydms.probecache.ProbeCache(self.cachefile)
+        cache.get(self.binary, 'langs', self._probe)
+        self.assertEqual(self.calls, 1)
+
+    def test_changed_binary(self):
+        """Check that replacing the binary invalidates its probes"""
+        cache = easydms.probecache.ProbeCache(self.cachefile)
+        cache.get(self.binary, 'langs', self._probe)
+        st = os.stat(self.binary)
+        os.utime(self.binary, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+        cache.get(self.binary, 'langs', self._probe)
+        self.assertEqual(self.calls, 2)
+
+    def test_changed_depends(self):
+        """Check that changing a directory a probe depends on invalidates it"""
+        tessdata = os.path.join(self.temp_dir, 'tessdata')
+        os.mkdir(tessdata)
+        cache = easydms.probecache.ProbeCache(self.cachefile)
+        cache.get(self.binary, 'langs', self._probe, depends=[tessdata])
+        cache.get(self.binary, 'langs', self._probe, depends=[tessdata])
+        self.assertEqual(self.calls, 1)
+
+        st = os.stat(tessdata)
+        open(os.path.join(tessdata, 'fra.traineddata'), 'w').close()
+        os.utime(tessdata, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+        cache = easydms.probecache.ProbeCache(self.cachefile)
+        cache.get(self.binary, 'langs', self._probe, depends=[tessdata])
+        self.assertEqual(self.calls, 2)
+        cache.get(self.binary, 'langs', self._probe, depends=[tessdata])
+        self.assertEqual(self.calls, 2)
+
+        other = os.path.join(self.temp_dir, 'other')
+        cache.get(self.binary, 'langs', self._probe, depends=[other])
+        self.assertEqual(self.calls, 3)
+
+    def test_depends_per_probe(self):
+        """Check that depends of one probe leave the others cached"""
+        cache = easydms.probecache.ProbeCache(self.cachefile)
+        cache.get(self.binary, 'version', self._probe)
+        cache.get(self.binary, 'langs', self._probe, depends=[self.temp_dir])
+        cache.get(self.binary, 'version', self._probe)
+        self.assertEqual(self.calls, 2)
+
+    def test_missing_binary(self):
+        """Check that probes of missing programs are never cached"""
+        cache = easydms.probecache.ProbeCache(self.cachefile)
+        missing = os.path.join(self.temp_dir, 'missing')
+        cache.get(missing, 'langs', self._probe)
+        cache.get(missing, 'langs', self._probe)
+        self.assertEqual(self.calls, 2)
+        self.assertNotExists(self.cachefile)
+
+    def test_default_location(self):
+        """Check that the cache lives below the user's cache directory"""
+        old = os.environ.get('XDG_CACHE_HOME')
+        os.environ['XDG_CACHE_HOME'] = os.path.join(self.temp_dir, 'xdg')
+        try:
+            cache = easydms.probecache.ProbeCache()
+            self.assertEqual(
+                cache.path,
+                os.path.join(self.temp_dir, 'xdg', 'easydms', 'probes.json'))
+            self.assertEqual(os.path.dirname(cache.path),
+                             easydms.config.cache_location())
+        finally:
+            if old is None:
+                del os.environ['XDG_CACHE_HOME']
+            else:
+                os.environ['XDG_CACHE_HOME'] = old
@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of easydms.
+# Copyright (c) 2015 Peter Kessen
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject
+# to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+# OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4
+
+"""Test looking up child processes in /proc."""
+
+from _common import TestCase
+import os
+import signal
+import subprocess
+import sys
+
+import easydms.proctree as proctree
+
+
+class TestProcTree(TestCase):
+    def _process(self, pid, ppid, comm='sleep', cmdline=b'sleep\x0060\x00'):
+        path = os.path.join(self.temp_dir, str(pid))
+        os.makedirs(path)
+        with open(os.path.join(path, 'stat'), 'w') as f:
+            f.write('{0} ({1}) S {2} 1 1 0 -1\n'.format(pid, comm, ppid))
+        with open(os.path.join(path, 'cmdline'), 'wb') as f:
+            f.write(cmdline)
+
+    def test_descendants(self):
+        """Check that children and grandchildren are found"""
+        self._process(10, 1)
+        self._process(11, 10, comm='gs (worker) x')
+        self._process(12, 11)
+        self._process(13, 10)
+        self._process(20, 1)
+        os.makedirs(os.path.join(self.temp_dir, 'self'))
+        self.assertEqual(proctree.parent_pid(11, self.temp_dir), 10)
+        self.assertEqual(proctree.descendants(10, self.temp_dir),
+                         [11, 13, 12])
+        self.assertEqual(proctree.descendants(20, self.temp_dir), [])
+        self.assertIsNone(proctree.parent_pid(99, self.temp_dir))
+
+    def test_command_line(self):
+        """Check that the arguments of a process are split"""
+        self._process(10, 1, cmdline=b'tesseract\x00/tmp/job/1.png\x00')
+        self.assertEqual(proctree.command_line(10, self.temp_dir),
+                         ['tesseract', '/tmp/job/1.png'])
+        self.assertEqual(proctree.command_line(99, self.temp_dir), [])
+
+    def test_missing_proc(self):
+        """Check that no children are found without procfs"""
+        missing = os.path.join(self.temp_dir, 'missing')
+        self.assertEqual(proctree.descendants(1, missing), [])
+
+    def test_terminate_child(self):
+        """Check that a running child process is found and terminated"""
+        if not os.path.isdir('/proc/self'):
+            self.skipTest("no procfs")
+        child = subprocess.Popen(
+            [sys.executable, '-c', 'import time; time.sleep(60)'])
+        try:
+            self.assertIn(child.pid, proctree.descendants(os.getpid()))
+            self.assertEqual(
+                proctree.send_signal([child.pid], signal.SIGTERM), 1)
+            self.assertEqual(child.wait(timeout=10), -signal.SIGTERM)
+        finally:
+            if child.poll() is None:
+                child.kill()
+                child.wait()
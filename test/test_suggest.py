@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of easydms.
+# Copyright (c) 2015 Peter Kessen
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject
+# to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+# OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4
+
+"""Test suggesting document metadata from OCRed text."""
+
+from _common import TestCase
+import datetime
+
+import easydms.suggest as suggest
+
+LETTER = """Stadtwerke Musterstadt GmbH · Postfach 12 34 · 12345 Musterstadt
+
+Herrn Max Mustermann                       Musterstadt, 24. Dezember 2016
+Beispielweg 1                              Kundennr. 4711-0815
+
+Rechnung vom 20.12.16
+"""
+
+
+class TestSuggest(TestCase):
+    def test_dates(self):
+        """Check that dates in German notation are found in order"""
+        self.assertEqual(suggest.find_dates(LETTER), [
+            datetime.date(2016, 12, 24), datetime.date(2016, 12, 20)])
+
+    def test_date_notations(self):
+        """Check numeric, ISO and English dates"""
+        self.assertEqual(
+            suggest.find_dates("Date: 2017-03-01, due March 15th, 2017"),
+            [datetime.date(2017, 3, 1), datetime.date(2017, 3, 15)])
+        self.assertEqual(suggest.find_dates("am 03/04/99"),
+                         [datetime.date(1999, 4, 3)])
+
+    def test_invalid_dates(self):
+        """Check that numbers that are no valid dates are ignored"""
+        self.assertEqual(suggest.find_dates("Kundennr. 31.02.2016 4711"), [])
+
+    def test_companies(self):
+        """Check that known companies are found despite OCR errors"""
+        names = ['Stadtwerke Musterstadt', 'Musterbank', 'Telekom']
+        self.assertEqual(suggest.find_companies(LETTER, names),
+                         ['Stadtwerke Musterstadt'])
+        self.assertEqual(
+            suggest.find_companies("Stadtwerke Mustcrstadt GmbH", names),
+            ['Stadtwerke Musterstadt'])
+        self.assertEqual(suggest.find_companies("Sparkasse", names), [])
+
+    def test_word_boundaries(self):
+        """Check that a name does not match the start of a longer word"""
+        self.assertEqual(
+            suggest.find_companies("Ihr Baumarkt am Ring", ['Bau']), [])
+        self.assertEqual(
+            suggest.find_companies("Ihre Rechnung vom Mai", ['Ihr']), [])
+        self.assertLess(suggest.company_score('Bau', "Baumarkt"),
+                        suggest.COMPANY_MIN_SIMILARITY)
+        self.assertEqual(suggest.company_score('Bau', "Bau und Garten"), 1.0)
+
+    def test_exact_match_first(self):
+        """Check that an exact name ranks before a similar one"""
+        names = ['Musterbank Sud', 'Musterbank Süd', 'Musterbank Nord']
+        self.assertEqual(
+            suggest.find_companies("Musterbank Süd AG, Ring 1", names),
+            ['Musterbank Süd', 'Musterbank Sud'])
+
+    def test_suggest(self):
+        """Check that all suggestions are made at once"""
+        result = suggest.suggest(LETTER, ['Stadtwerke Musterstadt'])
+        self.assertEqual(result.text, LETTER)
+        self.assertEqual(result.dates[0], datetime.date(2016, 12, 24))
+        self.assertEqual(result.companies, ['Stadtwerke Musterstadt'])
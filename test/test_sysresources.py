@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of easydms.
+# Copyright (c) 2015 Peter Kessen
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject
+# to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+# OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4
+
+"""Test detection of the CPUs and memory available in containers."""
+
+from _common import TestCase
+import os
+
+import easydms.sysresources as sysresources
+
+
+class TestSysResources(TestCase):
+    def _file(self, path, content):
+        path = os.path.join(self.temp_dir, path.lstrip('/'))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w') as f:
+            f.write(content)
+
+    def test_cgroup_v2(self):
+        """Check the limits of a cgroup v2 container"""
+        self._file('/proc/self/cgroup', '0::/\n')
+        self._file('/sys/fs/cgroup/cpu.max', '400000 100000\n')
+        self._file('/sys/fs/cgroup/memory.max', '2147483648\n')
+        self.assertEqual(sysresources.cgroup_cpu_limit(self.temp_dir), 4.0)
+        self.assertEqual(sysresources.cgroup_memory_limit(self.temp_dir),
+                         2147483648)
+
+    def test_cgroup_v2_nested(self):
+        """Check that the tightest limit on the way to the root counts"""
+        self._file('/proc/self/cgroup', '0::/kubepods/pod1/ctr\n')
+        self._file('/sys/fs/cgroup/kubepods/cpu.max', '200000 100000\n')
+        self._file('/sys/fs/cgroup/kubepods/pod1/ctr/cpu.max',
+                   'max 100000\n')
+        self.assertEqual(sysresources.cgroup_cpu_limit(self.temp_dir), 2.0)
+        self.assertIsNone(sysresources.cgroup_memory_limit(self.temp_dir))
+
+    def test_cgroup_v1(self):
+        """Check the limits of a cgroup v1 container"""
+        self._file('/proc/self/cgroup',
+                   '4:cpu,cpuacct:/docker/abc\n3:memory:/docker/abc\n')
+        self._file('/sys/fs/cgroup/cpu,cpuacct/cpu.cfs_quota_us', '150000\n')
+        self._file('/sys/fs/cgroup/cpu,cpuacct/cpu.cfs_period_us',
+                   '100000\n')
+        self._file('/sys/fs/cgroup/memory/memory.limit_in_bytes',
+                   '1073741824\n')
+        self.assertEqual(sysresources.cgroup_cpu_limit(self.temp_dir), 1.5)
+        self.assertEqual(sysresources.cgroup_memory_limit(self.temp_dir),
+                         1073741824)
+        self.assertLessEqual(sysresources.cpu_count(self.temp_dir), 2)
+
+    def test_cgroup_v1_unlimited(self):
+        """Check that unlimited cgroup v1 values are no limits"""
+        self._file('/proc/self/cgroup', '4:cpu:/\n3:memory:/\n')
+        self._file('/sys/fs/cgroup/cpu/cpu.cfs_quota_us', '-1\n')
+        self._file('/sys/fs/cgroup/cpu/cpu.cfs_period_us', '100000\n')
+        self._file('/sys/fs/cgroup/memory/memory.limit_in_bytes',
+                   '9223372036854771712\n')
+        self.assertIsNone(sysresources.cgroup_cpu_limit(self.temp_dir))
+        self.assertIsNone(sysresources.cgroup_memory_limit(self.temp_dir))
+
+    def test_available_memory(self):
+        """Check that the smaller of free memory and cgroup limit counts"""
+        self._file('/proc/meminfo',
+                   'MemTotal: 16000000 kB\nMemAvailable: 8000000 kB\n')
+        self.assertEqual(sysresources.available_memory(self.temp_dir),
+                         8000000 * 1024)
+        self._file('/proc/self/cgroup', '0::/\n')
+        self._file('/sys/fs/cgroup/memory.max', '1000000\n')
+        self.assertEqual(sysresources.available_memory(self.temp_dir),
+                         1000000)
+
+    def test_plan_jobs(self):
+        """Check that memory limits parallel pages and spare CPUs thread"""
+        page = sysresources.page_memory(
+            {'width_inches': 8.27, 'height_inches': 11.69}, 300)
+        self.assertEqual(sysresources.plan_jobs(4, None, page), (4, 1))
+        self.assertEqual(sysresources.plan_jobs(8, 2 * page, page), (2, 4))
+        self.assertEqual(sysresources.plan_jobs(4, page // 2, page), (1, 4))
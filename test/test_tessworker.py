@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of easydms.
+# Copyright (c) 2015 Peter Kessen
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject
+# to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+# OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4
+
+
+"""Test running tesseract through its API in the worker processes."""
+
+from _common import TestCase
+import logging
+import os
+import threading
+import unittest
+from unittest import mock
+
+try:
+    import easydms.tessworker as tessworker
+except ImportError:
+    tessworker = None
+
+
+@unittest.skipIf(tessworker is None, "Pillow is not installed")
+class TestTessWorker(TestCase):
+    def setUp(self):
+        TestCase.setUp(self)
+        # Keep the APIs made by the tests apart from real ones
+        for name, value in (('_local', threading.local()),
+                            ('_loaded', True)):
+            patcher = mock.patch.object(tessworker, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def fake_tesserocr(self):
+        """A tesserocr whose APIs remember their settings"""
+        tesserocr = mock.Mock()
+        tesserocr.PyTessBaseAPI.side_effect = lambda init: mock.Mock()
+        return mock.patch.object(tessworker, 'tesserocr', tesserocr)
+
+    def test_load(self):
+        """Check that tesserocr is imported on first use"""
+        tesserocr = mock.Mock()
+        with mock.patch.object(tessworker, '_loaded', False), \
+                mock.patch.object(tessworker, 'tesserocr', None), \
+                mock.patch.object(tessworker, '_thread_limit', None), \
+                mock.patch.dict('sys.modules', tesserocr=tesserocr), \
+                mock.patch.dict(os.environ, OMP_THREAD_LIMIT='2'):
+            self.assertTrue(tessworker.available())
+            self.assertIs(tessworker.tesserocr, tesserocr)
+            self.assertEqual(tessworker._thread_limit, '2')
+
+    def test_thread_limit(self):
+        """Check that the API is not used past a changed thread limit"""
+        with self.fake_tesserocr(), \
+                mock.patch.object(tessworker, '_thread_limit', '2'), \
+                mock.patch.dict(os.environ, OMP_THREAD_LIMIT='2'):
+            self.assertTrue(tessworker.available())
+            os.environ['OMP_THREAD_LIMIT'] = '3'
+            self.assertFalse(tessworker.available())
+            del os.environ['OMP_THREAD_LIMIT']
+            self.assertFalse(tessworker.available())
+
+    def test_language(self):
+        """Check that languages are passed as tesseract expects them"""
+        self.assertEqual(tessworker._language(None), 'eng')
+        self.assertEqual(tessworker._language('deu'), 'deu')
+        self.assertEqual(tessworker._language(['deu', 'eng']), 'deu+eng')
+
+    def test_unavailable(self):
+        """Check that a missing tesserocr makes the caller fall back"""
+        with mock.patch.object(tessworker, 'tesserocr', None):
+            self.assertFalse(tessworker.available())
+            with self.assertRaises(tessworker.TesseractApiError):
+                tessworker.generate_hocr(
+                    'page.png', os.path.join(self.temp_dir, 'page.hocr'),
+                    ['eng'], [], 10, logging.getLogger('test_tessworker'))
+
+    def test_api_cached(self):
+        """Check that an API is reused for the same settings only"""
+        with self.fake_tesserocr():
+            api = tessworker.get_api(['deu'], 3)
+            self.assertIs(tessworker.get_api('deu', 3), api)
+            self.assertIsNot(tessworker.get_api('deu', 4), api)
+            self.assertIsNot(tessworker.get_api('deu', 3, purpose='pdf'),
+                             api)
+            api.InitFull.assert_called_once_with(lang='deu', configs=[])
+            api.SetPageSegMode.assert_called_once_with(3)
+
+    def test_api_per_thread(self):
+        """Check that threads never share an API"""
+        apis = []
+
+        def get():
+            apis.append(tessworker.get_api('eng'))
+
+        with self.fake_tesserocr():
+            get()
+            threads = [threading.Thread(target=get) for _ in range(3)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            get()
+        self.assertIs(apis[0], apis[-1])
+        self.assertEqual(len(set(map(id, apis))), 4)
+
+    def test_init_error(self):
+        """Check that a failing initialization is reported as API error"""
+        with self.fake_tesserocr() as tesserocr:
+            tesserocr.PyTessBaseAPI.side_effect = None
+            tesserocr.PyTessBaseAPI.return_value.InitFull.side_effect = \
+                RuntimeError("Failed loading language 'xyz'")
+            with self.assertRaises(tessworker.TesseractApiError):
+                tessworker.get_api('xyz', purpose='test_init_error')
@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of easydms.
+# Copyright (c) 2015 Peter Kessen
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject
+# to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+# OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4
+
+
+"""Test the worker slots shared by several OCR jobs."""
+
+from _common import TestCase
+import multiprocessing
+import os
+import pickle
+import threading
+import time
+import unittest
+
+import easydms.workerslots as workerslots
+
+
+def hold_slot(slots, held, release):
+    with slots.hold():
+        held.set()
+        release.wait(10)
+
+
+def wait_a_little(started):
+    started.set()
+    time.sleep(0.5)
+
+
+@unittest.skipIf(workerslots.fcntl is None, "no fcntl")
+class TestWorkerSlots(TestCase):
+    def setUp(self):
+        TestCase.setUp(self)
+        self.slots = workerslots.WorkerSlots(
+            os.path.join(self.temp_dir, 'slots'), 2)
+
+    def test_budget(self):
+        """Check that no more stages run at once than there are slots"""
+        lock = threading.Lock()
+        running = []
+        peak = []
+
+        def stage():
+            with self.slots.hold():
+                with lock:
+                    running.append(1)
+                    peak.append(len(running))
+                time.sleep(0.01)
+                with lock:
+                    running.pop()
+
+        threads = [threading.Thread(target=stage) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(peak), 8)
+        self.assertEqual(max(peak), 2)
+
+    def test_partial(self):
+        """Check that free slots are taken without waiting for more"""
+        with self.slots.hold() as held:
+            self.assertEqual(held, 1)
+            with self.slots.hold(3, least=0) as extra:
+                self.assertEqual(extra, 1)
+                with self.slots.hold(1, least=0) as none:
+                    self.assertEqual(none, 0)
+        with self.slots.hold(5) as held:
+            self.assertEqual(held, 2)
+
+    def test_released_on_error(self):
+        """Check that slots are freed when the block fails"""
+        with self.assertRaises(ValueError):
+            with self.slots.hold(2):
+                raise ValueError()
+        with self.slots.hold(2, least=0) as held:
+            self.assertEqual(held, 2)
+
+    def test_other_process(self):
+        """Check that slots are shared with worker processes"""
+        slots = pickle.loads(pickle.dumps(self.slots))
+        ctx = multiprocessing.get_context('fork')
+        held, release = ctx.Event(), ctx.Event()
+        worker = ctx.Process(target=hold_slot, args=(slots, held, release))
+        worker.start()
+        try:
+            self.assertTrue(held.wait(10))
+            with self.slots.hold(2, least=0) as free:
+                self.assertEqual(free, 1)
+        finally:
+            release.set()
+            worker.join()
+        with self.slots.hold(2, least=0) as free:
+            self.assertEqual(free, 2)
+
+    def test_fork_while_held(self):
+        """Check that a child forked while a slot is held does not keep it"""
+        ctx = multiprocessing.get_context('fork')
+        started = ctx.Event()
+        with self.slots.hold(2):
+            child = ctx.Process(target=wait_a_little, args=(started,))
+            child.start()
+        try:
+            self.assertTrue(started.wait(10))
+            with self.slots.hold(2, least=0) as free:
+                self.assertEqual(free, 2)
+        finally:
+            child.join()
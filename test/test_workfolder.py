@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of easydms.
+# Copyright (c) 2015 Peter Kessen
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject
+# to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+# OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4
+
+"""Test accounting and spilling of work folder space."""
+
+from _common import TestCase
+import os
+import pickle
+
+import easydms.workfolder
+from easydms.workfolder import SPILL_MIN_SIZE
+
+
+class TestWorkFolder(TestCase):
+    def setUp(self):
+        super(TestWorkFolder, self).setUp()
+        self.work = os.path.join(self.temp_dir, 'com.github.ocrmypdf.x')
+        self.spill = os.path.join(self.temp_dir, 'disk')
+        os.mkdir(self.work)
+
+    def _file(self, name, size):
+        path = os.path.join(self.work, name)
+        with open(path, 'wb') as f:
+            f.write(b'\0' * size)
+        return path
+
+    def test_peak_usage(self):
+        """Check that usage is accounted across instances"""
+        folder = easydms.workfolder.WorkFolder(self.work)
+        folder.account(self._file('000001.page.png', 1000))
+        clone = pickle.loads(pickle.dumps(folder))
+        clone.account([[self._file('000001.hocr', 200)], []])
+        self.assertEqual(folder.usage(), (1200, 1200))
+
+    def test_links_not_counted(self):
+        """Check that symbolic links and foreign files are not counted"""
+        folder = easydms.workfolder.WorkFolder(self.work)
+        target = self._file('000001.page.pdf', 1000)
+        link = os.path.join(self.work, '000001.ocr.page.pdf')
+        os.symlink(target, link)
+        folder.account([link, os.path.join(self.temp_dir, 'output.pdf')])
+        self.assertEqual(folder.usage(), (0, 0))
+
+    def test_spill(self):
+        """Check that large outputs move to disk when over quota"""
+        folder = easydms.workfolder.WorkFolder(
+            self.work, quota=SPILL_MIN_SIZE * 3, spill_dir=self.spill)
+        folder.account(self._file('000001.page.png', SPILL_MIN_SIZE * 2))
+        small = self._file('000002.hocr', 100)
+        large = self._file('000002.page.png', SPILL_MIN_SIZE * 2)
+        folder.account([small, large])
+
+        self.assertTrue(os.path.islink(large))
+        self.assertFalse(os.path.islink(small))
+        with open(large, 'rb') as f:
+            self.assertEqual(len(f.read()), SPILL_MIN_SIZE * 2)
+        current, peak = folder.usage()
+        self.assertEqual(current, SPILL_MIN_SIZE * 2 + 100)
+        self.assertEqual(peak, SPILL_MIN_SIZE * 4 + 100)
+
+        folder.remove_spill()
+        self.assertNotExists(folder.spill_path)
+
+    def test_reserve(self):
+        """Check that space is reserved before files are written"""
+        folder = easydms.workfolder.WorkFolder(self.work, quota=1000)
+        self.assertTrue(folder.reserve(800))
+        self.assertFalse(folder.reserve(300))
+        self.assertEqual(folder.usage()[0], 800)
+        folder.account(self._file('000001.batch.png', 600), reserved=800)
+        self.assertEqual(folder.usage(), (600, 800))
+        self.assertTrue(folder.reserve(300))
+
+    def test_reserve_spills(self):
+        """Check that reserving moves earlier files to disk to make room"""
+        folder = easydms.workfolder.WorkFolder(
+            self.work, quota=SPILL_MIN_SIZE * 3, spill_dir=self.spill)
+        large = self._file('000001.page.png', SPILL_MIN_SIZE * 2)
+        folder.account(large)
+        self.assertTrue(folder.reserve(SPILL_MIN_SIZE * 2))
+        self.assertTrue(os.path.islink(large))
+        self.assertEqual(folder.usage()[0], SPILL_MIN_SIZE * 2)
+        self.assertFalse(folder.reserve(SPILL_MIN_SIZE * 2))
+
+    def test_remove(self):
+        """Check that removed and moved files are no longer counted"""
+        folder = easydms.workfolder.WorkFolder(self.work)
+        first = self._file('000001.batch.png', 1000)
+        second = self._file('000002.batch.png', 500)
+        folder.account([first, second])
+        folder.remove(first)
+        self.assertNotExists(first)
+        self.assertEqual(folder.usage(), (500, 1500))
+        folder.release(second)
+        self.assertEqual(folder.usage(), (0, 1500))
+        folder.remove(first)
+        self.assertEqual(folder.usage(), (0, 1500))
+
+    def test_lock_folder(self):
+        """Check that a work folder can only be locked once at a time"""
+        lock = easydms.workfolder.lock_folder(self.work)
+        self.assertIsNotNone(lock)
+        if easydms.workfolder.fcntl is not None:
+            self.assertIsNone(easydms.workfolder.lock_folder(self.work))
+        lock.close()
+        again = easydms.workfolder.lock_folder(self.work)
+        self.assertIsNotNone(again)
+        again.close()
+
+    def test_remove_stale(self):
+        """Check that only old, unlocked folders are removed"""
+        old = os.path.join(self.temp_dir, 'old')
+        busy = os.path.join(self.temp_dir, 'busy')
+        for path in (old, busy):
+            os.mkdir(path)
+            os.utime(path, (0, 0))
+        lock = easydms.workfolder.lock_folder(busy)
+        os.utime(busy, (0, 0))
+        try:
+            removed = easydms.workfolder.remove_stale(self.temp_dir, 3600)
+        finally:
+            lock.close()
+        self.assertNotExists(old)
+        self.assertExists(self.work)
+        if easydms.workfolder.fcntl is not None:
+            self.assertEqual(removed, 1)
+            self.assertExists(busy)